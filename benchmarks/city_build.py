@@ -0,0 +1,121 @@
+import time
+import sql_queries
+from warehouse import connect, warehouse_type
+from benchmarks.results import TIME_COLUMNS, format_times, run_benchmark, runs, save_results
+
+# Scratch table the city dimension is built into, so the benchmark leaves the loaded city table alone
+BENCHMARK_TABLE = 'city_benchmark'
+
+# The city build before it became a single pass, which inserted one row per city and then updated every row with the
+# coordinates of a matching airport, kept as the baseline to compare against
+city_insert_before = ("""
+INSERT INTO {table} (c_id, c_name, c_state_code)
+SELECT city_id, min(city), min(state) from staging_airports
+where city_id is not null
+group by city_id
+""").format(table=BENCHMARK_TABLE)
+
+city_update_before = ("""
+update {table} set c_lat = lat, c_long = long
+from staging_airports
+where {table}.c_id = staging_airports.city_id
+""").format(table=BENCHMARK_TABLE)
+
+
+def city_builds():
+    """
+    Returns each version of the city build as the statements it runs, pointed at the scratch table. The current build is read
+    from sql_queries when it is called, since its design depends on the configured warehouse
+    """
+    return {
+        'insert+update': [city_insert_before, city_update_before],
+        'single pass': [sql_queries.city_table_insert.replace('INSERT INTO city ', 'INSERT INTO {} '.format(BENCHMARK_TABLE))]
+    }
+
+
+def table_size(conn, config, table):
+    """
+    Returns the rows in a table together with the space it takes up in the warehouse. PostgreSQL reports the size of the rows in the
+    table and the size left once VACUUM FULL has removed the dead row versions, and Redshift reports its size in 1 MB blocks
+    and the rows it stores, including deleted rows not yet vacuumed. DuckDB reports neither
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT count(*) FROM {}'.format(table))
+    size = {'rows': cur.fetchone()[0], 'size_mb': None, 'compacted_mb': None, 'stored_rows': None}
+    if warehouse_type(config) == 'postgres':
+        cur.execute("SELECT pg_relation_size('{}')".format(table))
+        size['size_mb'] = cur.fetchone()[0] / 1024 ** 2
+        # VACUUM cannot run inside a transaction
+        conn.commit()
+        conn.autocommit = True
+        cur.execute('VACUUM FULL {}'.format(table))
+        conn.autocommit = False
+        cur.execute("SELECT pg_relation_size('{}')".format(table))
+        size['compacted_mb'] = cur.fetchone()[0] / 1024 ** 2
+    elif warehouse_type(config) == 'redshift':
+        cur.execute('SELECT size, tbl_rows FROM svv_table_info WHERE "table" = \'{}\''.format(table))
+        size['size_mb'], size['stored_rows'] = cur.fetchone()
+    conn.commit()
+    return size
+
+def time_build(conn, statements):
+    """
+    Recreates the scratch city table empty, then runs and commits the statements of a build into it and returns how long they took
+    """
+    cur = conn.cursor()
+    cur.execute('DROP TABLE IF EXISTS {}'.format(BENCHMARK_TABLE))
+    cur.execute(sql_queries.city_table_create.replace('TABLE IF NOT EXISTS city ', 'TABLE IF NOT EXISTS {} '.format(BENCHMARK_TABLE)))
+    conn.commit()
+    start = time.time()
+    for statement in statements:
+        cur.execute(statement)
+    conn.commit()
+    return time.time() - start
+
+def run_city_build_benchmark(config, conn, runs):
+    """
+    Builds the city dimension from the loaded staging airports a number of times with each version of the build, returning
+    the build times and the rows and size of the table the last run left behind
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT count(*) FROM staging_airports')
+    if not cur.fetchone()[0]:
+        raise ValueError('staging_airports is empty, load the staging tables with etl.py before timing the city build')
+
+    results = {}
+    for version, statements in city_builds().items():
+        times = [time_build(conn, statements) for run in range(runs)]
+        results[version] = dict(table_size(conn, config, BENCHMARK_TABLE), times=times)
+    cur.execute('DROP TABLE IF EXISTS {}'.format(BENCHMARK_TABLE))
+    conn.commit()
+    return results
+
+def format_size(value, pattern):
+    """
+    Formats a size measurement, or n/a when the warehouse does not report it
+    """
+    return pattern.format(value) if value is not None else '{:>10}'.format('n/a')
+
+def report(config):
+    """
+    Times the city dimension build as an insert followed by an update against the single pass insert, printing and recording
+    the times together with the rows, size and bloat of the table each version leaves
+    """
+    conn = connect(config)
+    results = run_city_build_benchmark(config, conn, runs(config))
+    conn.close()
+
+    print('{:<14} {} {:>10} {:>10} {:>10} {:>10}'.format('build', TIME_COLUMNS, 'rows', 'size MB', 'vacuum MB', 'stored'))
+    for version, result in results.items():
+        print('{:<14} {} {:>10} {} {} {}'.format(version, format_times(result['times']), result['rows'],
+            format_size(result['size_mb'], '{:>10.2f}'), format_size(result['compacted_mb'], '{:>10.2f}'), format_size(result['stored_rows'], '{:>10}')))
+    save_results(config, {'warehouse': warehouse_type(config), 'city_build': results})
+
+def main():
+    """
+    Main program entry point to time the city dimension build before and after it became a single pass and record its table size
+    """
+    run_benchmark(report)
+
+if __name__ == "__main__":
+    main()
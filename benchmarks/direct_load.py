@@ -0,0 +1,87 @@
+import configparser
+import os
+import tempfile
+import time
+from dataprep import s3_client
+from staging_files import DIRECT_LOAD_KEYS, dataset_files, data_files, output_exists, uncompressed_size
+from etl import DIRECT_LOADS, direct_copy, direct_load_keys
+from warehouse import connect, warehouse_type
+from benchmarks.results import TIME_COLUMNS, format_times, run_benchmark, runs, save_results
+
+
+def s3_load(cur, config, key):
+    """
+    Loads a staging dataset through S3 by uploading its files and copying them into the staging table. Redshift runs its COPY from S3,
+    while a PostgreSQL stand-in, which cannot read from S3, downloads the files again and copies them over the connection
+    """
+    s3 = s3_client(config)
+    bucket = config['S3']['BUCKET']
+    files = dataset_files(config, key)
+    for path, s3_key in files:
+        s3.upload_file(path, bucket, s3_key)
+    if warehouse_type(config) == 'redshift':
+        cur.execute(DIRECT_LOADS[key][1])
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        downloaded = configparser.ConfigParser()
+        downloaded.read_dict(config)
+        downloaded.set('OUTPUT', 'FOLDER', folder)
+        for path, s3_key in files:
+            local = os.path.join(folder, os.path.relpath(path, config['OUTPUT']['FOLDER']))
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            s3.download_file(bucket, s3_key, local)
+        direct_copy(cur, downloaded, key)
+
+def time_load(conn, table, load):
+    """
+    Empties a staging table, then runs and commits a load into it and returns how long the load took
+    """
+    cur = conn.cursor()
+    cur.execute('TRUNCATE {}'.format(table))
+    conn.commit()
+    start = time.time()
+    load(cur)
+    conn.commit()
+    return time.time() - start
+
+def run_direct_load_benchmark(config, conn, runs):
+    """
+    Loads each small staging dataset a number of times directly over the connection and through S3, returning the load times,
+    the uncompressed size of the local files and the path etl.py picks
+    """
+    results = {}
+    for key in DIRECT_LOAD_KEYS:
+        if not output_exists(config, key):
+            continue
+        table = DIRECT_LOADS[key][0]
+        results[key] = {
+            'size_mb': sum(uncompressed_size(path) for path in data_files(config, key)) / 1024 ** 2,
+            'chosen': 'direct' if key in direct_load_keys(config) else 's3',
+            'direct': [time_load(conn, table, lambda cur: direct_copy(cur, config, key)) for run in range(runs)],
+            's3': [time_load(conn, table, lambda cur: s3_load(cur, config, key)) for run in range(runs)]
+        }
+    return results
+
+def report(config):
+    """
+    Times the direct load of each small staging dataset against its load through S3, printing and recording the times
+    """
+    conn = connect(config)
+    results = run_direct_load_benchmark(config, conn, runs(config))
+    conn.close()
+
+    print('{:<14} {:>9} {:<7} {} {:>7}'.format('dataset', 'size MB', 'path', TIME_COLUMNS, 'chosen'))
+    for key, result in results.items():
+        for path in ('direct', 's3'):
+            print('{:<14} {:>9.1f} {:<7} {} {:>7}'.format(key, result['size_mb'], path, format_times(result[path]), '*' if result['chosen'] == path else ''))
+    save_results(config, {'warehouse': warehouse_type(config), 'direct_load': results})
+
+def main():
+    """
+    Main program entry point to time the direct load of the small staging datasets against the load through S3 and record the times
+    """
+    run_benchmark(report)
+
+if __name__ == "__main__":
+    main()
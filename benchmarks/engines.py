@@ -0,0 +1,88 @@
+import configparser
+import os
+import tempfile
+import time
+import pandas as pd
+from dataprep import STAGES
+from staging_files import output_format, data_files
+from benchmarks.results import TIME_COLUMNS, format_times, run_benchmark, runs, save_results
+
+# The prep stages that have both a pandas and a Spark version
+ENGINE_STAGES = ('CITIES', 'AIRPORTS', 'TEMPERATURES')
+
+
+def engine_config(config, key, engine, folder):
+    """
+    Returns a copy of the config that runs a stage with the given engine and writes its output to the given folder
+    """
+    forced = configparser.ConfigParser()
+    forced.read_dict(config)
+    if not forced.has_section('ENGINE'):
+        forced.add_section('ENGINE')
+    forced.set('ENGINE', key, engine)
+    forced.set('OUTPUT', 'FOLDER', folder)
+    return forced
+
+def time_stage(config, key):
+    """
+    Runs a prep stage and returns how long it took
+    """
+    start = time.time()
+    STAGES[key](config)
+    return time.time() - start
+
+def read_output(config, key):
+    """
+    Reads a staging output back into pandas sorted on every column so outputs can be compared regardless of row order
+    """
+    df = pd.concat([pd.read_parquet(path) if output_format(config) == 'parquet' else pd.read_csv(path) for path in data_files(config, key)], ignore_index=True)
+    return df.sort_values(by=list(df.columns)).reset_index(drop=True)
+
+def outputs_match(left, right):
+    """
+    Returns whether two staging outputs hold the same rows, allowing for the last rounding digit of averaged values
+    """
+    try:
+        pd.testing.assert_frame_equal(left, right, check_dtype=False, atol=0.011)
+        return True
+    except AssertionError:
+        return False
+
+def run_engine_benchmark(config, runs):
+    """
+    Runs each prep stage with both pandas and Spark a number of times, returning the execution times,
+    the input size and whether both engines wrote the same output
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for key in ENGINE_STAGES:
+            outputs = {}
+            results[key] = {'input_mb': os.path.getsize(config['INPUT'][key]) / 1024 ** 2}
+            for engine in ('pandas', 'spark'):
+                forced = engine_config(config, key, engine, os.path.join(folder, engine))
+                os.makedirs(forced['OUTPUT']['FOLDER'], exist_ok=True)
+                results[key][engine] = [time_stage(forced, key) for run in range(runs)]
+                outputs[engine] = read_output(forced, key)
+            results[key]['matches'] = outputs_match(outputs['pandas'], outputs['spark'])
+    return results
+
+def report(config):
+    """
+    Runs the pandas and Spark versions of each prep stage, printing and recording their execution times and whether their outputs match
+    """
+    results = run_engine_benchmark(config, runs(config))
+
+    print('{:<14} {:>10} {:<8} {} {:>8}'.format('stage', 'input MB', 'engine', TIME_COLUMNS, 'matches'))
+    for key, result in results.items():
+        for engine in ('pandas', 'spark'):
+            print('{:<14} {:>10.1f} {:<8} {} {:>8}'.format(key, result['input_mb'], engine, format_times(result[engine]), str(result['matches'])))
+    save_results(config, {'engines': results})
+
+def main():
+    """
+    Main program entry point to run the pandas and Spark versions of each prep stage, check that their outputs match and record their execution times
+    """
+    run_benchmark(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import datetime
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Rows of each source at a scale factor of 1, kept small enough to run locally; every generator multiplies these by the scale
+BASE_ROWS = {
+    'CITIES': 600,
+    'AIRPORTS': 55000,
+    'TEMPERATURE_CITIES': 1000,
+    'TEMPERATURE_MONTHS': 240,
+    'TRAVELERS': 100000
+}
+
+STATES = [
+    ('Alabama', 'AL'), ('Alaska', 'AK'), ('Arizona', 'AZ'), ('Arkansas', 'AR'), ('California', 'CA'), ('Colorado', 'CO'),
+    ('Connecticut', 'CT'), ('Delaware', 'DE'), ('District of Columbia', 'DC'), ('Florida', 'FL'), ('Georgia', 'GA'),
+    ('Hawaii', 'HI'), ('Idaho', 'ID'), ('Illinois', 'IL'), ('Indiana', 'IN'), ('Iowa', 'IA'), ('Kansas', 'KS'),
+    ('Kentucky', 'KY'), ('Louisiana', 'LA'), ('Maine', 'ME'), ('Maryland', 'MD'), ('Massachusetts', 'MA'),
+    ('Michigan', 'MI'), ('Minnesota', 'MN'), ('Mississippi', 'MS'), ('Missouri', 'MO'), ('Montana', 'MT'),
+    ('Nebraska', 'NE'), ('Nevada', 'NV'), ('New Hampshire', 'NH'), ('New Jersey', 'NJ'), ('New Mexico', 'NM'),
+    ('New York', 'NY'), ('North Carolina', 'NC'), ('North Dakota', 'ND'), ('Ohio', 'OH'), ('Oklahoma', 'OK'),
+    ('Oregon', 'OR'), ('Pennsylvania', 'PA'), ('Rhode Island', 'RI'), ('South Carolina', 'SC'), ('South Dakota', 'SD'),
+    ('Tennessee', 'TN'), ('Texas', 'TX'), ('Utah', 'UT'), ('Vermont', 'VT'), ('Virginia', 'VA'), ('Washington', 'WA'),
+    ('West Virginia', 'WV'), ('Wisconsin', 'WI'), ('Wyoming', 'WY')
+]
+
+RACES = ['White', 'Hispanic or Latino', 'Asian', 'American Indian and Alaska Native', 'Black or African-American']
+
+# Countries other than the US with their continent codes, used for foreign airports and temperature cities
+COUNTRIES = [('CA', 'Canada', 'NA'), ('MX', 'Mexico', 'NA'), ('GB', 'United Kingdom', 'EU'), ('DE', 'Germany', 'EU'),
+             ('FR', 'France', 'EU'), ('BR', 'Brazil', 'SA'), ('AU', 'Australia', 'OC'), ('JP', 'Japan', 'AS'),
+             ('CN', 'China', 'AS'), ('IN', 'India', 'AS')]
+
+AIRPORT_TYPES = ['small_airport', 'heliport', 'closed', 'medium_airport', 'seaplane_base', 'balloonport', 'large_airport']
+AIRPORT_TYPE_WEIGHTS = [0.6, 0.2, 0.08, 0.07, 0.02, 0.02, 0.01]
+
+
+def us_cities(scale):
+    """
+    Return the names, states and locations of the US cities shared by the cities, airports and temperatures generators.
+    Locations come from their own fixed seed so every generator places a city at the same point
+    """
+    count = BASE_ROWS['CITIES'] * scale
+    states = [STATES[i % len(STATES)] for i in range(count)]
+    locations = np.random.default_rng(0)
+    return pd.DataFrame({
+        'City': ['City {:06d}'.format(i) for i in range(count)],
+        'State': [name for name, code in states],
+        'State Code': [code for name, code in states],
+        'Latitude': locations.uniform(20, 64, count),
+        'Longitude': locations.uniform(-159, -68, count)
+    })
+
+def generate_cities(path, scale, rng):
+    """
+    Write a demographics file with one row per city and race in the semicolon separated layout of us-cities-demographics.csv
+    """
+    cities = us_cities(scale)
+    count = len(cities)
+    population = rng.lognormal(11.5, 0.8, count).astype(int) + 65000
+    male = (population * rng.uniform(0.47, 0.51, count)).astype(int)
+    cities = cities.assign(**{
+        'Median Age': rng.uniform(25, 45, count).round(1),
+        'Male Population': male,
+        'Female Population': population - male,
+        'Total Population': population,
+        'Number of Veterans': (population * rng.uniform(0.02, 0.09, count)).astype(int),
+        'Foreign-born': (population * rng.uniform(0.03, 0.4, count)).astype(int),
+        'Average Household Size': rng.uniform(2, 3.5, count).round(2)
+    })
+
+    # As in the real file, a few cities do not report every race and only those have missing demographics
+    missing_race = rng.random(count) < 0.08
+    for column, share in [('Male Population', 0.01), ('Female Population', 0.01), ('Number of Veterans', 0.03),
+                          ('Foreign-born', 0.03), ('Average Household Size', 0.04)]:
+        cities[column] = cities[column].astype(float).mask(missing_race & (rng.random(count) < share / 0.08))
+
+    rows = cities.loc[cities.index.repeat(len(RACES))].reset_index(drop=True)
+    rows['Race'] = RACES * count
+    rows['Count'] = (rows['Total Population'] * rng.uniform(0.005, 0.7, len(rows))).astype(int)
+    dropped_race = np.repeat(rng.integers(0, len(RACES), count), len(RACES)) == np.tile(np.arange(len(RACES)), count)
+    rows = rows[~(np.repeat(missing_race, len(RACES)) & dropped_race)]
+
+    columns = ['City', 'State', 'Median Age', 'Male Population', 'Female Population', 'Total Population', 'Number of Veterans',
+               'Foreign-born', 'Average Household Size', 'State Code', 'Race', 'Count']
+    rows.sample(frac=1, random_state=rng).to_csv(path, sep=';', columns=columns, index=False, float_format='%g')
+
+def generate_airports(path, scale, rng):
+    """
+    Write an airports file in the layout of airport-codes_csv.csv, with US airports located in the generated cities
+    """
+    count = BASE_ROWS['AIRPORTS'] * scale
+    cities = us_cities(scale)
+    us = rng.random(count) < 0.4
+    city_index = rng.integers(0, len(cities), count)
+    country_index = rng.integers(0, len(COUNTRIES), count)
+
+    # Only a share of airports have an IATA code, each unique within the three letter space, plus a few bad values
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    codes = np.array([''.join(code) for code in np.array(np.meshgrid(letters, letters, letters)).T.reshape(-1, 3)])
+    has_code = np.flatnonzero(rng.random(count) < 0.16)[:len(codes)]
+    iata_code = np.full(count, None, dtype=object)
+    iata_code[has_code] = rng.permutation(codes)[:len(has_code)]
+    iata_code[rng.random(count) < 0.002] = rng.choice(['0', '-'])
+
+    # US airports lie within a few km of their city so temperature series can be matched to them by distance
+    longitude = np.where(us, cities['Longitude'].values[city_index] + rng.uniform(-0.2, 0.2, count), rng.uniform(-180, 180, count))
+    latitude = np.where(us, cities['Latitude'].values[city_index] + rng.uniform(-0.2, 0.2, count), rng.uniform(-60, 70, count))
+    df = pd.DataFrame({
+        'ident': ['A{:07d}'.format(i) for i in range(count)],
+        'type': rng.choice(AIRPORT_TYPES, count, p=AIRPORT_TYPE_WEIGHTS),
+        'name': ['Airport {}'.format(i) for i in range(count)],
+        'elevation_ft': pd.Series(rng.integers(-50, 9000, count)).astype(float).mask(rng.random(count) < 0.05),
+        'continent': np.where(us, 'NA', [COUNTRIES[i][2] for i in country_index]),
+        'iso_country': np.where(us, 'US', [COUNTRIES[i][0] for i in country_index]),
+        'iso_region': np.where(us, 'US-' + cities['State Code'].values[city_index], [COUNTRIES[i][0] + '-U-A' for i in country_index]),
+        'municipality': np.where(us, cities['City'].values[city_index], ['Town {}'.format(i) for i in range(count)]),
+        'gps_code': ['G{:05d}'.format(i) for i in range(count)],
+        'iata_code': iata_code,
+        'local_code': None,
+        'coordinates': ['{}, {}'.format(lon, lat) for lon, lat in zip(longitude, latitude)]
+    })
+    df.to_csv(path, index=False)
+
+def generate_temperatures(path, scale, rng):
+    """
+    Write a monthly temperature series per city in the layout of GlobalLandTemperaturesByCity.csv, covering US and foreign cities
+    """
+    count = BASE_ROWS['TEMPERATURE_CITIES'] * scale
+    months = BASE_ROWS['TEMPERATURE_MONTHS']
+    cities = us_cities(scale)
+    us_count = min(int(count * 0.4), len(cities))
+    country_index = rng.integers(0, len(COUNTRIES), count - us_count)
+    # As in the real file, US series are located on a grid point up to about 50 km from their city
+    latitude = np.concatenate([cities['Latitude'].values[:us_count] + rng.uniform(-0.4, 0.4, us_count), rng.uniform(-60, 70, count - us_count)])
+    longitude = np.concatenate([cities['Longitude'].values[:us_count] + rng.uniform(-0.4, 0.4, us_count), rng.uniform(-180, 180, count - us_count)])
+    temp_cities = pd.DataFrame({
+        'City': list(cities['City'].values[:us_count]) + ['Town {}'.format(i) for i in range(count - us_count)],
+        'Country': ['United States'] * us_count + [COUNTRIES[i][1] for i in country_index],
+        'Latitude': ['{:.2f}{}'.format(abs(lat), 'S' if lat < 0 else 'N') for lat in latitude],
+        'Longitude': ['{:.2f}{}'.format(abs(lon), 'W' if lon < 0 else 'E') for lon in longitude],
+        'base': 25 - np.abs(latitude) * 0.4
+    })
+
+    # Monthly dates ending in September 2013 like the real file, so the README queries on April 2013 find readings for every city
+    dates = pd.date_range(end='2013-09-01', periods=months, freq='MS')
+    rows = temp_cities.loc[temp_cities.index.repeat(months)].reset_index(drop=True)
+    rows['dt'] = np.tile(dates.strftime('%Y-%m-%d'), count)
+    season = np.cos((np.tile(dates.month, count) - 7) / 6 * np.pi) * np.sign(np.repeat(latitude, months))
+    rows['AverageTemperature'] = (rows['base'] + 10 * season + rng.normal(0, 2, len(rows))).round(3)
+    rows['AverageTemperatureUncertainty'] = rng.uniform(0.1, 3, len(rows)).round(3)
+
+    # Older readings are often missing in the real file
+    missing = rng.random(len(rows)) < 0.04
+    rows.loc[missing, ['AverageTemperature', 'AverageTemperatureUncertainty']] = np.nan
+
+    columns = ['dt', 'AverageTemperature', 'AverageTemperatureUncertainty', 'City', 'Country', 'Latitude', 'Longitude']
+    rows.to_csv(path, columns=columns, index=False)
+
+def generate_travelers(path, scale, rng, airports_path, month=4, year=2016):
+    """
+    Write a month of I94 arrivals with the SAS column names as CSV or Parquet, depending on the file extension, as a stand-in for the SAS files
+    """
+    count = BASE_ROWS['TRAVELERS'] * scale
+    airports = pd.read_csv(airports_path, usecols=['iso_country', 'iata_code'], dtype=str)
+    ports = airports.loc[(airports['iso_country'] == 'US') & airports['iata_code'].str.fullmatch('[A-Z]{3}', na=False), 'iata_code'].values
+
+    # Most arrivals use a known US airport, the rest use unknown ports or the XXX placeholder
+    port_choice = rng.random(count)
+    i94port = np.where(port_choice < 0.9, rng.choice(ports, count), np.where(port_choice < 0.95, 'XXX', rng.choice(['YYZ', 'ZZA', 'QQQ'], count)))
+
+    first_day = (datetime.date(year, month, 1) - datetime.date(1960, 1, 1)).days
+    days = pd.Period(year=year, month=month, freq='M').days_in_month
+    arrdate = first_day + rng.integers(0, days, count)
+    age = pd.Series(rng.integers(0, 90, count)).astype(float).mask(rng.random(count) < 0.01)
+    df = pd.DataFrame({
+        'cicid': np.arange(count, dtype=float) + 1,
+        'i94yr': float(year),
+        'i94mon': float(month),
+        'i94cit': rng.integers(100, 700, count).astype(float),
+        'i94res': rng.integers(100, 700, count).astype(float),
+        'i94port': i94port,
+        'arrdate': arrdate.astype(float),
+        'i94mode': rng.choice([1.0, 2.0, 3.0, 9.0], count, p=[0.95, 0.02, 0.02, 0.01]),
+        'i94addr': rng.choice([code for name, code in STATES], count),
+        'depdate': pd.Series(arrdate + rng.integers(1, 60, count)).astype(float).mask(rng.random(count) < 0.05),
+        'i94bir': age,
+        'i94visa': rng.choice([1.0, 2.0, 3.0], count, p=[0.15, 0.8, 0.05]),
+        'biryear': year - age,
+        'gender': pd.Series(rng.choice(['M', 'F', 'X'], count, p=[0.48, 0.48, 0.04])).mask(rng.random(count) < 0.1),
+        'airline': rng.choice(['AA', 'UA', 'DL', 'BA', 'LH', 'JL'], count),
+        'visatype': rng.choice(['WT', 'B2', 'WB', 'B1', 'F1'], count)
+    })
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+def generator_version(scale, seed):
+    """
+    Return what the generated data depends on, which is the scale, the seed and the source of the generators
+    """
+    with open(__file__, 'rb') as f:
+        return {'scale': scale, 'seed': seed, 'code': hashlib.sha256(f.read()).hexdigest()}
+
+def generate(folder, scale=1, seed=42, travelers_format='parquet'):
+    """
+    Write all four inputs for a scale factor into a folder and return the INPUT settings that point at them.
+    Files that already exist are kept when the folder was generated with the same scale, seed and generator code,
+    which always produce the same data, otherwise every file is written again
+    """
+    stamp = os.path.join(folder, 'generator.json')
+    version = generator_version(scale, seed)
+    previous = None
+    if os.path.exists(stamp):
+        with open(stamp) as f:
+            previous = json.load(f)
+    paths = {
+        'CITIES': os.path.join(folder, 'us-cities-demographics.csv'),
+        'AIRPORTS': os.path.join(folder, 'airport-codes_csv.csv'),
+        'TEMPERATURES': os.path.join(folder, 'GlobalLandTemperaturesByCity.csv'),
+        'TRAVELERS': os.path.join(folder, 'travelers', 'i94_apr16_sub.' + travelers_format)
+    }
+    if previous != version:
+        # Remove the files written for another version, including the travelers month in the other format
+        for path in list(paths.values())[:-1] + glob.glob(os.path.join(folder, 'travelers', 'i94_apr16_sub.*')):
+            if os.path.exists(path):
+                os.remove(path)
+    os.makedirs(os.path.join(folder, 'travelers'), exist_ok=True)
+
+    # Each source has its own generator seeded from the base seed so regenerating one file does not change the others
+    generators = {
+        'CITIES': lambda path, rng: generate_cities(path, scale, rng),
+        'AIRPORTS': lambda path, rng: generate_airports(path, scale, rng),
+        'TEMPERATURES': lambda path, rng: generate_temperatures(path, scale, rng),
+        'TRAVELERS': lambda path, rng: generate_travelers(path, scale, rng, paths['AIRPORTS'])
+    }
+    for offset, (key, generator) in enumerate(generators.items()):
+        if not os.path.exists(paths[key]):
+            generator(paths[key], np.random.default_rng(seed + offset))
+    with open(stamp, 'w') as f:
+        json.dump(version, f, indent=2, sort_keys=True)
+
+    return dict(paths, TRAVELERS=os.path.join(folder, 'travelers'))
+
+def main():
+    """
+    Main program entry point to generate the benchmark inputs for one scale factor
+    """
+    parser = argparse.ArgumentParser(description='Generate synthetic inputs for the dataprep stages')
+    parser.add_argument('--scale', type=int, default=1, help='Scale factor applied to the base row counts')
+    parser.add_argument('--seed', type=int, default=42, help='Seed for the random generators')
+    parser.add_argument('--travelers-format', choices=['csv', 'parquet'], default='parquet', help='Stand-in format for the I94 SAS file')
+    parser.add_argument('--folder', help='Folder to write to, by default benchmark_data/<scale>x')
+    args = parser.parse_args()
+
+    folder = args.folder or os.path.join('benchmark_data', '{}x'.format(args.scale))
+    for key, path in generate(folder, args.scale, args.seed, args.travelers_format).items():
+        print('{}={}'.format(key, path))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import configparser
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataprep import STAGES
+from sql_queries import analytics_queries
+from warehouse import connect
+from benchmarks.engines import time_stage
+from benchmarks.generators import generate
+from benchmarks.results import TIME_COLUMNS, format_times, run_benchmark, runs, save_results
+
+# Folder holding dataprep.py, create_tables.py and etl.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scripts run in order for the end-to-end pipeline, from the prep stages to the validated star schema
+PIPELINE_SCRIPTS = [['dataprep.py', '--force'], ['create_tables.py'], ['etl.py']]
+
+
+def git_commit():
+    """
+    Returns the current commit and whether the working tree has uncommitted changes, so results can be compared across commits
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain'], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+def scale_config(config, inputs, folder):
+    """
+    Returns a copy of the config that reads the generated inputs and writes every output, including a local DuckDB warehouse, to a work folder
+    """
+    scaled = configparser.ConfigParser()
+    scaled.read_dict(config)
+    for key, path in inputs.items():
+        scaled.set('INPUT', key, os.path.abspath(path))
+    scaled.set('INPUT', 'TRAVELERS_INCREMENTAL', 'false')
+    scaled.set('OUTPUT', 'FOLDER', os.path.join(folder, 'output_data'))
+    scaled.set('WAREHOUSE', 'TYPE', 'duckdb')
+    scaled.set('WAREHOUSE', 'DATABASE', os.path.join(folder, 'warehouse.duckdb'))
+    scaled.set('ETL', 'LOAD_MODE', 'full')
+    if not scaled.has_section('INSTRUMENTATION'):
+        scaled.add_section('INSTRUMENTATION')
+    scaled.set('INSTRUMENTATION', 'LOG', os.path.join(folder, 'pipeline_metrics.jsonl'))
+    os.makedirs(scaled['OUTPUT']['FOLDER'], exist_ok=True)
+    return scaled
+
+def time_stages(config, runs):
+    """
+    Runs each prep stage a number of times and returns the execution times, or the error of a stage that fails
+    """
+    results = {}
+    for key in STAGES:
+        try:
+            results[key] = {'times': [time_stage(config, key) for run in range(runs)]}
+        except Exception as exc:
+            results[key] = {'error': str(exc)}
+    return results
+
+def time_pipeline(config, folder, runs):
+    """
+    Runs dataprep.py, create_tables.py and etl.py against the work folder a number of times, returning the execution times
+    and the steps that failed according to the run metrics
+    """
+    with open(os.path.join(folder, 'config.cfg'), 'w') as f:
+        config.write(f)
+    metrics = config['INSTRUMENTATION']['LOG']
+
+    times = []
+    failed = set()
+    for run in range(runs):
+        offset = os.path.getsize(metrics) if os.path.exists(metrics) else 0
+        start = time.time()
+        for script in PIPELINE_SCRIPTS:
+            subprocess.run([sys.executable, os.path.join(ROOT, script[0])] + script[1:], cwd=folder, capture_output=True, check=True)
+        times.append(time.time() - start)
+
+        # The scripts report errors rather than exiting, so failed steps are read back from the metrics they recorded
+        if os.path.exists(metrics):
+            with open(metrics) as f:
+                f.seek(offset)
+                failed.update(record['step'] for record in map(json.loads, f) if record['status'] == 'failed')
+    return {'times': times, 'failed_steps': sorted(failed)}
+
+def query_rows(config):
+    """
+    Returns the number of rows each README analytics query returns from the warehouse loaded by the pipeline, so a benchmark
+    whose generated data leaves a query empty is reported
+    """
+    conn = connect(config)
+    cur = conn.cursor()
+    rows = {}
+    for name, query in analytics_queries.items():
+        cur.execute(query)
+        rows[name] = len(cur.fetchall())
+    conn.close()
+    return rows
+
+def run_pipeline_benchmark(config, scale, runs):
+    """
+    Generates the inputs for a scale factor and times each prep stage and the end-to-end pipeline on them, then counts the rows
+    the analytics queries return from the loaded warehouse
+    """
+    travelers_format = config.get('BENCHMARK', 'TRAVELERS_FORMAT', fallback='parquet')
+    seed = config.getint('BENCHMARK', 'SEED', fallback=42)
+    inputs = generate(os.path.join(config.get('BENCHMARK', 'DATA', fallback='benchmark_data'), '{}x'.format(scale)), scale, seed, travelers_format)
+    with tempfile.TemporaryDirectory() as folder:
+        scaled = scale_config(config, inputs, folder)
+        result = {
+            'scale': scale,
+            'seed': seed,
+            'travelers_format': travelers_format,
+            'input_mb': {key: sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(path) for f in files) / 1024 ** 2
+                         if os.path.isdir(path) else os.path.getsize(path) / 1024 ** 2 for key, path in inputs.items()},
+            'stages': time_stages(scaled, runs),
+            'end_to_end': time_pipeline(scaled, folder, runs)
+        }
+        return dict(result, query_rows=query_rows(scaled))
+
+def previous_result(path, scale, commit):
+    """
+    Returns the most recent stored result for a scale factor from a different commit, if there is one
+    """
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path) as f:
+        for record in map(json.loads, f):
+            if record.get('scale') == scale and 'end_to_end' in record and record.get('commit') != commit:
+                previous = record
+    return previous
+
+def report(config):
+    """
+    Times the prep stages and the end-to-end pipeline at each configured scale factor, printing the change from the last
+    stored run from another commit and recording the results
+    """
+    path = config.get('BENCHMARK', 'RESULTS', fallback='benchmark_results.jsonl')
+    commit, dirty = git_commit()
+
+    print('{:<6} {:<14} {} {:>10} {:>9}'.format('scale', 'step', TIME_COLUMNS, 'previous', 'change'))
+    for scale in [int(scale) for scale in config.get('BENCHMARK', 'SCALES', fallback='1,10,100').split(',')]:
+        result = dict(run_pipeline_benchmark(config, scale, runs(config)), commit=commit, dirty=dirty)
+        previous = previous_result(path, scale, commit)
+        save_results(config, result)
+
+        steps = dict(result['stages'], PIPELINE=result['end_to_end'])
+        previous_steps = dict(previous['stages'], PIPELINE=previous['end_to_end']) if previous else {}
+        for name, step in steps.items():
+            if 'error' in step:
+                print('{:<6} {:<14} failed: {}'.format(scale, name, step['error'].splitlines()[0]))
+                continue
+            times = step['times']
+            before = previous_steps.get(name, {}).get('times')
+            change = '{:+.1f}%'.format((statistics.median(times) / statistics.median(before) - 1) * 100) if before else ''
+            print('{:<6} {:<14} {} {:>10} {:>9}'.format(scale, name, format_times(times),
+                  '{:.3f}s'.format(statistics.median(before)) if before else '', change))
+        if result['end_to_end']['failed_steps']:
+            print('{:<6} failed pipeline steps: {}'.format(scale, ', '.join(result['end_to_end']['failed_steps'])))
+        empty = [name for name, rows in result['query_rows'].items() if not rows]
+        if empty:
+            print('{:<6} queries returned no rows: {}'.format(scale, ', '.join(empty)))
+
+def main():
+    """
+    Main program entry point to time the prep stages and the end-to-end pipeline at each configured scale factor,
+    comparing against the last stored run from another commit
+    """
+    run_benchmark(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import time
+from sql_queries import analytics_queries, fact_analytics_queries, WAREHOUSE
+from warehouse import connect
+from benchmarks.results import TIME_COLUMNS, format_times, run_benchmark, runs, save_results
+
+
+def time_query(cur, query):
+    """
+    Executes a query, fetching all of its rows, and returns how long it took along with the rows
+    """
+    start = time.time()
+    cur.execute(query)
+    rows = cur.fetchall()
+    return time.time() - start, rows
+
+def run_query_benchmark(conn, runs):
+    """
+    Runs each README analytics query against both the aggregate tables and the travelers fact table a number of times,
+    returning the execution times, the rows returned and whether both versions returned the same rows
+    """
+    cur = conn.cursor()
+
+    # Redshift caches results between identical queries so turn that off to measure the execution itself
+    if WAREHOUSE == 'redshift':
+        cur.execute('SET enable_result_cache_for_session TO off')
+
+    results = {}
+    for name, query in analytics_queries.items():
+        aggregate_runs = [time_query(cur, query) for run in range(runs)]
+        fact_runs = [time_query(cur, fact_analytics_queries[name]) for run in range(runs)]
+        conn.commit()
+        results[name] = {
+            'aggregate': [elapsed for elapsed, rows in aggregate_runs],
+            'fact': [elapsed for elapsed, rows in fact_runs],
+            'rows': len(aggregate_runs[0][1]),
+            'matches': sorted(map(tuple, aggregate_runs[0][1]), key=repr) == sorted(map(tuple, fact_runs[0][1]), key=repr)
+        }
+    return results
+
+def report(config):
+    """
+    Runs the analytics queries against the configured warehouse, printing and recording their execution times.
+    A query that returns no rows is reported, since its timing does not reflect the work of a real result
+    """
+    conn = connect(config)
+    results = run_query_benchmark(conn, runs(config))
+    conn.close()
+
+    print('{:<28} {:<10} {} {:>8} {:>8}'.format('query', 'source', TIME_COLUMNS, 'rows', 'matches'))
+    for name, result in results.items():
+        for source in ('aggregate', 'fact'):
+            print('{:<28} {:<10} {} {:>8} {:>8}'.format(name, source, format_times(result[source]), result['rows'], str(result['matches'])))
+    empty = [name for name, result in results.items() if not result['rows']]
+    if empty:
+        print('Queries returned no rows: {}'.format(', '.join(empty)))
+    save_results(config, {'warehouse': WAREHOUSE, 'queries': results})
+
+def main():
+    """
+    Main program entry point to run the analytics queries against the configured warehouse and record their execution times
+    """
+    run_benchmark(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import configparser
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from dataprep import INPUT_SCHEMAS, read_input, prep_temperature_data
+from instrumentation import peak_rss_mb
+from benchmarks.generators import BASE_ROWS, generate
+from benchmarks.results import TIME_COLUMNS, format_times, run_benchmark, runs, save_results
+
+
+def time_read(read):
+    """
+    Reads an input with the given function and returns how long it took along with the memory held by the dataframe
+    """
+    start = time.time()
+    df = read()
+    elapsed = time.time() - start
+    return elapsed, int(df.memory_usage(deep=True).sum())
+
+def run_reader_benchmark(config, runs):
+    """
+    Reads each pandas input a number of times with default type inference and with its INPUT_SCHEMAS entry,
+    returning the read times and the dataframe memory of both versions
+    """
+    results = {}
+    for key, schema in INPUT_SCHEMAS.items():
+        sep = schema.get('sep', ',')
+        default_runs = [time_read(lambda: pd.read_csv(config['INPUT'][key], sep=sep)) for run in range(runs)]
+        typed_runs = [time_read(lambda: read_input(config, key)) for run in range(runs)]
+        results[key] = {
+            'default': {'times': [elapsed for elapsed, memory in default_runs], 'memory': default_runs[0][1]},
+            'typed': {'times': [elapsed for elapsed, memory in typed_runs], 'memory': typed_runs[0][1]}
+        }
+    return results
+
+def temperature_stage_memory(sections, chunksize):
+    """
+    Runs the pandas temperature stage with a chunk size, 0 reading the whole file at once, and returns how long it took along
+    with the peak RSS of the process. Without a chunk size only the imports are measured, as the baseline of every run
+    """
+    config = configparser.ConfigParser()
+    config.read_dict(sections)
+    start = time.time()
+    if chunksize is not None:
+        config.set('INPUT', 'TEMPERATURES_CHUNKSIZE', str(chunksize))
+        prep_temperature_data(config)
+    return time.time() - start, peak_rss_mb()
+
+def in_new_process(sections, chunksize):
+    """
+    Runs temperature_stage_memory in a process of its own, since the peak RSS of a process only ever goes up
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(temperature_stage_memory, sections, chunksize).result()
+
+def run_temperature_memory_benchmark(config, rows, runs):
+    """
+    Generates a temperature file of at least a number of rows and runs the temperature stage on it a number of times reading the
+    whole file at once and streaming it in TEMPERATURES_CHUNKSIZE chunks, returning the times and peak RSS of both versions
+    """
+    scale = math.ceil(rows / (BASE_ROWS['TEMPERATURE_CITIES'] * BASE_ROWS['TEMPERATURE_MONTHS']))
+    seed = config.getint('BENCHMARK', 'SEED', fallback=42)
+    inputs = generate(os.path.join(config.get('BENCHMARK', 'DATA', fallback='benchmark_data'), '{}x'.format(scale)), scale, seed,
+                      config.get('BENCHMARK', 'TRAVELERS_FORMAT', fallback='parquet'))
+    chunksize = config.getint('INPUT', 'TEMPERATURES_CHUNKSIZE', fallback=0) or 1000000
+
+    with tempfile.TemporaryDirectory() as folder:
+        sections = {section: dict(config[section]) for section in config.sections()}
+        sections['INPUT'].update(airports=os.path.abspath(inputs['AIRPORTS']), temperatures=os.path.abspath(inputs['TEMPERATURES']))
+        sections['OUTPUT']['folder'] = folder
+        sections.setdefault('ENGINE', {})['temperatures'] = 'pandas'
+        results = {
+            'rows': scale * BASE_ROWS['TEMPERATURE_CITIES'] * BASE_ROWS['TEMPERATURE_MONTHS'],
+            'input_mb': os.path.getsize(inputs['TEMPERATURES']) / 1024 ** 2,
+            'chunksize': chunksize,
+            'baseline_mb': in_new_process(sections, None)[1]
+        }
+        for name, size in (('in_memory', 0), ('streaming', chunksize)):
+            version_runs = [in_new_process(sections, size) for run in range(runs)]
+            results[name] = {'times': [elapsed for elapsed, peak in version_runs], 'peak_mb': max(peak for elapsed, peak in version_runs)}
+    return results
+
+def report(config):
+    """
+    Reads the pandas inputs with and without their declared schemas, then runs the temperature stage on a generated file of
+    BENCHMARK TEMPERATURE_ROWS rows in memory and streamed, printing and recording the time and memory used
+    """
+    results = run_reader_benchmark(config, runs(config))
+
+    print('{:<14} {:<8} {} {:>12}'.format('input', 'reader', TIME_COLUMNS, 'memory MB'))
+    for key, result in results.items():
+        for reader in ('default', 'typed'):
+            print('{:<14} {:<8} {} {:>12.1f}'.format(key, reader, format_times(result[reader]['times']), result[reader]['memory'] / 1024 ** 2))
+
+    temperatures = run_temperature_memory_benchmark(config, config.getint('BENCHMARK', 'TEMPERATURE_ROWS', fallback=5000000), runs(config))
+    print('\nTemperature stage on {:,} rows ({:.0f} MB), peak RSS above the {:.0f} MB of a process that only imports the stage'.format(
+        temperatures['rows'], temperatures['input_mb'], temperatures['baseline_mb']))
+    print('{:<24} {} {:>12}'.format('version', TIME_COLUMNS, 'peak MB'))
+    for name, label in (('in_memory', 'in memory'), ('streaming', 'chunks of {:,}'.format(temperatures['chunksize']))):
+        print('{:<24} {} {:>12.1f}'.format(label, format_times(temperatures[name]['times']), temperatures[name]['peak_mb'] - temperatures['baseline_mb']))
+    save_results(config, {'readers': results, 'temperature_memory': temperatures})
+
+def main():
+    """
+    Main program entry point to read the pandas inputs with and without their declared schemas, and run the temperature stage
+    in memory and streamed, recording the time and memory used
+    """
+    run_benchmark(report)
+
+if __name__ == "__main__":
+    main()
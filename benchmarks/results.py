@@ -0,0 +1,44 @@
+import configparser
+import datetime
+import json
+import statistics
+
+# Header of the min, median and max columns printed for every timed step
+TIME_COLUMNS = '{:>10} {:>10} {:>10}'.format('min', 'median', 'max')
+
+
+def load_config(path='config.cfg'):
+    """
+    Reads the config of the pipeline, which also holds the BENCHMARK settings
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+def runs(config):
+    """
+    Returns the number of times each benchmark step is repeated
+    """
+    return config.getint('BENCHMARK', 'RUNS', fallback=5)
+
+def format_times(times):
+    """
+    Formats the min, median and max of a list of times in seconds to line up with TIME_COLUMNS
+    """
+    return '{:>9.3f}s {:>9.3f}s {:>9.3f}s'.format(min(times), statistics.median(times), max(times))
+
+def save_results(config, result):
+    """
+    Appends a benchmark run to BENCHMARK RESULTS as a JSON line with the time it was recorded, so runs can be compared over time
+    """
+    with open(config.get('BENCHMARK', 'RESULTS', fallback='benchmark_results.jsonl'), 'a') as f:
+        f.write(json.dumps(dict(result, timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat())) + '\n')
+
+def run_benchmark(report):
+    """
+    Runs a benchmark's report with the config read from config.cfg, printing any error the way the pipeline scripts do
+    """
+    try:
+        report(load_config())
+    except Exception as exc:
+        print('Unexpected error running program: {}'.format(exc))
@@ -0,0 +1,193 @@
+import datetime
+import math
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import pyspark.sql.functions as F
+import pyspark.sql.types as T
+from dataprep import INPUT_SCHEMAS, RACES, race_columns, transform_airports, with_arrival_date_parts
+from spark_session import spark_session
+from benchmarks.generators import BASE_ROWS, generate_airports, generate_cities
+from benchmarks.results import TIME_COLUMNS, format_times, run_benchmark, runs, save_results
+
+
+def with_arrival_date_parts_udf(df):
+    """
+    The arrival date conversion the travelers stage used before with_arrival_date_parts, a Python UDF adding the days to
+    1960-01-01 followed by formatting each part as a string, kept as the baseline to compare against
+    """
+    start_date = datetime.datetime(1960, 1, 1)
+    convert_sas_date = F.udf(lambda x: start_date + datetime.timedelta(days = int(x)) if x is not None else None, T.DateType())
+    df = df.withColumn('arrival_date', convert_sas_date('arrival_date'))
+    for name, pattern in (('arrival_year', 'y'), ('arrival_month', 'M'), ('arrival_day', 'd')):
+        df = df.withColumn(name, F.date_format(F.col('arrival_date'), pattern).cast('int'))
+    return df.drop('arrival_date')
+
+def arrival_dates(spark, rows):
+    """
+    Returns a Spark dataframe of SAS arrival dates spread over about eight years from 2012, with one in a hundred missing as in the I94 files
+    """
+    return spark.range(rows).selectExpr('case when id % 100 = 0 then null else cast(19000 + id % 3000 as double) end as arrival_date')
+
+def time_spark(df):
+    """
+    Computes every row of a Spark dataframe without collecting or writing it and returns how long it took
+    """
+    start = time.time()
+    df.write.format('noop').mode('overwrite').save()
+    return time.time() - start
+
+def run_arrival_date_benchmark(spark, rows, runs):
+    """
+    Converts a number of SAS arrival dates a number of times with the Python UDF and with the native Spark expressions,
+    returning the execution times of both versions
+    """
+    df = arrival_dates(spark, rows).cache()
+    df.count()
+    results = {
+        'udf': [time_spark(with_arrival_date_parts_udf(df)) for run in range(runs)],
+        'native': [time_spark(with_arrival_date_parts(df)) for run in range(runs)]
+    }
+    df.unpersist()
+    return results
+
+def transform_airports_before(airportcodes):
+    """
+    The airports transform before transform_airports, which filtered to US airports after splitting the coordinates of every
+    airport with a code and formatted the coordinates row by row with DataFrame.apply, kept as the baseline to compare against
+    """
+    # Drop null IATA code columns and filter additional bad values
+    majorairports = airportcodes[airportcodes.iata_code.notnull()]
+    majorairports = majorairports[majorairports.iata_code != '0']
+    majorairports = majorairports[majorairports.iata_code != '-']
+
+    # Reduce the number of columns
+    clean_airports = majorairports.filter(['iata_code', 'type', 'name', 'elevation_ft', 'continent', 'iso_country', 'iso_region', 'municipality','coordinates'], axis=1)
+
+    # Convert coordinates to latitude and longitude separate columns
+    clean_airports[['long', 'lat']] = clean_airports["coordinates"].str.split(pat=",", expand=True)
+    clean_airports = clean_airports.drop('coordinates', axis=1)
+
+    # Drop any non-US based data from airports
+    clean_airports['iso_country'] = clean_airports['iso_country'].astype(str)
+    clean_airports = clean_airports[(clean_airports['iso_country']=="US")]
+
+    # Split up the data for iso_region to get state values
+    clean_airports[['country', 'state']] = clean_airports["iso_region"].str.split(pat="-", expand=True)
+
+    # Drop unused columns and rename others
+    clean_airports = clean_airports.drop(columns=['continent','iso_country','iso_region','country'])
+    clean_airports = clean_airports.rename(columns={"municipality": "city"})
+    clean_airports = clean_airports.sort_values(by=['city'], ascending=False)
+
+    # Convert the data in the columns to specific types
+    convert_dict = {'iata_code': str, 'type': str, 'name': str, 'city': str, 'lat': float, 'long': float, 'state': str}
+    final_airports = clean_airports.astype(convert_dict)
+
+    # Round data appropriately
+    final_airports = final_airports.round({'lat': 2,'long':2})
+
+    # Format latitude/longitude into relevant N/S or E/W rather than negative numbers
+    final_airports["long"] = final_airports.apply(lambda x: f"{abs(x['long'])}W" if x['long'] < 0 else f"{x['long']}E", axis=1)
+    final_airports["lat"] = final_airports.apply(lambda x: f"{abs(x['lat'])}S" if x['lat'] < 0 else f"{x['lat']}N", axis=1)
+    return final_airports
+
+def time_pandas(transform):
+    """
+    Runs a pandas transform, including the read of its input, and returns how long it took
+    """
+    start = time.time()
+    transform()
+    return time.time() - start
+
+def run_airports_benchmark(rows, runs, seed=42):
+    """
+    Generates an airports file of at least a number of rows and reads and transforms it a number of times with the row by row
+    baseline, which read the file with default type inference, and with transform_airports on the typed reader, returning
+    the execution times of both versions and the rows in the file
+    """
+    scale = math.ceil(rows / BASE_ROWS['AIRPORTS'])
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'airport-codes_csv.csv')
+        generate_airports(path, scale, np.random.default_rng(seed))
+        return {
+            'rows': scale * BASE_ROWS['AIRPORTS'],
+            'before': [time_pandas(lambda: transform_airports_before(pd.read_csv(path))) for run in range(runs)],
+            'after': [time_pandas(lambda: transform_airports(pd.read_csv(path, **INPUT_SCHEMAS['AIRPORTS']))) for run in range(runs)]
+        }
+
+def race_columns_before(citiesdf):
+    """
+    The race reshape before race_columns, which merged the count of each race into the demographics rows one race at a time
+    and only collapsed the rows to one per city at the end, kept as the baseline to compare against
+    """
+    citiesracesdf = citiesdf[['City', 'State','Race','Count']]
+    mergedcities = citiesdf
+    for race in RACES:
+        # Merge a count and percent column for each race into the main dataframe
+        racedf = citiesracesdf[citiesracesdf['Race'] == f"{race}"]
+        racedf = racedf.rename(columns = {'Count': f"{race} Count"}, inplace=False)
+        racedf = racedf.drop(['Race'], axis=1)
+        mergedcities = mergedcities.merge(racedf, on=['City', 'State'])
+        mergedcities[f"Percent {race}"] = mergedcities[f"{race} Count"] / mergedcities['Total Population']
+    return mergedcities.drop_duplicates(subset=["City", "State"])
+
+def run_cities_benchmark(cities, runs, seed=42):
+    """
+    Generates a demographics file for each of a list of city counts and reshapes its race rows a number of times with the
+    merge per race baseline and with race_columns, returning the execution times of both versions and the rows in each file
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for count in cities:
+            path = os.path.join(folder, 'us-cities-demographics.csv')
+            generate_cities(path, math.ceil(count / BASE_ROWS['CITIES']), np.random.default_rng(seed))
+            citiesdf = pd.read_csv(path, **INPUT_SCHEMAS['CITIES']).sort_values(by=['State','City'])
+            results['cities_{}'.format(count)] = {
+                'rows': len(citiesdf),
+                'before': [time_pandas(lambda: race_columns_before(citiesdf)) for run in range(runs)],
+                'after': [time_pandas(lambda: race_columns(citiesdf)) for run in range(runs)]
+            }
+    return results
+
+def report(config):
+    """
+    Times the airports and travelers transforms on BENCHMARK TRANSFORM_ROWS synthetic rows and the cities race reshape for
+    each of BENCHMARK CITY_COUNTS before and after their rewrite, printing and recording the times and the rows per second
+    """
+    rows = config.getint('BENCHMARK', 'TRANSFORM_ROWS', fallback=10000000)
+    seed = config.getint('BENCHMARK', 'SEED', fallback=42)
+    cities = [int(count) for count in config.get('BENCHMARK', 'CITY_COUNTS', fallback='10000,100000,1000000').split(',')]
+    cases = {
+        'airports': lambda: {'airports': run_airports_benchmark(rows, runs(config), seed)},
+        'cities': lambda: run_cities_benchmark(cities, runs(config), seed),
+        'arrival_date': lambda: {'arrival_date': dict(run_arrival_date_benchmark(spark_session(config), rows, runs(config)), rows=rows)}
+    }
+    results = {}
+    for name, case in cases.items():
+        try:
+            results.update(case())
+        except Exception as exc:
+            results[name] = {'error': str(exc)}
+
+    print('{:<16} {:<8} {} {:>14}'.format('transform', 'version', TIME_COLUMNS, 'rows/s'))
+    for name, result in results.items():
+        if 'error' in result:
+            print('{:<16} failed: {}'.format(name, result['error'].splitlines()[0]))
+            continue
+        for version, times in result.items():
+            if version != 'rows':
+                print('{:<16} {:<8} {} {:>14,.0f}'.format(name, version, format_times(times), result['rows'] / statistics.median(times)))
+    save_results(config, {'transforms': results})
+
+def main():
+    """
+    Main program entry point to time the airports, cities and travelers transforms before and after their rewrite and record the times
+    """
+    run_benchmark(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import configparser
+import contextlib
+import io
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from dataprep import load_manifest, save_manifest, upload_to_s3
+from staging_files import output_path
+from benchmarks.results import TIME_COLUMNS, format_times, run_benchmark, runs, save_results
+
+
+def upload_config(config, folder):
+    """
+    Returns a copy of the config that uploads a travelers folder of generated files from a work folder to a benchmark_uploads
+    folder under S3 FOLDER, away from the keys the staging COPY statements read
+    """
+    uploads = configparser.ConfigParser()
+    uploads.read_dict(config)
+    uploads.set('OUTPUT', 'FOLDER', folder)
+    uploads.set('OUTPUT', 'FORMAT', 'csv')
+    uploads.set('OUTPUT', 'SPLIT', 'false')
+    uploads.set('S3', 'FOLDER', config['S3']['FOLDER'] + '/benchmark_uploads')
+    return uploads
+
+def upload_files(config, keys=('TRAVELERS',)):
+    """
+    Runs the pipeline upload of the travelers folder without printing its summary line and returns how long it took
+    """
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        upload_to_s3(config, keys)
+    return time.time() - start
+
+def parse_file_sets(value):
+    """
+    Parses BENCHMARK UPLOAD_FILES, a comma separated list of <count>x<size MB> file sets such as 64x1,8x16
+    """
+    return [(int(count), float(size)) for count, size in (item.strip().split('x') for item in value.split(','))]
+
+def run_upload_benchmark(config, file_sets, runs):
+    """
+    Uploads each set of a number of random files of a size a number of times through upload_to_s3, which hashes the files and
+    uploads them concurrently with the configured multipart settings, returning the upload times. Every file is uploaded on each
+    run, and the files of a set are removed from the bucket through the stale key cleanup before the next set
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        uploads = upload_config(config, folder)
+        travelers = output_path(uploads, 'TRAVELERS')
+        for count, size_mb in file_sets:
+            os.makedirs(travelers)
+            for i in range(count):
+                with open(os.path.join(travelers, 'part-{:05d}.csv.gz'.format(i)), 'wb') as f:
+                    f.write(os.urandom(int(size_mb * 1024 * 1024)))
+
+            # Clearing the recorded hashes makes every file look changed without losing track of the keys to remove afterwards
+            times = []
+            for run in range(runs):
+                save_manifest(uploads, dict.fromkeys(load_manifest(uploads), ''))
+                times.append(upload_files(uploads))
+            results['{}x{:g}'.format(count, size_mb)] = {'count': count, 'size_mb': size_mb, 'times': times}
+
+            shutil.rmtree(travelers)
+            os.makedirs(travelers)
+            upload_files(uploads)
+            os.rmdir(travelers)
+    return results
+
+def report(config):
+    """
+    Times the S3 upload of each BENCHMARK UPLOAD_FILES set of files, printing and recording the times and the throughput
+    """
+    results = run_upload_benchmark(config, parse_file_sets(config.get('BENCHMARK', 'UPLOAD_FILES', fallback='64x1,8x16,1x128,4x128')), runs(config))
+
+    print('{:>6} {:>9} {} {:>10}'.format('files', 'MB each', TIME_COLUMNS, 'MB/s'))
+    for result in results.values():
+        print('{:>6} {:>9g} {} {:>10.1f}'.format(result['count'], result['size_mb'], format_times(result['times']),
+              result['count'] * result['size_mb'] / statistics.median(result['times'])))
+    save_results(config, {'uploads': results, 'upload_workers': config.getint('S3', 'UPLOAD_WORKERS', fallback=8),
+                          'multipart_threshold_mb': config.getint('S3', 'MULTIPART_THRESHOLD_MB', fallback=16),
+                          'multipart_chunksize_mb': config.getint('S3', 'MULTIPART_CHUNKSIZE_MB', fallback=16)})
+
+def main():
+    """
+    Main program entry point to time the S3 upload of sets of files of different sizes and counts and record the throughput
+    """
+    run_benchmark(report)
+
+if __name__ == "__main__":
+    main()
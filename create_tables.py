@@ -1,19 +1,19 @@
 import configparser
-import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from sql_queries import create_table_queries, drop_table_queries, staging_drop_table_queries
+from warehouse import connect
 
 
-def drop_tables(cur, conn):
+def drop_tables(cur, conn, queries=drop_table_queries):
     """
     Drops tables listed in `drop_table_queries` collection.
     """
-    for query in drop_table_queries:
+    for query in queries:
         try:
             cur.execute(query)
             conn.commit()
         except Exception as exc:
             print('Unexpected error running drop query: {} {}'.format(query, exc))
-            cur.execute('rollback')
+            conn.rollback()
 
 def create_tables(cur, conn):
     """
@@ -25,21 +25,25 @@ def create_tables(cur, conn):
             conn.commit()
         except Exception as exc:
             print('Unexpected error running create query: {} {}'.format(query, exc))
-            cur.execute('rollback')
+            conn.rollback()
 
 
 def main():
     """
-    Main program entry point to connect to Redshift cluster and drop/create data tables
+    Main program entry point to connect to the warehouse and drop/create data tables
     """
     try:
         config = configparser.ConfigParser()
         config.read('config.cfg')
 
-        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+        conn = connect(config)
         cur = conn.cursor()
 
-        drop_tables(cur, conn)
+        # The incremental load mode keeps the star schema and only recreates the staging tables
+        if config.get('ETL', 'LOAD_MODE', fallback='full').lower() == 'incremental':
+            drop_tables(cur, conn, staging_drop_table_queries)
+        else:
+            drop_tables(cur, conn)
         create_tables(cur, conn)
 
         conn.close()
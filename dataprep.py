@@ -1,43 +1,443 @@
 import pandas as pd
-import datetime
-import pyspark.sql.types as T
+import numpy as np
 import pyspark.sql.functions as F
 import configparser
-from pyspark.sql import SparkSession
+from pyspark.sql import Window
 import os
 import glob
+import gzip
+import io
+import math
+import shutil
+import functools
 import boto3
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import fnmatch
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+import time
+import sys
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ledger import load_ledger, save_ledger, file_signature, is_processed
+from stage_cache import load_fingerprint, save_fingerprint, stage_fingerprint
+from instrumentation import start_run, measure, add, print_summary
+from spark_session import spark_session, stop_spark_session
+from staging_files import STAGING_SCHEMAS, output_format, output_name, output_path, split_outputs, part_path, s3_key, copy_manifest_path
+from staging_files import staged_files, dataset_files, output_exists, uploads_to_s3, loads_directly
+
+# Columns and compact dtypes read from each pandas input, so unused columns are never parsed and
+# low-cardinality text is held as categories instead of one Python string per row
+INPUT_SCHEMAS = {
+    'CITIES': {
+        'sep': ';',
+        'usecols': ['City', 'State', 'Median Age', 'Male Population', 'Female Population', 'Total Population',
+                    'Number of Veterans', 'Foreign-born', 'Average Household Size', 'State Code', 'Race', 'Count'],
+        'dtype': {'City': str, 'State': 'category', 'Median Age': 'float64', 'Male Population': 'Int32',
+                  'Female Population': 'Int32', 'Total Population': 'int32', 'Number of Veterans': 'Int32',
+                  'Foreign-born': 'Int32', 'Average Household Size': 'float64', 'State Code': 'category',
+                  'Race': 'category', 'Count': 'int32'}
+    },
+    'AIRPORTS': {
+        'usecols': ['type', 'name', 'elevation_ft', 'iso_country', 'iso_region', 'municipality', 'iata_code', 'coordinates'],
+        'dtype': {'type': 'category', 'name': str, 'elevation_ft': 'float32', 'iso_country': 'category',
+                  'iso_region': 'category', 'municipality': str, 'iata_code': str, 'coordinates': str}
+    },
+    'TEMPERATURES': {
+        'usecols': ['dt', 'AverageTemperature', 'AverageTemperatureUncertainty', 'City', 'Country', 'Latitude', 'Longitude'],
+        'dtype': {'dt': 'category', 'AverageTemperature': 'float64', 'AverageTemperatureUncertainty': 'float64',
+                  'City': str, 'Country': 'category', 'Latitude': 'category', 'Longitude': 'category'}
+    }
+}
+
+def read_input(config, key, **kwargs):
+    """
+    Read one of the pandas inputs with the columns and dtypes declared for it in INPUT_SCHEMAS, failing with the input and
+    the columns or values that do not match when the file has another layout
+    """
+    schema = INPUT_SCHEMAS[key]
+    path = config['INPUT'][key]
+
+    # Check the header first so a file with other columns or another separator names what is missing
+    columns = list(pd.read_csv(path, sep=schema.get('sep', ','), nrows=0).columns)
+    missing = [column for column in schema['usecols'] if column not in columns]
+    if missing:
+        raise ValueError('{} input {} is missing the columns {} declared in INPUT_SCHEMAS, found {}'.format(key, path, missing, columns))
+    try:
+        df = pd.read_csv(path, **schema, **kwargs)
+    except ValueError as exc:
+        raise ValueError('{} input {} does not match the dtypes declared in INPUT_SCHEMAS: {}'.format(key, path, exc)) from exc
+    # Chunked reads return a reader whose rows are counted by the caller as the chunks arrive
+    if 'chunksize' not in kwargs:
+        add('rows_in', len(df))
+    return df
+
+# Guards the upload manifest when several uploads run at the same time
+MANIFEST_LOCK = threading.Lock()
+
+def part_count(config, estimated_bytes):
+    """
+    Return the number of parts to split a dataset into, a multiple of the cluster slice count with each part close to PART_SIZE_MB
+    """
+    slices = config.getint('OUTPUT', 'SLICES', fallback=1)
+    target = config.getint('OUTPUT', 'PART_SIZE_MB', fallback=128) * 1024 * 1024
+    return slices * max(1, round(estimated_bytes / (slices * target)))
+
+def estimated_size(df, config, rows=None):
+    """
+    Estimate the compressed size of a dataframe, or of the given number of rows like it, by writing a sample in the output format
+    """
+    sample = df.head(10000)
+    if sample.empty:
+        return 0
+    buffer = io.BytesIO()
+    if output_format(config) == 'parquet':
+        sample.to_parquet(buffer, engine='pyarrow', compression='snappy', index=False)
+    else:
+        sample.to_csv(buffer, index=False, compression='gzip')
+    return len(buffer.getvalue()) * (len(df) if rows is None else rows) / len(sample)
+
+def write_copy_manifest(config, name, paths):
+    """
+    Write the COPY manifest listing the S3 location and size of each part of a staging dataset
+    """
+    manifest = copy_manifest_path(config, name)
+    os.makedirs(os.path.dirname(manifest), exist_ok=True)
+    entries = [{'url': 's3://{}/{}'.format(config['S3']['BUCKET'], s3_key(config, path)), 'mandatory': True,
+                'meta': {'content_length': os.path.getsize(path)}} for path in paths]
+    with open(manifest, 'w') as f:
+        json.dump({'entries': entries}, f, indent=2)
+
+class PartWriter:
+    """
+    Writes a staging dataset as numbered gzip CSV or Snappy Parquet parts of a fixed number of rows, followed by the COPY manifest
+    listing them, so that every slice of the cluster loads a part of about the same size
+    """
+    def __init__(self, config, key, rows_per_part):
+        self.config = config
+        self.key = key
+        self.rows_per_part = max(1, rows_per_part)
+        self.paths = []
+        self.file = None
+        self.rows = 0
+
+        # Remove the parts of a previous run, which may have been split into more of them
+        for path in glob.glob(part_path(config, key)):
+            os.remove(path)
+
+    def write(self, df):
+        start = 0
+        while start < len(df):
+            if self.file is None or self.rows >= self.rows_per_part:
+                self.next_part()
+            piece = df.iloc[start:start + self.rows_per_part - self.rows]
+            if output_format(self.config) == 'parquet':
+                self.file.write_table(pa.Table.from_pandas(piece, schema=STAGING_SCHEMAS[self.key], preserve_index=False))
+            else:
+                # Every part has its own header since COPY applies IGNOREHEADER to each file
+                piece.to_csv(self.file, header=self.rows == 0, index=False)
+            self.rows += len(piece)
+            start += len(piece)
+
+    def next_part(self):
+        if self.file is not None:
+            self.file.close()
+        path = part_path(self.config, self.key, len(self.paths))
+        self.paths.append(path)
+        if output_format(self.config) == 'parquet':
+            self.file = pq.ParquetWriter(path, STAGING_SCHEMAS[self.key], compression='snappy')
+        else:
+            self.file = gzip.open(path, 'wt', newline='')
+        self.rows = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        write_copy_manifest(self.config, output_name(self.config, self.key), self.paths)
+
+def write_output(df, config, key):
+    """
+    Write a pandas dataframe for a staging dataset as CSV or Snappy-compressed Parquet depending on the output format
+    """
+    if split_outputs(config):
+        writer = PartWriter(config, key, math.ceil(len(df) / part_count(config, estimated_size(df, config))))
+        writer.write(df)
+        writer.close()
+    elif output_format(config) == 'parquet':
+        df.to_parquet(output_path(config, key), engine='pyarrow', compression='snappy', index=False, schema=STAGING_SCHEMAS[key])
+    else:
+        df.to_csv(output_path(config, key), index=False)
+    add('rows_out', len(df))
+
+# Spark SQL types for the pandas dtypes in INPUT_SCHEMAS, which are read as strings when they are not listed
+SPARK_TYPES = {
+    'int32': 'int',
+    'Int32': 'int',
+    'float32': 'float',
+    'float64': 'double'
+}
+
+# Spark SQL types for the Arrow types in STAGING_SCHEMAS, which are named differently from their Spark types
+STAGING_SPARK_TYPES = {
+    pa.string(): 'string',
+    pa.int32(): 'int',
+    pa.int64(): 'bigint',
+    pa.float32(): 'float',
+    pa.float64(): 'double'
+}
+
+def staging_spark_type(field):
+    """
+    Return the Spark SQL type a STAGING_SCHEMAS field is cast to, failing for an Arrow type that has no Spark type in STAGING_SPARK_TYPES
+    """
+    if field.type not in STAGING_SPARK_TYPES:
+        raise ValueError('Staging column {} has the Arrow type {}, which has no Spark type in STAGING_SPARK_TYPES'.format(field.name, field.type))
+    return STAGING_SPARK_TYPES[field.type]
+
+def stage_engine(config, key):
+    """
+    Return the engine, pandas or spark, that runs a prep stage, picking spark for auto when the input is larger than AUTO_THRESHOLD_MB
+    """
+    engine = config.get('ENGINE', key, fallback='pandas').lower()
+    if engine == 'auto':
+        threshold = config.getint('ENGINE', 'AUTO_THRESHOLD_MB', fallback=512) * 1024 * 1024
+        engine = 'spark' if os.path.getsize(config['INPUT'][key]) > threshold else 'pandas'
+    return engine
+
+def read_input_spark(spark, config, key):
+    """
+    Read one of the pandas inputs into Spark with the columns declared in INPUT_SCHEMAS cast to the matching Spark types
+    """
+    schema = INPUT_SCHEMAS[key]
+    df = spark.read.csv(config['INPUT'][key], sep=schema.get('sep', ','), header=True)
+    return df.select([F.col(name).cast(SPARK_TYPES.get(schema['dtype'][name], 'string')).alias(name) for name in schema['usecols']])
+
+def estimated_size_spark(df, config, rows):
+    """
+    Estimate the compressed size of a number of rows of a Spark dataframe by writing a sample of it in the output format
+    """
+    return estimated_size(df.limit(10000).toPandas(), config, rows)
+
+def write_output_spark(df, config, key):
+    """
+    Write a Spark dataframe for a staging dataset to the same single file or parts that the pandas version writes
+    """
+    path = output_path(config, key)
+    parts = path + '.parts'
+
+    # Cast to the staging schema so the output can replace the pandas output one for one
+    df = df.select([F.col(field.name).cast(staging_spark_type(field)) for field in STAGING_SCHEMAS[key]])
+
+    # Split parts are sized like the pandas parts from a compressed sample of the output and its row count, which is counted
+    # from the cached output so the write does not compute it again
+    if split_outputs(config):
+        cached = df.cache()
+        rows = cached.count()
+        add('rows_out', rows)
+        df = cached.repartition(part_count(config, estimated_size_spark(cached, config, rows)))
+    else:
+        df = df.coalesce(1)
+    writer = df.write.mode("overwrite")
+    if output_format(config) == 'parquet':
+        writer.option("compression", "snappy").parquet(parts)
+    else:
+        writer.option("header", True).option("escape", '"').option("compression", "gzip" if split_outputs(config) else "none").csv(parts)
+
+    if split_outputs(config):
+        for stale in glob.glob(part_path(config, key)):
+            os.remove(stale)
+        written = sorted(glob.glob(os.path.join(parts, 'part-*')))
+        paths = [part_path(config, key, index) for index in range(len(written))]
+        for part, target in zip(written, paths):
+            os.replace(part, target)
+        write_copy_manifest(config, output_name(config, key), paths)
+        cached.unpersist()
+    else:
+        os.replace(glob.glob(os.path.join(parts, 'part-*'))[0], path)
+    shutil.rmtree(parts)
+
+# Abbreviations applied to the first word of a city name so that "Saint Louis" and "St. Louis" resolve to the same city
+CITY_PREFIXES = {'saint': 'st', 'fort': 'ft', 'mount': 'mt'}
+
+def normalize_city(name):
+    """
+    Normalize a city name for matching by stripping accents, punctuation, case and extra spaces and abbreviating Saint, Fort and Mount
+    """
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    words = re.sub(r'[^a-z0-9]+', ' ', re.sub(r"[.']", '', name)).split()
+    if words:
+        words[0] = CITY_PREFIXES.get(words[0], words[0])
+    return ' '.join(words)
+
+def city_id(name, state):
+    """
+    Return the integer surrogate key of a city, derived from its normalized name and state code so that every stage and
+    every run assigns the same key without sharing an index, or None when the name or state is missing
+    """
+    if not isinstance(name, str) or not isinstance(state, str):
+        return None
+    key = normalize_city(name) + '|' + state.strip().upper()
+    # 15 hex digits keep the key within a signed BIGINT
+    return int(hashlib.sha256(key.encode()).hexdigest()[:15], 16)
+
+def city_ids(names, states):
+    """
+    Return the city ids for columns of city names and state codes, hashing each distinct pair once
+    """
+    pairs = pd.DataFrame({'name': np.asarray(names, dtype=object), 'state': np.asarray(states, dtype=object)})
+    distinct = pairs.drop_duplicates()
+    distinct = distinct.assign(city_id=pd.array([city_id(name, state) for name, state in zip(distinct['name'], distinct['state'])], dtype='Int64'))
+    return pairs.merge(distinct, how='left', on=['name', 'state'])['city_id'].values
+
+def parse_coordinate(value):
+    """
+    Convert a coordinate such as 32.95N or 100.53W into signed decimal degrees
+    """
+    value = str(value).strip()
+    return -float(value[:-1]) if value[-1] in 'SW' else float(value[:-1])
+
+def us_airports(airportcodes):
+    """
+    Keep the US airports with a usable IATA code, which are the airports loaded into the warehouse
+    """
+    majorairports = airportcodes[airportcodes['iso_country'] == "US"]
+    return majorairports[majorairports.iata_code.notnull() & ~majorairports.iata_code.isin(['0', '-'])]
+
+def read_us_airports(config):
+    """
+    Read the US airports with a usable IATA code and their city id from the airports input, for stages other than the
+    airports stage that need them without waiting for its output
+    """
+    airports = us_airports(pd.read_csv(config['INPUT']['AIRPORTS'], **INPUT_SCHEMAS['AIRPORTS']))
+    return airports.assign(city_id=city_ids(airports['municipality'], airports['iso_region'].str.split(pat="-", n=1).str[1]))
+
+def airport_codes(config):
+    """
+    Return the IATA codes of the airports that end up in the warehouse, which are the US airports with a known city
+    """
+    airports = read_us_airports(config)
+    return sorted(set(airports.loc[airports['city_id'].notna(), 'iata_code']))
+
+def airport_locations(config):
+    """
+    Read the coordinates, normalized city name and city id of every US airport, the canonical locations that
+    temperature series are matched against
+    """
+    airports = read_us_airports(config)
+    coordinates = airports['coordinates'].str.split(pat=",", n=1, expand=True)
+    locations = pd.DataFrame({
+        'name': [normalize_city(name) if isinstance(name, str) else None for name in airports['municipality']],
+        'city_id': airports['city_id'].values,
+        'lat': pd.to_numeric(coordinates[1]).values,
+        'long': pd.to_numeric(coordinates[0]).values
+    })
+    return locations.dropna().reset_index(drop=True)
+
+def haversine_km(lat1, long1, lat2, long2):
+    """
+    Great-circle distance in km between a point and an array of points
+    """
+    lat1, long1, lat2, long2 = map(np.radians, (lat1, long1, lat2, long2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((long2 - long1) / 2) ** 2
+    return 6371 * 2 * np.arcsin(np.sqrt(a))
+
+def spatial_index(locations, cell):
+    """
+    Bucket locations into a grid of cells `cell` degrees wide so points near a coordinate are found without scanning them all
+    """
+    cells = zip(np.floor(locations['lat'] / cell).astype(int), np.floor(locations['long'] / cell).astype(int))
+    index = {}
+    for position, key in enumerate(cells):
+        index.setdefault(key, []).append(position)
+    return index
+
+def nearby(index, cell, lat, long):
+    """
+    Return the positions of the locations in the grid cells within one cell of latitude of a coordinate, widening the
+    longitude range towards the poles where a degree of longitude covers less distance
+    """
+    row, column = math.floor(lat / cell), math.floor(long / cell)
+    span = math.ceil(1 / max(math.cos(math.radians(lat)), 0.01))
+    return [position for r in range(row - 1, row + 2) for c in range(column - span, column + span + 1) for position in index.get((r, c), [])]
+
+def resolve_temperature_cities(config, locations):
+    """
+    Match each temperature location, given as city, lat and long columns, to the nearest airport city of the same normalized
+    name within TEMPERATURES_MATCH_KM. Only the closest location is kept for each city so that no city gets two temperature
+    series. Returns the matched locations with their city_id.
+    """
+    radius = config.getfloat('INPUT', 'TEMPERATURES_MATCH_KM', fallback=150)
+    airports = airport_locations(config)
+    # Cells one radius tall so every airport in range is in the cells around a location
+    cell = radius / 111.2
+    index = spatial_index(airports, cell)
+
+    matches = []
+    for city, lat, long in zip(locations['city'], locations['lat'], locations['long']):
+        lat, long = parse_coordinate(lat), parse_coordinate(long)
+        candidates = airports.iloc[nearby(index, cell, lat, long)]
+        candidates = candidates[candidates['name'] == normalize_city(city)]
+        distances = haversine_km(lat, long, candidates['lat'].values, candidates['long'].values)
+        if len(candidates) and distances.min() <= radius:
+            matches.append((candidates['city_id'].values[distances.argmin()], distances.min()))
+        else:
+            matches.append((None, None))
+
+    # Ids go through a nullable integer array since they do not fit a float without losing digits
+    matched = locations.assign(city_id=pd.array([match[0] for match in matches], dtype='Int64'),
+                               distance=[match[1] for match in matches]).dropna(subset=['city_id'])
+    matched = matched.sort_values(by=['distance']).drop_duplicates(subset=['city_id'])
+    return matched.drop(columns=['distance']).astype({'city_id': 'int64'}).reset_index(drop=True)
+
+# Race codes that are pivoted into count and percent columns for each city
+RACES = ['White', 'Hispanic or Latino', 'Asian', 'American Indian and Alaska Native', 'Black or African-American']
+
+def race_columns(citiesdf):
+    """
+    Reshape the demographics rows, one per city and race, into one row per city with a count and percent column for each race,
+    pivoting the race counts in one pass. Cities that do not report every race are dropped
+    """
+    # Pivot the race counts into one row per city with a column per race, keeping only cities that report every race
+    racecounts = citiesdf.pivot_table(index=['City', 'State'], columns='Race', values='Count', aggfunc='first', observed=True)
+    racecounts = racecounts.reindex(columns=RACES).dropna().astype(int)
+    racecounts.columns = [f"{race} Count" for race in RACES]
+
+    # Join the race counts onto a single row of demographics per city in one pass
+    mergedcities = citiesdf.drop_duplicates(subset=["City", "State"]).merge(racecounts.reset_index(), on=['City', 'State'])
+    for race in RACES:
+        # Move the count column to the end so that the count and percent columns for each race sit together
+        mergedcities[f"{race} Count"] = mergedcities.pop(f"{race} Count")
+        mergedcities[f"Percent {race}"] = mergedcities[f"{race} Count"] / mergedcities['Total Population']
+    return mergedcities
 
 def prep_cities_data(config):
     """
     Read cities data in from CSV and format into appropriate dataframe before exporting to CSV again
     """
-    # Enumerate the race codes to populate new columns
-    races = ['White', 'Hispanic or Latino', 'Asian', 'American Indian and Alaska Native', 'Black or African-American']
-    
+    # Hand large inputs to the Spark version of this stage
+    if stage_engine(config, 'CITIES') == 'spark':
+        prep_cities_data_spark(config)
+        return
+
     # Read in the CSV and then sort by state, city
-    citiesdf = pd.read_csv(config['INPUT']['CITIES'], sep=';')
+    citiesdf = read_input(config, 'CITIES')
     citiesdf = citiesdf.sort_values(by=['State','City'])
     
-    # Split out race and counts into separate dataframe
-    citiesracesdf = citiesdf[['City', 'State','Race','Count']]
-    
-    mergedcities = citiesdf
-    for race in races:
-        # Merge a count and percent column for each race into the main dataframe
-        racedf = citiesracesdf[citiesracesdf['Race'] == f"{race}"]
-        racedf = racedf.rename(columns = {'Count': f"{race} Count"}, inplace=False)
-        racedf = racedf.drop(['Race'], axis=1)
-        mergedcities = mergedcities.merge(racedf, on=['City', 'State'])
-        mergedcities[f"Percent {race}"] = mergedcities[f"{race} Count"] / mergedcities['Total Population']
+    # Reshape the race rows into a count and percent column for each race on a single row per city
+    mergedcities = race_columns(citiesdf)
     
     # Merge percentages of population for various existing count columns
     otherstats = ['Male Population', 'Female Population', 'Number of Veterans', 'Foreign-born']
     for stat in otherstats:
         mergedcities[f"Percent {stat}"] = mergedcities[f"{stat}"] / mergedcities['Total Population']
 
-    # Drop any duplicate records of City State since there will be for each race
-    final_cities = mergedcities.drop_duplicates(subset=["City", "State"]).sort_values(by=['City'])
+    # Sort the single record per City State by city
+    final_cities = mergedcities.sort_values(by=['City'])
     
     # Drop additional unused columns
     final_cities = final_cities.drop(columns=['State', 'Race','Count'])
@@ -91,48 +491,109 @@ def prep_cities_data(config):
                    'Percent Hispanic or Latino':"per_his_latino",
                   })
 
-    # Output to CSV
-    final_cities.to_csv(config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['CITIES'],index=False)
+    # Key each city on its normalized name and state
+    final_cities['city_id'] = city_ids(final_cities['city'], final_cities['state'])
+
+    # Output to the configured staging format
+    write_output(final_cities, config, 'CITIES')
+
+def prep_cities_data_spark(config):
+    """
+    Spark version of prep_cities_data for demographics files too large for a single pandas process
+    """
+    citiesdf = read_input_spark(spark_session(config, os.path.getsize(config['INPUT']['CITIES'])), config, 'CITIES')
+
+    # Pivot the race counts into one row per city with a column per race, keeping only cities that report every race
+    racecounts = citiesdf.groupBy('City', 'State').pivot('Race', RACES).agg(F.first('Count')).dropna()
+    for race in RACES:
+        racecounts = racecounts.withColumnRenamed(race, f"{race} Count")
+
+    # Join the race counts onto a single row of demographics per city
+    mergedcities = citiesdf.dropDuplicates(['City', 'State']).join(racecounts, ['City', 'State'])
+
+    # Percentages of the total population rounded half to even like pandas round
+    def percent(column):
+        return F.bround(F.col(column) / F.col('Total Population'), 2)
+
+    final_cities = mergedcities.orderBy('City', 'State').select(
+        F.col('City').alias('city'),
+        F.col('Median Age').alias('median_age'),
+        F.col('Male Population').alias('cnt_male'),
+        F.col('Female Population').alias('cnt_female'),
+        F.col('Total Population').alias('population'),
+        F.col('Number of Veterans').alias('cnt_veterans'),
+        F.col('Foreign-born').alias('cnt_foreign_born'),
+        F.col('Average Household Size').alias('avg_household'),
+        F.col('State Code').alias('state'),
+        F.col('White Count').alias('cnt_white'),
+        percent('White Count').alias('per_white'),
+        F.col('Hispanic or Latino Count').alias('cnt_his_latino'),
+        percent('Hispanic or Latino Count').alias('per_his_latino'),
+        F.col('Asian Count').alias('cnt_asian'),
+        percent('Asian Count').alias('per_asian'),
+        F.col('American Indian and Alaska Native Count').alias('cnt_amer_ind_ak_native'),
+        percent('American Indian and Alaska Native Count').alias('per_amer_ind_ak_native'),
+        F.col('Black or African-American Count').alias('cnt_black'),
+        percent('Black or African-American Count').alias('per_black_afr_amer'),
+        percent('Male Population').alias('per_male'),
+        percent('Female Population').alias('per_female'),
+        percent('Number of Veterans').alias('per_veterans'),
+        percent('Foreign-born').alias('per_foreign_born'),
+        F.udf(city_id, 'long')(F.col('City'), F.col('State Code')).alias('city_id')
+    )
+
+    # Output to the configured staging format
+    write_output_spark(final_cities, config, 'CITIES')
 
 def prep_airport_data(config):
     """
     Read airport data in from CSV and format into appropriate dataframe before exporting to CSV again
     """
+    # Hand large inputs to the Spark version of this stage
+    if stage_engine(config, 'AIRPORTS') == 'spark':
+        prep_airport_data_spark(config)
+        return
+
     # Read in data from csv
-    airportcodes = pd.read_csv(config['INPUT']['AIRPORTS'])
+    airportcodes = read_input(config, 'AIRPORTS')
 
-    # Drop null IATA code columns and filter additional bad values
-    majorairports = airportcodes[airportcodes.iata_code.notnull()]
-    majorairports = majorairports[majorairports.iata_code != '0']
-    majorairports = majorairports[majorairports.iata_code != '-']
-    majorairports.sort_values(by='iata_code')
+    # Output final data frame to the configured staging format
+    write_output(transform_airports(airportcodes), config, 'AIRPORTS')
+
+def transform_airports(airportcodes):
+    """
+    Reduce the airports input to US airports with a usable IATA code and format them into the staging airports columns,
+    working on whole columns rather than row by row
+    """
+    # Drop any non-US based data from airports first so every later step works on the smaller frame,
+    # then drop null IATA code columns and filter additional bad values
+    majorairports = us_airports(airportcodes)
 
     # Reduce the number of columns
-    clean_airports = majorairports.filter(['iata_code', 'type', 'name', 'elevation_ft', 'continent', 'iso_country', 'iso_region', 'municipality','coordinates'], axis=1)
+    clean_airports = majorairports.filter(['iata_code', 'type', 'name', 'elevation_ft', 'iso_region', 'municipality','coordinates'], axis=1)
 
-    # Convert coordinates to latitude and longitude separate columns
-    clean_airports[['long', 'lat']] = clean_airports["coordinates"].str.split(pat=",", expand=True)
+    # Parse coordinates into numeric longitude and latitude columns
+    coordinates = clean_airports["coordinates"].str.split(pat=",", n=1, expand=True)
+    clean_airports['long'] = pd.to_numeric(coordinates[0])
+    clean_airports['lat'] = pd.to_numeric(coordinates[1])
     clean_airports = clean_airports.drop('coordinates', axis=1)
-    
-    # Drop any non-US based data from airports
-    clean_airports['iso_country'] = clean_airports['iso_country'].astype(str)
-    clean_airports = clean_airports[(clean_airports['iso_country']=="US")]
 
     # Split up the data for iso_region to get state values
-    clean_airports[['country', 'state']] = clean_airports["iso_region"].str.split(pat="-", expand=True)
+    clean_airports['state'] = clean_airports["iso_region"].str.split(pat="-", n=1).str[1]
     
     # Drop unused columns and rename others
-    clean_airports = clean_airports.drop(columns=['continent','iso_country','iso_region','country'])
+    clean_airports = clean_airports.drop(columns=['iso_region'])
     clean_airports = clean_airports.rename(columns={"municipality": "city"})
     clean_airports = clean_airports.sort_values(by=['city'], ascending=False)
 
+    # Key each airport on the normalized name and state of its city before missing names are converted to text
+    clean_airports['city_id'] = city_ids(clean_airports['city'], clean_airports['state'])
+
     # Convert the data in the columns to specific types
     convert_dict = {'iata_code': str, 
                     'type': str,
                     'name': str,
                     'city': str,
-                    'lat': float,
-                    'long': float,
                     'state': str
                 } 
     final_airports = clean_airports.astype(convert_dict)
@@ -141,18 +602,61 @@ def prep_airport_data(config):
     final_airports = final_airports.round({'lat': 2,'long':2})
     
     # Format latitude/longitude into relevant N/S or E/W rather than negative numbers
-    final_airports["long"] = final_airports.apply(lambda x: f"{abs(x['long'])}W" if x['long'] < 0 else f"{x['long']}E", axis=1)
-    final_airports["lat"] = final_airports.apply(lambda x: f"{abs(x['lat'])}S" if x['lat'] < 0 else f"{x['lat']}N", axis=1)
+    final_airports["long"] = np.where(final_airports['long'] < 0, final_airports['long'].abs().astype(str) + 'W', final_airports['long'].astype(str) + 'E')
+    final_airports["lat"] = np.where(final_airports['lat'] < 0, final_airports['lat'].abs().astype(str) + 'S', final_airports['lat'].astype(str) + 'N')
+    return final_airports
+
+def prep_airport_data_spark(config):
+    """
+    Spark version of prep_airport_data for airport files too large for a single pandas process
+    """
+    airportcodes = read_input_spark(spark_session(config, os.path.getsize(config['INPUT']['AIRPORTS'])), config, 'AIRPORTS')
+
+    # Keep US airports with a usable IATA code
+    majorairports = airportcodes.filter((F.col('iso_country') == "US") & F.col('iata_code').isNotNull() & ~F.col('iata_code').isin('0', '-'))
+
+    # Parse coordinates into rounded numeric longitude and latitude and take the state from the region code
+    coordinates = F.split(F.col('coordinates'), ',', 2)
+    clean_airports = majorairports.select(
+        'iata_code',
+        'type',
+        'name',
+        'elevation_ft',
+        F.col('municipality').alias('city'),
+        F.bround(F.trim(F.try_element_at(coordinates, F.lit(1))).cast('double'), 2).alias('long'),
+        F.bround(F.trim(F.try_element_at(coordinates, F.lit(2))).cast('double'), 2).alias('lat'),
+        F.try_element_at(F.split(F.col('iso_region'), '-', 2), F.lit(2)).alias('state')
+    )
+    clean_airports = clean_airports.withColumn('city_id', F.udf(city_id, 'long')(F.col('city'), F.col('state')))
+
+    # Format latitude/longitude into relevant N/S or E/W rather than negative numbers
+    def hemisphere(column, negative, positive):
+        return F.when(F.col(column) < 0, F.concat(F.abs(F.col(column)).cast('string'), F.lit(negative)))\
+            .otherwise(F.concat(F.col(column).cast('string'), F.lit(positive)))
 
-    # Output final data frame to CSV
-    final_airports.to_csv(config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['AIRPORTS'],index=False)
+    final_airports = clean_airports.withColumn('long', hemisphere('long', 'W', 'E'))\
+        .withColumn('lat', hemisphere('lat', 'S', 'N'))\
+        .orderBy(F.col('city').desc_nulls_last())
+
+    # Output final data frame to the configured staging format
+    write_output_spark(final_airports, config, 'AIRPORTS')
 
 def prep_temperature_data(config):
     """
     Read temperature data in from CSV and format into appropriate dataframe before exporting to CSV again
     """
+    # Hand large inputs to the Spark version of this stage
+    if stage_engine(config, 'TEMPERATURES') == 'spark':
+        prep_temperature_data_spark(config)
+        return
+
+    # Stream the file in chunks instead when a chunk size is configured
+    if config.getint('INPUT', 'TEMPERATURES_CHUNKSIZE', fallback=0) > 0:
+        prep_temperature_data_streaming(config)
+        return
+
     # Read in CSV file
-    temperaturedf = pd.read_csv(config['INPUT']['TEMPERATURES'])
+    temperaturedf = read_input(config, 'TEMPERATURES')
     temperaturedf = temperaturedf.sort_values(by=['dt'], ascending=False)
 
     # Split out data columns for month and year 
@@ -177,77 +681,516 @@ def prep_temperature_data(config):
         "Longitude": "long"
     })
     
+    # Match each temperature location to a city and keep only the matched rows
+    locations = final_temps[['city', 'lat', 'long']].drop_duplicates().astype(str)
+    final_temps = final_temps.astype({'lat': str, 'long': str}).merge(resolve_temperature_cities(config, locations), on=['city', 'lat', 'long'])
+
     # Calculate the average month temperature across years by city
-    temp_averages = final_temps.groupby(['city', 'month'], as_index=False).agg(average_temp_month=pd.NamedAgg(column="avg_temp",aggfunc="mean"))
+    temp_averages = final_temps.groupby(['city_id', 'month'], as_index=False).agg(average_temp_month=pd.NamedAgg(column="avg_temp",aggfunc="mean"))
     
     # Combine the results with the main dataframe and round values
-    combined_temps = pd.merge(final_temps, temp_averages, how='left', left_on=['city','month'], right_on = ['city','month'])
+    combined_temps = pd.merge(final_temps, temp_averages, how='left', on=['city_id', 'month'])
+    combined_temps['city_id'] = combined_temps.pop('city_id')
     combined_temps = combined_temps.round({'avg_temp': 2, 
                                         'avg_temp_uncertainty': 2,
                                         'average_temp_month': 2
                                         })
-    # Output the data back to CSV 
-    combined_temps.to_csv(config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['TEMPERATURES'],index=False)
+    # Output the data back to the configured staging format
+    write_output(combined_temps, config, 'TEMPERATURES')
+
+def read_temperature_chunks(config, count_rows=False):
+    """
+    Stream the temperature CSV in chunks reduced to cleaned US rows with month and year columns
+    """
+    reader = read_input(config, 'TEMPERATURES', chunksize=config.getint('INPUT', 'TEMPERATURES_CHUNKSIZE', fallback=0))
+    for chunk in reader:
+        # Count the rows read only on the pass that asks for it so the file is not counted twice
+        if count_rows:
+            add('rows_in', len(chunk))
+
+        # Filter to US rows as soon as the chunk arrives and drop any rows with empty columns
+        chunk = chunk[chunk['Country'] == "United States"].dropna()
+
+        # Split out data columns for month and year
+        dates = pd.DatetimeIndex(chunk['dt'])
+        chunk = chunk.assign(month=dates.month, year=dates.year)
+
+        # Drop extra columns and rename columns
+        yield chunk.drop(columns=['Country']).rename(columns={
+            "dt": "date",
+            "AverageTemperature": "avg_temp",
+            "AverageTemperatureUncertainty": "avg_temp_uncertainty",
+            "City": "city",
+            "Latitude": "lat",
+            "Longitude": "long"
+        })
+
+def prep_temperature_data_streaming(config):
+    """
+    Read temperature data in chunks so that peak memory is bounded by the chunk size rather than the file size
+    """
+    # First pass accumulates the sums and counts needed for the month average across years by location
+    totals = None
+    for chunk in read_temperature_chunks(config, count_rows=True):
+        chunk_totals = chunk.groupby([chunk['city'], chunk['lat'].astype(str), chunk['long'].astype(str), 'month'])['avg_temp'].agg(['sum', 'count'])
+        totals = chunk_totals if totals is None else totals.add(chunk_totals, fill_value=0)
+    # Without any US rows an empty output replaces the previous one, as the in-memory version writes an empty frame
+    if totals is None or totals.empty:
+        write_output(STAGING_SCHEMAS['TEMPERATURES'].empty_table().to_pandas(), config, 'TEMPERATURES')
+        return
+
+    # Match each location to a city, which keeps one location per city so the location averages are the city averages
+    locations = resolve_temperature_cities(config, totals.index.to_frame(index=False)[['city', 'lat', 'long']].drop_duplicates())
+    totals = totals.reset_index().merge(locations, on=['city', 'lat', 'long'])
+    temp_averages = totals.assign(average_temp_month=totals['sum'] / totals['count'])[['city_id', 'month', 'average_temp_month']]
+
+    # Second pass combines each chunk with the averages and appends it to the output
+    path = output_path(config, 'TEMPERATURES')
+    total_rows = int(totals['count'].sum())
+    writer = None
+    parts = None
+    first = True
+    for chunk in read_temperature_chunks(config):
+        chunk = chunk.astype({'lat': str, 'long': str}).merge(locations, on=['city', 'lat', 'long'])
+        combined_temps = pd.merge(chunk, temp_averages, how='left', on=['city_id', 'month'])
+        combined_temps['city_id'] = combined_temps.pop('city_id')
+        combined_temps = combined_temps.round({'avg_temp': 2,
+                                            'avg_temp_uncertainty': 2,
+                                            'average_temp_month': 2
+                                            })
+        add('rows_out', len(combined_temps))
+        if split_outputs(config):
+            # The first pass counted the output rows, so the parts can be sized from the first chunk before any are written
+            if parts is None:
+                parts = PartWriter(config, 'TEMPERATURES', math.ceil(total_rows / part_count(config, estimated_size(combined_temps, config, total_rows))))
+            parts.write(combined_temps)
+        elif output_format(config) == 'parquet':
+            if writer is None:
+                writer = pq.ParquetWriter(path, STAGING_SCHEMAS['TEMPERATURES'], compression='snappy')
+            writer.write_table(pa.Table.from_pandas(combined_temps, schema=STAGING_SCHEMAS['TEMPERATURES'], preserve_index=False))
+        else:
+            combined_temps.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+        first = False
+    if writer is not None:
+        writer.close()
+    if parts is not None:
+        parts.close()
+
+def prep_temperature_data_spark(config):
+    """
+    Spark version of prep_temperature_data for temperature files too large for a single pandas process
+    """
+    spark = spark_session(config, os.path.getsize(config['INPUT']['TEMPERATURES']))
+    temperaturedf = read_input_spark(spark, config, 'TEMPERATURES')
+
+    # Drop any rows with empty columns and keep only the US
+    temperature_clean = temperaturedf.dropna().filter(F.col('Country') == "United States")
+
+    # Match the few distinct locations to cities on the driver and broadcast the matches back to keep only the matched rows
+    locations = temperature_clean.select(F.col('City').alias('city'), F.col('Latitude').alias('lat'), F.col('Longitude').alias('long')).distinct().toPandas()
+    matches = resolve_temperature_cities(config, locations).rename(columns={'city': 'City', 'lat': 'Latitude', 'long': 'Longitude'})
+    matches = spark.createDataFrame(matches, 'City string, Latitude string, Longitude string, city_id long')
+    temperature_clean = temperature_clean.join(F.broadcast(matches), ['City', 'Latitude', 'Longitude'])
+
+    # Split out month and year and average each month across years by city without a separate join
+    dates = F.to_date(F.col('dt'))
+    temperature_clean = temperature_clean.withColumn('month', F.month(dates)).withColumn('year', F.year(dates))
+    temperature_clean = temperature_clean.withColumn('average_temp_month', F.avg('AverageTemperature').over(Window.partitionBy('city_id', 'month')))
+
+    # Rename and round the columns in the staging order
+    final_temps = temperature_clean.orderBy(F.col('dt').desc(), F.col('City').desc()).select(
+        F.col('dt').alias('date'),
+        F.bround('AverageTemperature', 2).alias('avg_temp'),
+        F.bround('AverageTemperatureUncertainty', 2).alias('avg_temp_uncertainty'),
+        F.col('City').alias('city'),
+        F.col('Latitude').alias('lat'),
+        F.col('Longitude').alias('long'),
+        'month',
+        'year',
+        F.bround('average_temp_month', 2).alias('average_temp_month'),
+        'city_id'
+    )
+
+    # Output the data back to the configured staging format
+    write_output_spark(final_temps, config, 'TEMPERATURES')
+
+def travelers_input_files(config):
+    """
+    Resolve the travelers input setting, which may be a single SAS file, a directory of monthly files or a glob
+    """
+    path = config['INPUT']['TRAVELERS']
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, 'i94_*_sub.*')))
+    return sorted(glob.glob(path))
+
+# The I94 columns used by the travelers stage and the type each is read as, regardless of the monthly file's own schema
+TRAVELERS_COLUMNS = {
+    'i94port': 'string',
+    'arrdate': 'double',
+    'i94bir': 'double',
+    'i94visa': 'double',
+    'biryear': 'double',
+    'gender': 'string'
+}
+
+def read_travelers(spark, files, with_source=False):
+    """
+    Read monthly I94 SAS files with differing column sets into one dataframe projected down to TRAVELERS_COLUMNS, with the name
+    of the file each row came from in a source column when `with_source` is set
+    """
+    frames = []
+    for f in files:
+        # CSV and Parquet files with the SAS column names are accepted as stand-ins, such as the generated benchmark inputs
+        if f.endswith('.csv'):
+            sas_df = spark.read.csv(f, header=True)
+        elif f.endswith('.parquet'):
+            sas_df = spark.read.parquet(f)
+        else:
+            sas_df = spark.read.format('com.github.saurfang.sas.spark').load(f)
+
+        # Match columns case-insensitively and fill any the file does not have with nulls so every month lines up
+        available = {c.lower(): c for c in sas_df.columns}
+        frames.append(sas_df.select([
+            (F.col(available[name]) if name in available else F.lit(None)).cast(dtype).alias(name)
+            for name, dtype in TRAVELERS_COLUMNS.items()
+        ] + ([F.lit(os.path.basename(f)).alias('source')] if with_source else [])))
+
+    # Union the projected files so the whole set is read as a single Spark job
+    return functools.reduce(lambda left, right: left.unionByName(right), frames)
+
+def report_dropped_ports(dropped):
+    """
+    Print how many travelers were dropped at each unknown port, most first, and add the total to the stage's metrics
+    """
+    counts = dropped.groupBy('iata_code').count().orderBy(F.col('count').desc(), 'iata_code').collect()
+    total = sum(row['count'] for row in counts)
+    add('rows_dropped', total)
+    print('Dropped {} travelers at {} unknown ports'.format(total, len(counts)))
+    for row in counts:
+        print('{:<6} {:>10}'.format(str(row['iata_code']), row['count']))
+
+def write_travelers(df, config, path, estimated_bytes=0, partition_by=None):
+    """
+    Write a travelers dataframe to a folder in the configured staging format, split into a slice-multiple of gzip parts
+    with a COPY manifest when SPLIT is set. With `partition_by` the rows are written to a subfolder per value of that column,
+    and only the subfolders being written are replaced
+    """
+    if split_outputs(config):
+        df = df.repartition(part_count(config, estimated_bytes))
+    writer = df.write.mode("overwrite")
+    if partition_by:
+        writer = writer.partitionBy(partition_by).option("partitionOverwriteMode", "dynamic")
+    if output_format(config) == 'parquet':
+        writer.option("compression", "snappy").parquet(path)
+    else:
+        writer.option("compression", "gzip" if split_outputs(config) else "none").csv(path)
+    if split_outputs(config):
+        write_copy_manifest(config, os.path.relpath(path, config['OUTPUT']['FOLDER']), staged_files(path))
+
+def travelers_partition(year, month):
+    """
+    Return the arrival_year/arrival_month partition folder of a month, matching Spark's default partition for rows without an arrival date
+    """
+    year = '__HIVE_DEFAULT_PARTITION__' if year is None else year
+    month = '__HIVE_DEFAULT_PARTITION__' if month is None else month
+    return f"arrival_year={year}/arrival_month={month}"
+
+def write_travelers_partitions(df, config, row_bytes=0):
+    """
+    Write travelers into arrival_year/arrival_month partition folders, keeping the columns in the files for COPY. Each input file
+    writes to its own source= folder within a partition, so a new file with rows for a month that is already written adds to
+    the partition instead of replacing it, and a changed file replaces only its own rows. Returns the partitions each source wrote
+    """
+    df.cache()
+    months = {}
+    sources = {}
+    for row in df.groupBy('source', 'arrival_year', 'arrival_month').count().collect():
+        month = (row.arrival_year, row.arrival_month)
+        months[month] = months.get(month, 0) + row['count']
+        sources.setdefault(row.source, set()).add(travelers_partition(*month))
+    for (year, month), count in months.items():
+        # Match nulls explicitly so rows without an arrival date land in Spark's default partition rather than being dropped
+        write_travelers(df.filter(F.col('arrival_year').eqNullSafe(year) & F.col('arrival_month').eqNullSafe(month)),
+                        config, output_path(config, 'TRAVELERS') + travelers_partition(year, month), row_bytes * count, partition_by='source')
+    df.unpersist()
+    return {source: sorted(partitions) for source, partitions in sources.items()}
+
+def with_arrival_date_parts(df):
+    """
+    Replace the SAS arrival_date, the days since 1960-01-01, with arrival_year, arrival_month and arrival_day integer columns
+    using native Spark date arithmetic, which runs in the JVM without sending rows to a Python worker
+    """
+    arrival_date = F.expr("date_add(to_date('1960-01-01'), cast(arrival_date as int))")
+    return df.withColumn('arrival_year', F.year(arrival_date))\
+        .withColumn('arrival_month', F.month(arrival_date))\
+        .withColumn('arrival_day', F.dayofmonth(arrival_date))\
+        .drop('arrival_date')
 
 def prep_travelers_data(config):
     """
     Read travelers data in from SAS files into Spark and export to CSV
     """
+    incremental = config.getboolean('INPUT', 'TRAVELERS_INCREMENTAL', fallback=False)
+
+    # Only pick up monthly files that are not already in the ledger when running incrementally
+    if incremental:
+        ledger = load_ledger(config)
+        new_files = [f for f in travelers_input_files(config) if not is_processed(ledger, f)]
+        if not new_files:
+            print('No new travelers files to process')
+            return
+
+    # The input size sizes the shuffle partitions of the Spark session
+    files = new_files if incremental else travelers_input_files(config)
+    input_bytes = sum(os.path.getsize(f) for f in files)
+
     # Initiate spark connection
-    spark = SparkSession.builder.config("spark.jars.packages","saurfang:spark-sas7bdat:2.0.0-s_2.11")\
-        .enableHiveSupport().getOrCreate()
+    spark = spark_session(config, input_bytes)
 
-    # Read data file into spark dataframe
-    i94_df = spark.read.format('com.github.saurfang.sas.spark').load(config['INPUT']['TRAVELERS'])
+    # Read the data files into a single spark dataframe with only the columns we use, plus the file of each row when
+    # writing partitions so every file writes its own rows
+    i94_df = read_travelers(spark, files, with_source=incremental)
     
     # Rename columns
-    travel_data = i94_df.selectExpr("i94port as iata_code", "arrdate as arrival_date","i94bir as age","i94visa as visa","biryear as year_of_birth","gender")
+    travel_data = i94_df.selectExpr("i94port as iata_code", "arrdate as arrival_date","i94bir as age","i94visa as visa","biryear as year_of_birth","gender",
+                                    *(["source"] if incremental else []))
     
-    # Filter out any non-existant airport codes
-    travel_data = travel_data.filter(travel_data.iata_code != 'XXX')
+    # Semi-join against the codes of the airports loaded into the warehouse, broadcast to every executor, so rows for unknown
+    # ports such as the XXX placeholder are dropped here rather than after being uploaded and copied into Redshift.
+    # The flagged rows are cached so the dropped rows can be counted per port without reading the input twice
+    codes = spark.createDataFrame([(code, True) for code in airport_codes(config)], 'iata_code string, known boolean')
+    flagged = travel_data.join(F.broadcast(codes), 'iata_code', 'left').cache()
+    report_dropped_ports(flagged.filter(F.col('known').isNull()))
 
-    # Convert the SAS date to a regular date type
-    start_date = datetime.datetime(1960, 1, 1)
-    convert_sas_date = F.udf(lambda x: start_date + datetime.timedelta(days = int(x)) if x is not None else None, T.DateType())
-    travel_data_clean = travel_data.withColumn('arrival_date', convert_sas_date('arrival_date'))
+    # Count the rows read and the rows kept, known ports with a gender, from the cached frame in a single pass
+    counts = flagged.agg(F.count(F.lit(1)).alias('rows_in'), F.count(F.when(F.col('known') & F.col('gender').isNotNull(), 1)).alias('rows_out')).first()
+    add('rows_in', counts['rows_in'])
+    add('rows_out', counts['rows_out'])
+    travel_data = flagged.filter(F.col('known')).drop('known')
 
-    # Extract the arrival year, month, and day into separate columns
-    travel_data_clean = travel_data_clean.withColumn("arrival_year", F.date_format(F.col("arrival_date"), "y"))
-    travel_data_clean = travel_data_clean.withColumn("arrival_month", F.date_format(F.col("arrival_date"), "M"))
-    travel_data_clean = travel_data_clean.withColumn("arrival_day", F.date_format(F.col("arrival_date"), "d"))
+    # Replace the SAS date with the arrival year, month, and day
+    travel_data_clean = with_arrival_date_parts(travel_data)
 
-    # Drop additional column and filter out nulls from gender 
-    travel_data_clean = travel_data_clean.drop(F.col('arrival_date'))
+    # Filter out nulls from gender 
     travel_data_clean = travel_data_clean.filter(travel_data_clean.gender.isNotNull())
 
     # Cast datatypes to the appropriate column types
-    travel_data_final = travel_data_clean.selectExpr("iata_code", "cast(age as int) as age", "cast(visa as int) as visa","gender","cast(year_of_birth as int) as year_of_birth", "cast(arrival_year as int) as arrival_year", "cast(arrival_month as int) as arrival_month", "cast(arrival_day as int) as arrival_day")
+    travel_data_final = travel_data_clean.selectExpr("iata_code", "cast(age as int) as age", "cast(visa as int) as visa","gender","cast(year_of_birth as int) as year_of_birth", "arrival_year", "arrival_month", "arrival_day",
+                                                     *(["source"] if incremental else []))
+
+    # Split parts are sized from a compressed sample of the output and the rows kept, counted above from the cached rows
+    row_bytes = estimated_size_spark(travel_data_final.drop('source'), config, 1) if split_outputs(config) else 0
 
-    # Export the dataframe to csv format
-    travel_data_final.write.mode("overwrite").csv(config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['TRAVELERS'])
+    # Write only the new files into their partitions and record them in the ledger for etl.py to copy
+    if incremental:
+        # A changed file may no longer cover every month it wrote before, so its previous rows are removed and those months copied again
+        previous = set()
+        for f in new_files:
+            for partition in ledger['files'].get(f, {}).get('partitions', []):
+                shutil.rmtree(os.path.join(output_path(config, 'TRAVELERS') + partition, 'source=' + os.path.basename(f)), ignore_errors=True)
+                previous.add(partition)
+        sources = write_travelers_partitions(travel_data_final, config, row_bytes)
+        partitions = set().union(*sources.values())
+        if split_outputs(config):
+            for partition in previous - partitions:
+                path = output_path(config, 'TRAVELERS') + partition
+                write_copy_manifest(config, os.path.relpath(path, config['OUTPUT']['FOLDER']), staged_files(path))
+        # Each file records only the partitions it wrote, so a later change to it only removes and reloads its own months
+        for f in new_files:
+            ledger['files'][f] = dict(file_signature(f), partitions=sources.get(os.path.basename(f), []))
+        ledger['pending'] = sorted(set(ledger['pending']) | previous | partitions)
+    else:
+        # Export the dataframe to the configured staging format
+        write_travelers(travel_data_final, config, output_path(config, 'TRAVELERS'), row_bytes * counts['rows_out'])
+
+    flagged.unpersist()
 
     # Remove files that are not necessary for import to redshift
-    for f in os.listdir(config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['TRAVELERS']):
-        if f.endswith('crc') or f.startswith('_'):
-            os.remove(f"{config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['TRAVELERS']}/{f}")
-
-def upload_to_s3(config):
-    """
-    Upload the data files to S3 to be loaded into Redshift
-    """
-    s3 = boto3.resource('s3',
-                       region_name=config['AWS']['REGION'],
-                       aws_access_key_id=config['AWS']['KEY'],
-                       aws_secret_access_key=config['AWS']['SECRET']
-                    )
-    s3.Bucket(config['S3']['BUCKET']).upload_file(config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['CITIES'],config['S3']['FOLDER'] + '/' + config['OUTPUT']['CITIES'])
-    s3.Bucket(config['S3']['BUCKET']).upload_file(config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['AIRPORTS'],config['S3']['FOLDER'] + '/' + config['OUTPUT']['AIRPORTS'])
-    s3.Bucket(config['S3']['BUCKET']).upload_file(config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['TEMPERATURES'],config['S3']['FOLDER'] + '/' + config['OUTPUT']['TEMPERATURES'])
-    for f in os.listdir(config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['TRAVELERS']):
-        if f.endswith('csv'):
-            # Since travelers is a folder we don't need the trailing slash between the folder and the file name
-            s3.Bucket(config['S3']['BUCKET']).upload_file(config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT']['TRAVELERS'] + f, config['S3']['FOLDER'] + '/' + config['OUTPUT']['TRAVELERS'] + f)
-            
+    for folder, dirs, files in os.walk(output_path(config, 'TRAVELERS')):
+        for f in files:
+            if f.endswith('crc') or f.startswith('_'):
+                os.remove(os.path.join(folder, f))
+
+    if incremental:
+        save_ledger(config, ledger)
+
+def file_hash(path):
+    """
+    Calculate the SHA-256 content hash of a file reading it in blocks
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def manifest_path(config):
+    """
+    Return the path of the upload manifest holding the content hash of each uploaded S3 key
+    """
+    return config['OUTPUT']['FOLDER'] + '/' + config['S3'].get('MANIFEST', 'upload_manifest.json')
+
+def load_manifest(config):
+    """
+    Load the upload manifest from the output folder or return an empty one on the first run
+    """
+    if not os.path.exists(manifest_path(config)):
+        return {}
+    with open(manifest_path(config)) as f:
+        return json.load(f)
+
+def save_manifest(config, manifest):
+    """
+    Write the upload manifest back to the output folder
+    """
+    with open(manifest_path(config), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+def dataset_key_patterns(config, key):
+    """
+    Return the S3 key patterns that the files of a staging dataset can have: every file under a folder such as travelers, or
+    the single file and the numbered parts of a split dataset, along with their COPY manifests
+    """
+    if output_name(config, key).endswith('/'):
+        patterns = [s3_key(config, output_path(config, key)) + '*']
+    else:
+        patterns = [s3_key(config, output_path(config, key)), s3_key(config, part_path(config, key))]
+    manifest = s3_key(config, copy_manifest_path(config, output_name(config, key)))
+    # Travelers partitions have their own manifests in a folder named after the dataset
+    return patterns + [manifest, manifest[:-len('.manifest')] + '/*']
+
+def s3_client(config):
+    """
+    Create the S3 client, pointed at S3 ENDPOINT_URL when set so a local S3 stand-in such as MinIO can be used
+    """
+    return boto3.client('s3',
+                        region_name=config['AWS']['REGION'],
+                        aws_access_key_id=config['AWS']['KEY'],
+                        aws_secret_access_key=config['AWS']['SECRET'],
+                        endpoint_url=config.get('S3', 'ENDPOINT_URL', fallback=None) or None
+                      )
+
+def upload_to_s3(config, keys=('CITIES', 'AIRPORTS', 'TEMPERATURES', 'TRAVELERS')):
+    """
+    Upload the data files to S3 to be loaded into Redshift, skipping files whose content is unchanged since the last upload
+    and datasets that etl.py loads directly
+    """
+    direct = [key for key in keys if loads_directly(config, key)]
+    if direct:
+        print('Skipping the S3 upload of {}, which etl.py loads directly'.format(', '.join(direct)))
+        keys = tuple(key for key in keys if key not in direct)
+    if not keys:
+        return
+
+    with measure('upload_to_s3 ' + ','.join(key.lower() for key in keys), 'upload'):
+        s3 = s3_client(config)
+        bucket = config['S3']['BUCKET']
+        transfer_config = TransferConfig(multipart_threshold=int(config['S3'].get('MULTIPART_THRESHOLD_MB', '16')) * 1024 * 1024,
+                                         multipart_chunksize=int(config['S3'].get('MULTIPART_CHUNKSIZE_MB', '16')) * 1024 * 1024)
+        files = [item for key in keys for item in dataset_files(config, key)]
+
+        # Hash the files and compare against the manifest to find the ones that need uploading
+        with MANIFEST_LOCK:
+            manifest = load_manifest(config)
+        hashes = {s3_key: file_hash(path) for path, s3_key in files}
+        pending = [(path, s3_key) for path, s3_key in files if manifest.get(s3_key) != hashes[s3_key]]
+
+        # Upload the changed files concurrently through the shared client
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=int(config['S3'].get('UPLOAD_WORKERS', '8'))) as executor:
+            list(executor.map(lambda item: s3.upload_file(item[0], bucket, item[1], Config=transfer_config), pending))
+        uploaded_bytes = sum(os.path.getsize(path) for path, s3_key in pending)
+        add('bytes_uploaded', uploaded_bytes)
+
+        # Remove objects from previous runs that no longer exist locally so re-runs do not leave duplicate traveler files or parts
+        patterns = [pattern for key in keys for pattern in dataset_key_patterns(config, key)]
+        stale = [s3_key for s3_key in manifest if s3_key not in hashes and any(fnmatch.fnmatchcase(s3_key, pattern) for pattern in patterns)]
+        for i in range(0, len(stale), 1000):
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': s3_key} for s3_key in stale[i:i + 1000]]})
+
+        # Record the uploaded content hashes so the next run can skip unchanged files
+        with MANIFEST_LOCK:
+            manifest = load_manifest(config)
+            for s3_key in stale:
+                manifest.pop(s3_key, None)
+            manifest.update(hashes)
+            save_manifest(config, manifest)
+
+        print('Uploaded {} files ({} bytes) in {:.2f}s, skipped {} unchanged, removed {} stale'.format(
+            len(pending), uploaded_bytes, time.time() - start, len(files) - len(pending), len(stale)))
+
+# Prep stages keyed by the staging dataset they write, each independent of the others
+STAGES = {
+    'CITIES': prep_cities_data,
+    'AIRPORTS': prep_airport_data,
+    'TEMPERATURES': prep_temperature_data,
+    'TRAVELERS': prep_travelers_data
+}
+
+def stage_inputs(config, key):
+    """
+    List the input files a prep stage reads
+    """
+    # Travelers are filtered to known airports and temperatures are matched to cities through the airport locations
+    if key == 'TRAVELERS':
+        return travelers_input_files(config) + [config['INPUT']['AIRPORTS']]
+    if key == 'TEMPERATURES':
+        return [config['INPUT'][key], config['INPUT']['AIRPORTS']]
+    return [config['INPUT'][key]]
+
+def run_cached_stage(config, key, force=False):
+    """
+    Run a prep stage unless its inputs, settings and code match the fingerprint recorded with its existing output, returning whether it ran
+    """
+    with measure(STAGES[key].__name__, 'prep') as record:
+        fingerprint = stage_fingerprint(config, key, STAGES[key], stage_inputs(config, key))
+        if not force and output_exists(config, key) and load_fingerprint(config, key) == fingerprint:
+            print('{} output is up to date, skipping the stage'.format(key))
+            record['status'] = 'skipped'
+            return False
+        STAGES[key](config)
+        save_fingerprint(config, key, fingerprint)
+        add('bytes_written', sum(os.path.getsize(path) for path, s3_key in dataset_files(config, key)))
+        return True
+
+def run_stage(key, config_file, force=False):
+    """
+    Run a single prep stage in a worker process and return how long it took
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    start = time.time()
+    try:
+        run_cached_stage(config, key, force)
+    finally:
+        # Workers are reused for other stages, so the Spark JVM is released as soon as the stage that started it is done
+        stop_spark_session()
+    return time.time() - start
+
+def run_pipeline(config, config_file='config.cfg', force=False):
+    """
+    Run all prep stages at the same time in a process pool and upload each stage to S3 as soon as its output is written
+    """
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=config.getint('PIPELINE', 'WORKERS', fallback=len(STAGES))) as stage_pool, \
+            ThreadPoolExecutor(max_workers=len(STAGES)) as upload_pool:
+        stage_futures = {stage_pool.submit(run_stage, key, config_file, force): key for key in STAGES}
+        upload_futures = {}
+        for future in as_completed(stage_futures):
+            key = stage_futures[future]
+            try:
+                print('######## PREP {} DATA finished in {:.2f}s ###########'.format(key, future.result()))
+                if uploads_to_s3(config):
+                    upload_futures[upload_pool.submit(upload_to_s3, config, (key,))] = key
+            except Exception as exc:
+                print('Unexpected error running {} stage: {}'.format(key, exc))
+        for future in as_completed(upload_futures):
+            try:
+                future.result()
+            except Exception as exc:
+                print('Unexpected error uploading {} data: {}'.format(upload_futures[future], exc))
+    print('######## PIPELINE finished in {:.2f}s ###########'.format(time.time() - start))
+
 def main():
     """
     Main program entry point to load file data into dataframes, manipulate and write back out into files for staging import
@@ -255,24 +1198,41 @@ def main():
     try:
         config = configparser.ConfigParser()
         config.read('config.cfg')
+        run_id = start_run(config)
+
+        # Rebuild every stage even when its output is up to date
+        force = '--force' in sys.argv[1:]
+
+        if config.getboolean('PIPELINE', 'PARALLEL', fallback=False):
+            run_pipeline(config, force=force)
+            print ('######## RUN SUMMARY ###########')
+            print_summary(run_id)
+            return
         
         print ('######## PREP CITY DATA ###########')
-        prep_cities_data(config)
+        run_cached_stage(config, 'CITIES', force)
 
         print ('######## PREP AIRPORT DATA ###########')
-        prep_airport_data(config)
+        run_cached_stage(config, 'AIRPORTS', force)
 
         print ('######## PREP TEMPERATURE DATA ###########')
-        prep_temperature_data(config)
+        run_cached_stage(config, 'TEMPERATURES', force)
 
         print ('######## PREP TRAVELERS DATA ###########')
-        prep_travelers_data(config)
+        run_cached_stage(config, 'TRAVELERS', force)
         
-        print ('######## UPLOAD TO S3 ###########')
-        upload_to_s3(config)
+        if uploads_to_s3(config):
+            print ('######## UPLOAD TO S3 ###########')
+            upload_to_s3(config)
+
+        print ('######## RUN SUMMARY ###########')
+        print_summary(run_id)
 
     except Exception as exc:
         print('Unexpected error running program: {}'.format(exc))
+    finally:
+        # Release the Spark JVM started by any Spark stage, whether or not the travelers stage ran
+        stop_spark_session()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
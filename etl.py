@@ -1,72 +1,278 @@
 import configparser
-import psycopg2
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from sql_queries import copy_table_queries, insert_table_queries, validation_queries, staging_validation_queries
+from sql_queries import staging_travelers_copy, staging_travelers_truncate, staging_travelers_partition_copy, load_graph
+from sql_queries import upsert_table_queries, upsert_load_graph
+from sql_queries import staging_cities_copy, staging_airports_copy, staging_temperatures_copy
+from ledger import load_ledger, save_ledger
+from warehouse import connect, connection_pool, warehouse_type
+from instrumentation import start_run, measure, add, statement_name, print_summary
+from staging_files import loads_directly, read_output_table, read_staging_file, data_files
+from psycopg2.extras import execute_values
+import pyarrow.csv as pa_csv
+import io
 import json
+import time
 
-def load_staging_tables(cur, conn):
+# Staging tables that datasets are loaded into directly from the output folder, with the COPY from S3 the direct load replaces.
+# Redshift only loads the small datasets in DIRECT_LOAD_KEYS this way, while PostgreSQL, which cannot read from S3, loads all of them
+DIRECT_LOADS = {
+    'CITIES': ('staging_cities', staging_cities_copy),
+    'AIRPORTS': ('staging_airports', staging_airports_copy),
+    'TEMPERATURES': ('staging_temperatures', staging_temperatures_copy),
+    'TRAVELERS': ('staging_travelers', staging_travelers_copy)
+}
+
+# Rows sent per INSERT statement when loading directly into Redshift
+DIRECT_INSERT_ROWS = 1000
+
+def load_staging_tables(cur, conn, queries=copy_table_queries):
     """
     Loads staging data from S3 into staging tables via `copy_table_queries` list.
     """
-    for query in copy_table_queries:
+    for query in queries:
         try:
-            cur.execute(query)
+            with measure(statement_name(query), 'sql'):
+                cur.execute(query)
+                add('rows_out', cur.rowcount)
             conn.commit()
         except Exception as exc:
             print('Unexpected error running copy query: {} {}'.format(query, exc))
-            cur.execute('rollback')
+            conn.rollback()
+
+
+def direct_copy(cur, config, key, partition=None):
+    """
+    Streams a staging dataset, or one arrival_year/arrival_month partition of travelers, from the local output folder straight into
+    its staging table over the connection. PostgreSQL loads each file with COPY FROM STDIN from an in-memory CSV buffer, so only one
+    part is held in memory at a time, while Redshift, which only copies from S3 and other AWS sources, loads small datasets with multi-row inserts.
+    """
+    table = DIRECT_LOADS[key][0]
+    if warehouse_type(config) == 'redshift':
+        data = read_output_table(config, key)
+        execute_values(cur, 'INSERT INTO {} VALUES %s'.format(table), [tuple(row.values()) for row in data.to_pylist()], page_size=DIRECT_INSERT_ROWS)
+        add('rows_out', data.num_rows)
+        return
+
+    for path in data_files(config, key, partition):
+        data = read_staging_file(config, key, path)
+        buffer = io.BytesIO()
+        pa_csv.write_csv(data, buffer, pa_csv.WriteOptions(include_header=False))
+        buffer.seek(0)
+        cur.copy_expert('COPY {} FROM STDIN WITH (FORMAT csv)'.format(table), buffer)
+        add('rows_out', data.num_rows)
+
+def direct_load_keys(config):
+    """
+    Return the staging datasets etl.py loads from the local output folder, which is every dataset for PostgreSQL and those
+    small enough for ETL DIRECT_LOAD_MB for Redshift. DuckDB reads the files itself in its COPY statements
+    """
+    if warehouse_type(config) == 'postgres':
+        return list(DIRECT_LOADS)
+    return [key for key in DIRECT_LOADS if loads_directly(config, key)]
 
 
-def insert_tables(cur, conn):
+def load_direct_tables(cur, conn, config, keys):
+    """
+    Loads staging datasets straight into their staging tables from the local output folder instead of copying them from S3
+    """
+    for key in keys:
+        try:
+            with measure('direct load ' + DIRECT_LOADS[key][0], 'sql'):
+                direct_copy(cur, config, key)
+            conn.commit()
+        except Exception as exc:
+            print('Unexpected error running direct load: {} {}'.format(key, exc))
+            conn.rollback()
+
+
+def ledger_partitions(ledger, reload):
+    """
+    Return the travelers partitions to copy, which are the partitions waiting in the ledger, or every partition recorded in it
+    when the travelers table was recreated and has to be loaded again from the start
+    """
+    partitions = set(ledger['pending'])
+    if reload:
+        partitions.update(partition for entry in ledger['files'].values() for partition in entry['partitions'])
+    return sorted(partitions)
+
+def load_travelers_partitions(cur, conn, config, reload=False):
+    """
+    Replaces the staging travelers data with the arrival_year/arrival_month partitions recorded in the ledger by dataprep.py, either
+    only those not loaded yet or, with `reload`, all of them
+    """
+    ledger = load_ledger(config)
+    cur.execute(staging_travelers_truncate)
+    conn.commit()
+    for partition in ledger_partitions(ledger, reload):
+        try:
+            # PostgreSQL cannot read from S3 so the partition is streamed from the output folder
+            if warehouse_type(config) == 'postgres':
+                with measure('direct load staging_travelers ' + partition, 'sql'):
+                    direct_copy(cur, config, 'TRAVELERS', partition)
+            else:
+                with measure(statement_name(staging_travelers_partition_copy(partition)), 'sql'):
+                    cur.execute(staging_travelers_partition_copy(partition))
+                    add('rows_out', cur.rowcount)
+            conn.commit()
+            if partition in ledger['pending']:
+                ledger['pending'].remove(partition)
+        except Exception as exc:
+            print('Unexpected error running copy for partition: {} {}'.format(partition, exc))
+            conn.rollback()
+    save_ledger(config, ledger)
+
+
+def insert_tables(cur, conn, queries=insert_table_queries):
     """
     Selects data from staging tables and imports into new data model schema via `insert_table_queries` list.
     """
-    for query in insert_table_queries:
+    for query in queries:
         try:
-            cur.execute(query)
+            with measure(statement_name(query), 'sql'):
+                cur.execute(query)
+                add('rows_out', cur.rowcount)
             conn.commit()
         except Exception as exc:
             print('Unexpected error running insert query: {} {}'.format(query, exc))
-            cur.execute('rollback')
+            conn.rollback()
    
+def run_step(pool, name, action):
+    """
+    Runs a single load step on a connection from the pool and returns how long it took
+    """
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        start = time.time()
+        try:
+            with measure(name, 'sql'):
+                if callable(action):
+                    action(cur, conn)
+                else:
+                    cur.execute(action)
+                    add('rows_out', cur.rowcount)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return time.time() - start
+    finally:
+        pool.putconn(conn)
+
+def run_load_graph(pool, graph, workers):
+    """
+    Runs the steps of a load graph on a pool of connections, starting each step as soon as the steps it depends on have finished
+    """
+    timings = {}
+    failed = set()
+    pending = dict(graph)
+    running = {}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            # Skip any step whose dependencies failed and start every step whose dependencies are complete
+            for name, (action, dependencies) in list(pending.items()):
+                if any(dependency in failed for dependency in dependencies):
+                    print('Skipping load step {} since a dependency failed'.format(name))
+                    failed.add(name)
+                    del pending[name]
+                elif all(dependency in timings for dependency in dependencies):
+                    running[executor.submit(run_step, pool, name, action)] = name
+                    del pending[name]
+            if not running:
+                # Remaining steps depend on steps that are not in the graph so they can never start
+                for name in pending:
+                    print('Skipping load step {} since its dependencies are not in the load graph'.format(name))
+                    failed.add(name)
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    timings[name] = future.result()
+                except Exception as exc:
+                    print('Unexpected error running load step: {} {}'.format(name, exc))
+                    failed.add(name)
+
+    # Report the time taken by each step along with the total wall clock time
+    for name in graph:
+        print('{:<30} {}'.format(name, 'failed' if name in failed else '{:.2f}s'.format(timings[name])))
+    print('{:<30} {:.2f}s'.format('total', time.time() - start))
+    return timings
+
 def validate_tables(cur, conn, queries):
     """
     Prints results from a collection of queries
     """
     for query in queries:
         try:
-            cur.execute(query)
-            result = cur.fetchone()
+            with measure(statement_name(query), 'sql'):
+                cur.execute(query)
+                result = cur.fetchone()
+                add('rows_out', cur.rowcount)
             print('{} - {}'.format(query, result[0]))
             conn.commit()
         except Exception as exc:
             print('Unexpected error running validation query: {} {}'.format(query, exc))
-            cur.execute('rollback')
+            conn.rollback()
 
 
 def main():
     """
-    Main program entry point to connect to Redshift cluster and load, insert and validate data in tables
+    Main program entry point to connect to the warehouse and load, insert and validate data in tables
     """
     try:
         config = configparser.ConfigParser()
         config.read('config.cfg')
+        run_id = start_run(config)
 
-        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+        conn = connect(config)
         cur = conn.cursor()
 
-        print ('######## LOADING STAGING DATA ###########')
-        load_staging_tables(cur, conn)
+        # A full load recreates the travelers table, so incremental travelers then copy every partition in the ledger rather than only the new ones
+        incremental = config.getboolean('INPUT', 'TRAVELERS_INCREMENTAL', fallback=False)
+        upsert = config.get('ETL', 'LOAD_MODE', fallback='full').lower() == 'incremental'
+        # Incremental travelers are loaded partition by partition from the ledger instead
+        direct = [key for key in direct_load_keys(config) if not (incremental and key == 'TRAVELERS')]
+
+        if config.getboolean('ETL', 'PARALLEL', fallback=False):
+            print ('######## LOADING STAGING DATA AND STAR SCHEMA ###########')
+            graph = dict(upsert_load_graph if upsert else load_graph)
+            if incremental:
+                graph['staging_travelers'] = (lambda cur, conn: load_travelers_partitions(cur, conn, config, reload=not upsert), [])
+            for key in direct:
+                graph[DIRECT_LOADS[key][0]] = (lambda cur, conn, key=key: direct_copy(cur, config, key), [])
+            workers = config.getint('ETL', 'CONNECTIONS', fallback=4)
+            pool = connection_pool(config, workers)
+            run_load_graph(pool, graph, workers)
+            pool.closeall()
 
-        print ('######## STAGING DATA VALIDATAION ###########')
-        validate_tables(cur, conn, staging_validation_queries)
+            print ('######## STAGING DATA VALIDATAION ###########')
+            validate_tables(cur, conn, staging_validation_queries)
+        else:
+            start = time.time()
+            print ('######## LOADING STAGING DATA ###########')
+            skipped = [DIRECT_LOADS[key][1] for key in direct] + ([staging_travelers_copy] if incremental else [])
+            load_staging_tables(cur, conn, [query for query in copy_table_queries if query not in skipped])
+            load_direct_tables(cur, conn, config, direct)
+            if incremental:
+                load_travelers_partitions(cur, conn, config, reload=not upsert)
 
-        print ('######## LOADING DATA INTO STAR SCHEMA ###########')
-        insert_tables(cur, conn)
+            print ('######## STAGING DATA VALIDATAION ###########')
+            validate_tables(cur, conn, staging_validation_queries)
+
+            print ('######## LOADING DATA INTO STAR SCHEMA ###########')
+            insert_tables(cur, conn, upsert_table_queries if upsert else insert_table_queries)
+            print('Loaded staging data and star schema in {:.2f}s'.format(time.time() - start))
 
         print ('######## TRANSFORMED DATA VALIDATAION ###########')
         validate_tables(cur, conn, validation_queries)
 
         conn.close()
+
+        print ('######## RUN SUMMARY ###########')
+        print_summary(run_id)
     except Exception as exc:
         print('Unexpected error running program: {}'.format(exc))
 
@@ -0,0 +1,109 @@
+import datetime
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Steps being measured in the current thread, innermost last, so counters are added to the step that is running
+ACTIVE = threading.local()
+
+# Serializes appends to the metrics log from the threads of one process
+LOG_LOCK = threading.Lock()
+
+
+def start_run(config):
+    """
+    Start a new instrumented run, sharing its id and metrics log with worker processes through the environment
+    """
+    os.environ['PIPELINE_RUN_ID'] = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:6]
+    os.environ['PIPELINE_METRICS'] = config.get('INSTRUMENTATION', 'LOG', fallback='pipeline_metrics.jsonl')
+    return os.environ['PIPELINE_RUN_ID']
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of this process so far in MB. This is the high-water mark since the process started,
+    not the peak of a single step, so a step only shows its own peak when it raises the mark
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes while macOS reports bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def add(counter, amount):
+    """
+    Add to a counter such as rows_in, rows_out, bytes_written or bytes_uploaded on the step being measured in this thread
+    """
+    records = getattr(ACTIVE, 'records', [])
+    if records and amount is not None and amount >= 0:
+        records[-1][counter] = records[-1].get(counter, 0) + amount
+
+def emit(record):
+    """
+    Append a step record to the metrics log of the current run as a JSON line
+    """
+    path = os.environ.get('PIPELINE_METRICS')
+    if not path:
+        return
+    with LOG_LOCK, open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+@contextmanager
+def measure(step, kind):
+    """
+    Measure a pipeline step, recording its wall time, status, the peak RSS of the process so far and any counters added while it runs
+    """
+    record = {'run': os.environ.get('PIPELINE_RUN_ID'), 'step': step, 'kind': kind,
+              'started': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'pid': os.getpid()}
+    if not hasattr(ACTIVE, 'records'):
+        ACTIVE.records = []
+    ACTIVE.records.append(record)
+    start = time.time()
+    try:
+        yield record
+        record.setdefault('status', 'ok')
+    except Exception as exc:
+        record['status'] = 'failed'
+        record['error'] = str(exc)
+        raise
+    finally:
+        ACTIVE.records.pop()
+        record['seconds'] = round(time.time() - start, 3)
+        record['process_peak_rss_mb'] = peak_rss_mb()
+        emit(record)
+
+def statement_name(query):
+    """
+    Return a short single-line name for a SQL statement
+    """
+    name = ' '.join(query.split())
+    return name if len(name) <= 60 else name[:57] + '...'
+
+def load_run(run_id):
+    """
+    Load the records of a run from the metrics log, including those written by worker processes
+    """
+    path = os.environ.get('PIPELINE_METRICS')
+    if not path or not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [record for record in map(json.loads, f) if record['run'] == run_id]
+
+def print_summary(run_id):
+    """
+    Print a table of the steps recorded for a run
+    """
+    def count(value):
+        return '' if value is None else str(value)
+
+    def megabytes(value):
+        return '' if value is None else '{:.1f}'.format(value / 1024 ** 2)
+
+    print('{:<62} {:<7} {:>9} {:>12} {:>12} {:>15} {:>10} {:>11}'.format(
+        'step', 'status', 'seconds', 'rows in', 'rows out', 'process peak MB', 'MB written', 'MB uploaded'))
+    for record in load_run(run_id):
+        print('{:<62} {:<7} {:>9.2f} {:>12} {:>12} {:>15.1f} {:>10} {:>11}'.format(
+            record['step'], record['status'], record['seconds'], count(record.get('rows_in')), count(record.get('rows_out')),
+            record['process_peak_rss_mb'], megabytes(record.get('bytes_written')), megabytes(record.get('bytes_uploaded'))))
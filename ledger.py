@@ -0,0 +1,39 @@
+import json
+import os
+
+
+def ledger_path(config):
+    """
+    Return the path of the travelers ledger within the output folder
+    """
+    return config['OUTPUT']['FOLDER'] + '/' + config['OUTPUT'].get('TRAVELERS_LEDGER', 'travelers_ledger.json')
+
+def load_ledger(config):
+    """
+    Load the ledger of processed travelers files and partitions still waiting to be copied into Redshift
+    """
+    if not os.path.exists(ledger_path(config)):
+        return {'files': {}, 'pending': []}
+    with open(ledger_path(config)) as f:
+        return json.load(f)
+
+def save_ledger(config, ledger):
+    """
+    Write the travelers ledger back to the output folder
+    """
+    with open(ledger_path(config), 'w') as f:
+        json.dump(ledger, f, indent=2, sort_keys=True)
+
+def file_signature(path):
+    """
+    Return the size and modification time used to tell whether an input file has changed since it was processed
+    """
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def is_processed(ledger, path):
+    """
+    Check whether an input file was already processed and has not changed since
+    """
+    entry = ledger['files'].get(path)
+    return entry is not None and {'size': entry['size'], 'mtime': entry['mtime']} == file_signature(path)
@@ -0,0 +1,64 @@
+import glob
+import math
+import os
+import time
+from pyspark.sql import SparkSession
+from instrumentation import measure
+
+# Connector used to read the I94 SAS files, resolved over the network only when it is not in the local jar cache
+SAS_PACKAGE = 'saurfang:spark-sas7bdat:2.0.0-s_2.11'
+
+
+def cached_jars(jars_dir):
+    """
+    List the connector jars in the local cache, either copied into the folder or downloaded into its jars subfolder by a previous online run
+    """
+    return sorted(glob.glob(os.path.join(jars_dir, '*.jar')) + glob.glob(os.path.join(jars_dir, 'jars', '*.jar')))
+
+def shuffle_partitions(config, input_bytes):
+    """
+    Size the shuffle partitions to the input at one per SPARK SHUFFLE_PARTITION_MB, with at least MIN_SHUFFLE_PARTITIONS
+    """
+    partition_bytes = config.getint('SPARK', 'SHUFFLE_PARTITION_MB', fallback=128) * 1024 * 1024
+    return max(config.getint('SPARK', 'MIN_SHUFFLE_PARTITIONS', fallback=8), math.ceil(input_bytes / partition_bytes))
+
+def spark_session(config, input_bytes=0):
+    """
+    Return the Spark session for the prep stages with the SAS reader available, starting it on the first call with the
+    cached connector jars, the configured driver and executor memory, adaptive query execution and Kryo serialization.
+    Shuffle partitions are set for the input of each stage, since they can change on a running session
+    """
+    spark = SparkSession.getActiveSession()
+    if spark is None:
+        jars_dir = os.path.abspath(config.get('SPARK', 'JARS_DIR', fallback='jars'))
+        builder = SparkSession.builder.appName('dataprep')\
+            .config('spark.driver.memory', config.get('SPARK', 'DRIVER_MEMORY', fallback='4g'))\
+            .config('spark.executor.memory', config.get('SPARK', 'EXECUTOR_MEMORY', fallback='4g'))\
+            .config('spark.sql.adaptive.enabled', 'true')\
+            .config('spark.sql.adaptive.coalescePartitions.enabled', 'true')\
+            .config('spark.serializer', 'org.apache.spark.serializer.KryoSerializer')
+
+        # Load the connector from the local cache so batch hosts without network access start the same way,
+        # otherwise resolve it once into the cache so the next run finds it there
+        jars = cached_jars(jars_dir)
+        if jars:
+            builder = builder.config('spark.jars', ','.join(jars))
+        else:
+            builder = builder.config('spark.jars.packages', config.get('SPARK', 'PACKAGES', fallback=SAS_PACKAGE))\
+                .config('spark.jars.ivy', jars_dir)
+
+        start = time.time()
+        with measure('spark_session', 'startup'):
+            spark = builder.enableHiveSupport().getOrCreate()
+        print('Started Spark {} in {:.2f}s with {} cached jars'.format(spark.version, time.time() - start, len(jars)))
+
+    spark.conf.set('spark.sql.shuffle.partitions', str(shuffle_partitions(config, input_bytes)))
+    return spark
+
+def stop_spark_session():
+    """
+    Stop the active Spark session, if there is one, releasing its JVM
+    """
+    spark = SparkSession.getActiveSession()
+    if spark is not None:
+        spark.stop()
@@ -5,6 +5,9 @@ import configparser
 config = configparser.ConfigParser()
 config.read('config.cfg')
 
+# The warehouse the queries run against, either redshift, postgres or duckdb
+WAREHOUSE = config.get('WAREHOUSE', 'TYPE', fallback='redshift').lower()
+
 # DROP TABLES
 
 staging_travelers_table_drop = "DROP TABLE IF EXISTS staging_travelers"
@@ -18,6 +21,8 @@ airports_table_drop = "DROP TABLE IF EXISTS airports"
 temperatures_table_drop = "DROP TABLE IF EXISTS temperatures"
 statistics_table_drop = "DROP TABLE IF EXISTS statistics"
 travelers_table_drop = "DROP TABLE IF EXISTS travelers"
+travelers_daily_agg_drop = "DROP TABLE IF EXISTS travelers_daily_agg"
+travelers_monthly_agg_drop = "DROP TABLE IF EXISTS travelers_monthly_agg"
 
 # CREATE TABLES
 staging_travelers_table_create= ("""
@@ -42,7 +47,8 @@ CREATE TABLE IF NOT EXISTS staging_airports (
     city VARCHAR,
     long VARCHAR,
     lat VARCHAR,
-    state VARCHAR
+    state VARCHAR,
+    city_id BIGINT
     )
 """)
 
@@ -70,7 +76,8 @@ CREATE TABLE IF NOT EXISTS staging_cities (
     per_male                  FLOAT,
     per_female                FLOAT,
     per_veterans              FLOAT,
-    per_foreign_born          FLOAT
+    per_foreign_born          FLOAT,
+    city_id                   BIGINT
     )
 """)
 
@@ -84,143 +91,257 @@ CREATE TABLE IF NOT EXISTS staging_temperatures (
     long                     VARCHAR,
     month                     INTEGER,
     year                      INTEGER,
-    average_temp_month      FLOAT
+    average_temp_month      FLOAT,
+    city_id                 BIGINT
     )
 """)
 
 # STAGING TABLES
 
-staging_travelers_copy = ("""
-copy staging_travelers
+# Staging files are written by dataprep.py as CSV or Snappy-compressed Parquet based on the OUTPUT FORMAT setting
+OUTPUT_FORMAT = config['OUTPUT'].get('FORMAT', 'csv').lower()
+
+staging_csv_copy = ("""
+copy {}
 from 's3://{}/{}/{}'
 iam_role '{}' 
-format as csv;
-""").format(config['S3']['BUCKET'],config['S3']['FOLDER'],config['OUTPUT']['TRAVELERS'],config['IAM_ROLE']['ARN'])
+format as csv{};
+""")
 
-staging_cities_copy = ("""
-copy staging_cities
+staging_parquet_copy = ("""
+copy {}
 from 's3://{}/{}/{}'
 iam_role '{}' 
-format as csv
-IGNOREHEADER 1;
-""").format(config['S3']['BUCKET'],config['S3']['FOLDER'],config['OUTPUT']['CITIES'],config['IAM_ROLE']['ARN'])
+format as parquet;
+""")
 
-staging_airports_copy = ("""
-copy staging_airports
-from 's3://{}/{}/{}'
+# With OUTPUT SPLIT set each staging dataset is written as gzip CSV or Parquet parts, a multiple of the cluster slice count,
+# and loaded through the COPY manifest dataprep.py writes for it so every slice loads parts in parallel
+SPLIT_OUTPUTS = config.getboolean('OUTPUT', 'SPLIT', fallback=False)
+
+staging_csv_manifest_copy = ("""
+copy {}
+from 's3://{}/{}/copy_manifests/{}.manifest'
 iam_role '{}' 
-format as csv
-IGNOREHEADER 1;
-""").format(config['S3']['BUCKET'],config['S3']['FOLDER'],config['OUTPUT']['AIRPORTS'],config['IAM_ROLE']['ARN'])
+format as csv{}
+gzip
+manifest;
+""")
 
-staging_temperatures_copy = ("""
-copy staging_temperatures
-from 's3://{}/{}/{}'
+staging_parquet_manifest_copy = ("""
+copy {}
+from 's3://{}/{}/copy_manifests/{}.manifest'
 iam_role '{}' 
-format as csv
-IGNOREHEADER 1;
-""").format(config['S3']['BUCKET'],config['S3']['FOLDER'],config['OUTPUT']['TEMPERATURES'],config['IAM_ROLE']['ARN'])
+format as parquet
+manifest;
+""")
+
+# DuckDB reads the files straight from the local output folder rather than from S3
+staging_duckdb_copy = ("""
+INSERT INTO {}
+SELECT * FROM {}
+""")
 
+def staging_copy(table, key, header=True, suffix=''):
+    """
+    Build the COPY statement for a staging table from its output file in S3 using the configured output format. PostgreSQL cannot
+    read from S3, so etl.py replaces these statements with a COPY FROM STDIN of the local files when WAREHOUSE TYPE is postgres
+    """
+    name = config['OUTPUT'][key] + suffix
+    if OUTPUT_FORMAT == 'parquet' and name.endswith('.csv'):
+        name = name[:-len('.csv')] + '.parquet'
+    if WAREHOUSE == 'duckdb':
+        path = config['OUTPUT']['FOLDER'] + '/' + name
+        if name.endswith('/'):
+            # Folders such as travelers are read with a recursive glob so partition folders are included
+            path += '**/*.' + ('parquet' if OUTPUT_FORMAT == 'parquet' else 'csv.gz' if SPLIT_OUTPUTS else 'csv')
+        elif SPLIT_OUTPUTS:
+            # Split datasets are read from all of their numbered parts
+            path = path[:-len('.parquet')] + '.*.parquet' if OUTPUT_FORMAT == 'parquet' else path + '.*.gz'
+        # The partition columns are already in the files, so the arrival_year=/arrival_month= folder names are not read as extra columns
+        if OUTPUT_FORMAT == 'parquet':
+            return staging_duckdb_copy.format(table, "read_parquet('{}', hive_partitioning=false)".format(path))
+        return staging_duckdb_copy.format(table, "read_csv_auto('{}', header={}, hive_partitioning=false)".format(path, 'true' if header else 'false'))
+    if SPLIT_OUTPUTS:
+        if OUTPUT_FORMAT == 'parquet':
+            return staging_parquet_manifest_copy.format(table, config['S3']['BUCKET'], config['S3']['FOLDER'], name.rstrip('/'), config['IAM_ROLE']['ARN'])
+        return staging_csv_manifest_copy.format(table, config['S3']['BUCKET'], config['S3']['FOLDER'], name.rstrip('/'), config['IAM_ROLE']['ARN'],
+            '\nIGNOREHEADER 1' if header else '')
+    if OUTPUT_FORMAT == 'parquet':
+        return staging_parquet_copy.format(table, config['S3']['BUCKET'], config['S3']['FOLDER'], name, config['IAM_ROLE']['ARN'])
+    return staging_csv_copy.format(table, config['S3']['BUCKET'], config['S3']['FOLDER'], name, config['IAM_ROLE']['ARN'],
+        '\nIGNOREHEADER 1' if header else '')
+
+staging_travelers_copy = staging_copy('staging_travelers', 'TRAVELERS', header=False)
+staging_cities_copy = staging_copy('staging_cities', 'CITIES')
+staging_airports_copy = staging_copy('staging_airports', 'AIRPORTS')
+staging_temperatures_copy = staging_copy('staging_temperatures', 'TEMPERATURES')
+
+staging_travelers_truncate = "TRUNCATE staging_travelers"
+
+def staging_travelers_partition_copy(partition):
+    """
+    Build the COPY statement for a single arrival_year/arrival_month partition of the travelers output
+    """
+    return staging_copy('staging_travelers', 'TRAVELERS', header=False, suffix=partition + '/')
+
+
+# PHYSICAL DESIGN
+# Distribution styles, sort keys and column encodings are Redshift-only so they are left out when running against PostgreSQL or DuckDB
+
+if WAREHOUSE == 'redshift':
+    design = {
+        'airports_identity': 'IDENTITY(1,1)',
+        'travelers_identity': 'IDENTITY(1,1)',
+        'raw': ' ENCODE raw',
+        'az64': ' ENCODE az64',
+        'zstd': ' ENCODE zstd',
+        # The small dimensions are copied to every node so joins from travelers through airports to city never shuffle
+        'visa_codes': 'DISTSTYLE ALL',
+        'city': 'DISTSTYLE ALL SORTKEY (c_id)',
+        'airports': 'DISTSTYLE ALL SORTKEY (a_id)',
+        # The larger tables are distributed on the keys they are joined and aggregated on
+        'temperatures': 'DISTKEY (t_city_id) SORTKEY (t_year, t_month)',
+        'statistics': 'DISTKEY (s_city_id) SORTKEY (s_city_id)',
+        'travelers': 'DISTKEY (p_airport_id) SORTKEY (p_arrival_year, p_arrival_month, p_arrival_day)',
+        'travelers_daily_agg': 'DISTKEY (d_city_id) SORTKEY (d_arrival_year, d_arrival_month, d_arrival_day)',
+        'travelers_monthly_agg': 'DISTKEY (m_city_id) SORTKEY (m_arrival_year, m_arrival_month)'
+    }
+else:
+    design = {
+        'airports_identity': 'GENERATED BY DEFAULT AS IDENTITY',
+        'travelers_identity': 'GENERATED BY DEFAULT AS IDENTITY',
+        'raw': '',
+        'az64': '',
+        'zstd': '',
+        'visa_codes': '',
+        'city': '',
+        'airports': '',
+        'temperatures': '',
+        'statistics': '',
+        'travelers': '',
+        'travelers_daily_agg': '',
+        'travelers_monthly_agg': ''
+    }
+
+# DuckDB has no identity columns so the ids are drawn from sequences created before the tables
+if WAREHOUSE == 'duckdb':
+    design.update({
+        'airports_identity': "DEFAULT nextval('airports_id_seq')",
+        'travelers_identity': "DEFAULT nextval('travelers_id_seq')"
+    })
+identity_sequence_create = ["CREATE SEQUENCE IF NOT EXISTS {}_id_seq".format(table) for table in ['airports', 'travelers']] if WAREHOUSE == 'duckdb' else []
+identity_sequence_drop = ["DROP SEQUENCE IF EXISTS {}_id_seq".format(table) for table in ['airports', 'travelers']] if WAREHOUSE == 'duckdb' else []
 
 # FINAL TABLES
 
 visa_table_create= ("""
 CREATE TABLE IF NOT EXISTS visa_codes (
-    v_code INTEGER PRIMARY KEY,
-    v_description VARCHAR
+    v_code INTEGER PRIMARY KEY{az64},
+    v_description VARCHAR{zstd}
     )
-""")
+{visa_codes}
+""").format(**design)
 
 visa_table_insert= ("""
 INSERT INTO visa_codes (v_code, v_description) 
 VALUES (1,'Business'),(2, 'Pleasure'),(3,'Student')
 """)
 
+# City ids are the integer keys dataprep.py derives from each city's normalized name and state and writes to every
+# staging file, so the staging tables join to city on integers rather than on names
 city_table_create= ("""
 CREATE TABLE IF NOT EXISTS city (
-    c_id BIGINT IDENTITY(1,1),
-    c_name VARCHAR,
-    c_state_code VARCHAR,
-    c_lat VARCHAR,
-    c_long VARCHAR
+    c_id BIGINT{raw},
+    c_name VARCHAR{zstd},
+    c_state_code VARCHAR{zstd},
+    c_lat VARCHAR{zstd},
+    c_long VARCHAR{zstd}
     )
+{city}
+""").format(**design)
+
+# Cities are built in a single pass from staging airports, taking the coordinates of one representative airport per
+# city so that no UPDATE is needed afterwards. Larger airports are preferred and ties are broken by IATA code.
+city_representative_airports = ("""
+SELECT city_id, city, state, lat, long, row_number() over (partition by city_id
+    order by case type when 'large_airport' then 1 when 'medium_airport' then 2 else 3 end, iata_code) as airport_rank
+from staging_airports
+where city_id is not null
 """)
 
 city_table_insert = ("""
-INSERT INTO city (c_name, c_state_code) 
-SELECT city, state from staging_airports group by city,state
-""")
-
-city_table_update = ("""
-update city set c_lat = lat, c_long = long
-from staging_airports 
-where city.c_name = staging_airports.city and city.c_state_code = staging_airports.state
-"""
-)
+INSERT INTO city (c_id, c_name, c_state_code, c_lat, c_long) 
+SELECT city_id, city, state, lat, long from ({}) as ranked
+where airport_rank = 1
+""").format(city_representative_airports)
 
 airports_table_create=("""
 CREATE TABLE IF NOT EXISTS airports (
-    a_id BIGINT IDENTITY(1,1),
-    a_city_id BIGINT,
-    a_iata_code VARCHAR,
-    a_type VARCHAR,
-    a_name VARCHAR,
-    a_elevation_ft FLOAT
+    a_id BIGINT {airports_identity}{raw},
+    a_city_id BIGINT{az64},
+    a_iata_code VARCHAR{zstd},
+    a_type VARCHAR{zstd},
+    a_name VARCHAR{zstd},
+    a_elevation_ft FLOAT{zstd}
     )
-""")
+{airports}
+""").format(**design)
 
 airports_table_insert= ("""
 INSERT INTO airports (a_city_id, a_iata_code, a_type, a_name, a_elevation_ft) 
 SELECT c.c_id, sa.iata_code, sa.type, sa.name, sa.elevation_ft
 from staging_airports as sa
-join city as c on sa.city = c.c_name and sa.state = c.c_state_code
+join city as c on sa.city_id = c.c_id
 """)
 
 temperatures_table_create = ("""
 CREATE TABLE IF NOT EXISTS temperatures (
-    t_city_id   BIGINT,
-    t_date      VARCHAR,
-    t_month     INTEGER,
-    t_year      INTEGER,
-    t_avg_temp  FLOAT,
-    t_avg_temp_uncertainty FLOAT,
-    t_average_temp_month FLOAT
+    t_city_id   BIGINT{az64},
+    t_date      VARCHAR{zstd},
+    t_month     INTEGER{az64},
+    t_year      INTEGER{raw},
+    t_avg_temp  FLOAT{zstd},
+    t_avg_temp_uncertainty FLOAT{zstd},
+    t_average_temp_month FLOAT{zstd}
     )
-""")
+{temperatures}
+""").format(**design)
 
 temperatures_table_insert= ("""
 INSERT INTO temperatures (t_city_id, t_date, t_month, t_year, t_avg_temp, t_avg_temp_uncertainty, t_average_temp_month) 
 SELECT c.c_id, st.date, st.month, st.year, st.avg_temp, st.avg_temp_uncertainty, st.average_temp_month
 from staging_temperatures as st
-join city as c on st.city = c.c_name
+join city as c on st.city_id = c.c_id
 """)
 
 statistics_table_create = ("""
 CREATE TABLE IF NOT EXISTS statistics (
-    s_city_id   BIGINT,
-    s_population                  INTEGER,
-    s_median_age                FLOAT,
-    s_avg_household             FLOAT,
-    s_cnt_male                    INTEGER,
-    s_per_male                  FLOAT,
-    s_cnt_female                  INTEGER,
-    s_per_female                FLOAT,
-    s_cnt_veterans                INTEGER,
-    s_per_veterans              FLOAT,
-    s_cnt_foreign_born            INTEGER,
-    s_per_foreign_born          FLOAT,
-    s_cnt_white                   INTEGER,
-    s_per_white                 FLOAT,
-    s_cnt_his_latino              INTEGER,
-    s_per_his_latino            FLOAT,
-    s_cnt_asian                   INTEGER,
-    s_per_asian                 FLOAT,
-    s_cnt_amer_ind_ak_native      INTEGER,
-    s_per_amer_ind_ak_native    FLOAT,
-    s_cnt_black                   INTEGER,
-    s_per_black_afr_amer        FLOAT
+    s_city_id   BIGINT{raw},
+    s_population                  INTEGER{az64},
+    s_median_age                FLOAT{zstd},
+    s_avg_household             FLOAT{zstd},
+    s_cnt_male                    INTEGER{az64},
+    s_per_male                  FLOAT{zstd},
+    s_cnt_female                  INTEGER{az64},
+    s_per_female                FLOAT{zstd},
+    s_cnt_veterans                INTEGER{az64},
+    s_per_veterans              FLOAT{zstd},
+    s_cnt_foreign_born            INTEGER{az64},
+    s_per_foreign_born          FLOAT{zstd},
+    s_cnt_white                   INTEGER{az64},
+    s_per_white                 FLOAT{zstd},
+    s_cnt_his_latino              INTEGER{az64},
+    s_per_his_latino            FLOAT{zstd},
+    s_cnt_asian                   INTEGER{az64},
+    s_per_asian                 FLOAT{zstd},
+    s_cnt_amer_ind_ak_native      INTEGER{az64},
+    s_per_amer_ind_ak_native    FLOAT{zstd},
+    s_cnt_black                   INTEGER{az64},
+    s_per_black_afr_amer        FLOAT{zstd}
     )
-""")
+{statistics}
+""").format(**design)
 
 statistics_table_insert = ("""
 INSERT INTO statistics (s_city_id, s_population, s_median_age, s_avg_household, s_cnt_male, s_per_male,
@@ -233,22 +354,23 @@ SELECT c.c_id, population, median_age, avg_household, cnt_male, per_male,
     cnt_white, per_white, cnt_his_latino, per_his_latino, cnt_asian, per_asian, 
     cnt_amer_ind_ak_native, per_amer_ind_ak_native, cnt_black, per_black_afr_amer
 from staging_cities as sc
-join city as c on sc.city = c.c_name and sc.state = c.c_state_code
+join city as c on sc.city_id = c.c_id
 """)
 
 travelers_table_create = ("""
 CREATE TABLE IF NOT EXISTS travelers (
-    p_id BIGINT IDENTITY(1,1),
-    p_airport_id INTEGER,
-    p_age INTEGER,
-    p_visa_code INTEGER,
-    p_gender VARCHAR,
-    p_year_of_birth INTEGER,
-    p_arrival_year INTEGER,
-    p_arrival_month INTEGER,
-    p_arrival_day INTEGER
+    p_id BIGINT {travelers_identity}{az64},
+    p_airport_id INTEGER{az64},
+    p_age INTEGER{az64},
+    p_visa_code INTEGER{az64},
+    p_gender VARCHAR{zstd},
+    p_year_of_birth INTEGER{az64},
+    p_arrival_year INTEGER{raw},
+    p_arrival_month INTEGER{az64},
+    p_arrival_day INTEGER{az64}
     )
-""")
+{travelers}
+""").format(**design)
 
 travelers_table_insert = ("""
 INSERT INTO travelers (p_airport_id, p_age, p_visa_code, p_gender, p_year_of_birth, p_arrival_year, p_arrival_month, p_arrival_day)
@@ -257,6 +379,241 @@ from staging_travelers st
 join airports on a_iata_code = st.iata_code
 """)
 
+# AGGREGATE TABLES
+# Traveler counts and age sums per day and per month by airport, city, visa and gender so the analytics queries do not
+# scan the travelers fact table. Both are refreshed after each load for the arrival months present in staging_travelers.
+
+travelers_daily_agg_create = ("""
+CREATE TABLE IF NOT EXISTS travelers_daily_agg (
+    d_arrival_year INTEGER{raw},
+    d_arrival_month INTEGER{az64},
+    d_arrival_day INTEGER{az64},
+    d_airport_id BIGINT{az64},
+    d_city_id BIGINT{az64},
+    d_visa_code INTEGER{az64},
+    d_gender VARCHAR{zstd},
+    d_traveler_count BIGINT{az64},
+    d_age_sum BIGINT{az64},
+    d_age_count BIGINT{az64}
+    )
+{travelers_daily_agg}
+""").format(**design)
+
+travelers_monthly_agg_create = ("""
+CREATE TABLE IF NOT EXISTS travelers_monthly_agg (
+    m_arrival_year INTEGER{raw},
+    m_arrival_month INTEGER{az64},
+    m_airport_id BIGINT{az64},
+    m_city_id BIGINT{az64},
+    m_visa_code INTEGER{az64},
+    m_gender VARCHAR{zstd},
+    m_traveler_count BIGINT{az64},
+    m_age_sum BIGINT{az64},
+    m_age_count BIGINT{az64}
+    )
+{travelers_monthly_agg}
+""").format(**design)
+
+changed_months = "SELECT DISTINCT arrival_year, arrival_month from staging_travelers"
+
+travelers_daily_agg_delete = ("""
+DELETE FROM travelers_daily_agg
+USING ({}) as changed
+where d_arrival_year = changed.arrival_year and d_arrival_month = changed.arrival_month
+""").format(changed_months)
+
+travelers_daily_agg_insert = ("""
+INSERT INTO travelers_daily_agg (d_arrival_year, d_arrival_month, d_arrival_day, d_airport_id, d_city_id, d_visa_code, d_gender,
+    d_traveler_count, d_age_sum, d_age_count)
+SELECT p_arrival_year, p_arrival_month, p_arrival_day, p_airport_id, a_city_id, p_visa_code, p_gender, count(*), sum(p_age), count(p_age)
+from travelers
+join airports on p_airport_id = a_id
+join ({}) as changed on p_arrival_year = changed.arrival_year and p_arrival_month = changed.arrival_month
+group by p_arrival_year, p_arrival_month, p_arrival_day, p_airport_id, a_city_id, p_visa_code, p_gender
+""").format(changed_months)
+
+travelers_monthly_agg_delete = ("""
+DELETE FROM travelers_monthly_agg
+USING ({}) as changed
+where m_arrival_year = changed.arrival_year and m_arrival_month = changed.arrival_month
+""").format(changed_months)
+
+travelers_monthly_agg_insert = ("""
+INSERT INTO travelers_monthly_agg (m_arrival_year, m_arrival_month, m_airport_id, m_city_id, m_visa_code, m_gender,
+    m_traveler_count, m_age_sum, m_age_count)
+SELECT d_arrival_year, d_arrival_month, d_airport_id, d_city_id, d_visa_code, d_gender, sum(d_traveler_count), sum(d_age_sum), sum(d_age_count)
+from travelers_daily_agg
+join ({}) as changed on d_arrival_year = changed.arrival_year and d_arrival_month = changed.arrival_month
+group by d_arrival_year, d_arrival_month, d_airport_id, d_city_id, d_visa_code, d_gender
+""").format(changed_months)
+
+# UPSERT QUERIES
+# Used by the incremental load mode to merge staging deltas into the existing tables on their natural keys
+
+visa_table_upsert = ("""
+INSERT INTO visa_codes (v_code, v_description)
+SELECT v.v_code, v.v_description
+from (SELECT 1 as v_code, 'Business' as v_description UNION ALL SELECT 2, 'Pleasure' UNION ALL SELECT 3, 'Student') as v
+left join visa_codes as vc on vc.v_code = v.v_code
+where vc.v_code is null
+""")
+
+city_table_upsert = ("""
+INSERT INTO city (c_id, c_name, c_state_code, c_lat, c_long)
+SELECT ranked.city_id, ranked.city, ranked.state, ranked.lat, ranked.long from ({}) as ranked
+left join city as c on ranked.city_id = c.c_id
+where ranked.airport_rank = 1 and c.c_id is null
+""").format(city_representative_airports)
+
+airports_table_update = ("""
+update airports set a_city_id = c.c_id, a_type = sa.type, a_name = sa.name, a_elevation_ft = sa.elevation_ft
+from staging_airports as sa
+join city as c on sa.city_id = c.c_id
+where airports.a_iata_code = sa.iata_code
+""")
+
+airports_table_upsert = ("""
+INSERT INTO airports (a_city_id, a_iata_code, a_type, a_name, a_elevation_ft)
+SELECT c.c_id, sa.iata_code, sa.type, sa.name, sa.elevation_ft
+from staging_airports as sa
+join city as c on sa.city_id = c.c_id
+left join airports as a on a.a_iata_code = sa.iata_code
+where a.a_id is null
+""")
+
+temperatures_table_update = ("""
+update temperatures set t_avg_temp = st.avg_temp, t_avg_temp_uncertainty = st.avg_temp_uncertainty, t_average_temp_month = st.average_temp_month
+from staging_temperatures as st
+join city as c on st.city_id = c.c_id
+where temperatures.t_city_id = c.c_id and temperatures.t_date = st.date
+""")
+
+temperatures_table_upsert = ("""
+INSERT INTO temperatures (t_city_id, t_date, t_month, t_year, t_avg_temp, t_avg_temp_uncertainty, t_average_temp_month)
+SELECT c.c_id, st.date, st.month, st.year, st.avg_temp, st.avg_temp_uncertainty, st.average_temp_month
+from staging_temperatures as st
+join city as c on st.city_id = c.c_id
+left join temperatures as t on t.t_city_id = c.c_id and t.t_date = st.date
+where t.t_city_id is null
+""")
+
+statistics_table_update = ("""
+update statistics set s_population = sc.population, s_median_age = sc.median_age, s_avg_household = sc.avg_household,
+    s_cnt_male = sc.cnt_male, s_per_male = sc.per_male, s_cnt_female = sc.cnt_female, s_per_female = sc.per_female,
+    s_cnt_veterans = sc.cnt_veterans, s_per_veterans = sc.per_veterans, s_cnt_foreign_born = sc.cnt_foreign_born,
+    s_per_foreign_born = sc.per_foreign_born, s_cnt_white = sc.cnt_white, s_per_white = sc.per_white,
+    s_cnt_his_latino = sc.cnt_his_latino, s_per_his_latino = sc.per_his_latino, s_cnt_asian = sc.cnt_asian,
+    s_per_asian = sc.per_asian, s_cnt_amer_ind_ak_native = sc.cnt_amer_ind_ak_native,
+    s_per_amer_ind_ak_native = sc.per_amer_ind_ak_native, s_cnt_black = sc.cnt_black, s_per_black_afr_amer = sc.per_black_afr_amer
+from staging_cities as sc
+join city as c on sc.city_id = c.c_id
+where statistics.s_city_id = c.c_id
+""")
+
+statistics_table_upsert = ("""
+INSERT INTO statistics (s_city_id, s_population, s_median_age, s_avg_household, s_cnt_male, s_per_male,
+    s_cnt_female, s_per_female, s_cnt_veterans, s_per_veterans, s_cnt_foreign_born, s_per_foreign_born, 
+    s_cnt_white, s_per_white, s_cnt_his_latino, s_per_his_latino, s_cnt_asian, s_per_asian, 
+    s_cnt_amer_ind_ak_native, s_per_amer_ind_ak_native, s_cnt_black, s_per_black_afr_amer
+ ) 
+SELECT c.c_id, population, median_age, avg_household, cnt_male, per_male,
+    cnt_female, per_female, cnt_veterans, per_veterans, cnt_foreign_born, per_foreign_born, 
+    cnt_white, per_white, cnt_his_latino, per_his_latino, cnt_asian, per_asian, 
+    cnt_amer_ind_ak_native, per_amer_ind_ak_native, cnt_black, per_black_afr_amer
+from staging_cities as sc
+join city as c on sc.city_id = c.c_id
+left join statistics as s on s.s_city_id = c.c_id
+where s.s_city_id is null
+""")
+
+# Staging travelers hold whole arrival months, every file that added to a partition included, so the months in staging replace
+# the same months in travelers and are then inserted again with travelers_table_insert
+travelers_table_delete = ("""
+DELETE FROM travelers
+USING ({}) as changed
+where p_arrival_year = changed.arrival_year and p_arrival_month = changed.arrival_month
+""").format(changed_months)
+
+# ANALYTICS QUERIES
+# The example queries from the README answered from the monthly aggregate, with the original versions against the travelers
+# fact table kept alongside so the benchmark harness can compare both
+
+average_age_by_city = ("""
+select avg_age, s_median_age, c_name, c_state_code from 
+(select sum(m_age_sum) / nullif(sum(m_age_count), 0) as avg_age, m_city_id as age_city_id from travelers_monthly_agg
+group by m_city_id) as averages
+join city on c_id = age_city_id
+join statistics on s_city_id = c_id
+order by s_median_age desc
+""")
+
+average_age_by_city_fact = ("""
+select avg_age, s_median_age, c_name, c_state_code from 
+(select avg(p_age) as avg_age, a_city_id as age_city_id from travelers 
+join airports on p_airport_id = a_id
+join city on a_city_id = c_id
+group by a_city_id) as averages
+join city on c_id = age_city_id
+join statistics on s_city_id = c_id
+order by s_median_age desc
+""")
+
+travelers_by_foreign_born = ("""
+select c_name, c_state_code, s_per_foreign_born, cnt from statistics join (
+select m_city_id as c_id, sum(m_traveler_count) as cnt from travelers_monthly_agg
+join statistics on s_city_id = m_city_id
+group by m_city_id) as t
+on t.c_id = s_city_id
+join city as c on s_city_id = c.c_id
+order by s_per_foreign_born desc
+""")
+
+travelers_by_foreign_born_fact = ("""
+select c_name, c_state_code, s_per_foreign_born, cnt from statistics join (
+select c_id, count(*) as cnt from travelers 
+join airports on p_airport_id = a_id
+join city on a_city_id = c_id
+join statistics on s_city_id = c_id
+group by c_id
+order by cnt desc) as t
+on t.c_id = s_city_id
+join city as c on s_city_id = c.c_id
+order by s_per_foreign_born desc
+""")
+
+travelers_by_temperature = ("""
+select c_name, c_state_code, t_average_temp_month, cnt, round((100*(cnt::float/total::float))::numeric,2) as percent_of_total_travelers
+from temperatures 
+join (
+select m_city_id as c_id, sum(m_traveler_count) as cnt from travelers_monthly_agg
+join statistics on s_city_id = m_city_id
+group by m_city_id) as t on t.c_id = t_city_id
+join city as c on t_city_id = c.c_id
+cross join (select sum(m_traveler_count) as total
+  from travelers_monthly_agg
+) as totals
+where t_year = '2013' and t_month = '4'
+order by percent_of_total_travelers desc
+""")
+
+travelers_by_temperature_fact = ("""
+select c_name, c_state_code, t_average_temp_month, cnt, round((100*(cnt::float/total::float))::numeric,2) as percent_of_total_travelers
+from temperatures 
+join (
+select c_id, count(*) as cnt from travelers 
+join airports on p_airport_id = a_id
+join city on a_city_id = c_id
+join statistics on s_city_id = c_id
+group by c_id
+order by cnt desc) as t on t.c_id = t_city_id
+join city as c on t_city_id = c.c_id
+cross join (select count(*) as total
+  from travelers
+) as totals
+where t_year = '2013' and t_month = '4'
+order by percent_of_total_travelers desc
+""")
+
 # STAGING VALIDATION QUERIES
 staging_airports_validate = "select count(*) from staging_airports"
 staging_cities_validate = "select count(*) from staging_cities"
@@ -270,14 +627,68 @@ temperatures_validate = "select count(*) from temperatures"
 visa_validate = "select count(*) from visa_codes"
 statistics_validate = "select count(*) from statistics"
 travelers_validate = "select count(*) from travelers"
+travelers_daily_agg_validate = "select sum(d_traveler_count) from travelers_daily_agg"
+travelers_monthly_agg_validate = "select sum(m_traveler_count) from travelers_monthly_agg"
 
 # QUERY LISTS
 
-create_table_queries = [staging_travelers_table_create, staging_airports_table_create, staging_cities_table_create,
-    staging_temperatures_table_create, visa_table_create, city_table_create, airports_table_create, temperatures_table_create, statistics_table_create, travelers_table_create]
+create_table_queries = identity_sequence_create + [staging_travelers_table_create, staging_airports_table_create, staging_cities_table_create,
+    staging_temperatures_table_create, visa_table_create, city_table_create, airports_table_create, temperatures_table_create, statistics_table_create, travelers_table_create,
+    travelers_daily_agg_create, travelers_monthly_agg_create]
 drop_table_queries = [staging_travelers_table_drop, staging_airports_table_drop, staging_cities_table_drop,
-    staging_temperatures_table_drop, visa_table_drop, airports_table_drop, city_table_drop, temperatures_table_drop, statistics_table_drop, travelers_table_drop]
+    staging_temperatures_table_drop, visa_table_drop, airports_table_drop, city_table_drop, temperatures_table_drop, statistics_table_drop, travelers_table_drop,
+    travelers_daily_agg_drop, travelers_monthly_agg_drop] + identity_sequence_drop
 copy_table_queries = [staging_travelers_copy, staging_cities_copy, staging_airports_copy, staging_temperatures_copy]
-insert_table_queries = [visa_table_insert, city_table_insert, city_table_update, airports_table_insert, temperatures_table_insert, statistics_table_insert, travelers_table_insert]
-validation_queries  = [visa_validate, city_validate, airports_validate, temperatures_validate, statistics_validate, travelers_validate]
-staging_validation_queries  = [staging_airports_validate, staging_cities_validate, staging_temperatures_validate, staging_travelers_validate]
\ No newline at end of file
+insert_table_queries = [visa_table_insert, city_table_insert, airports_table_insert, temperatures_table_insert, statistics_table_insert, travelers_table_insert,
+    travelers_daily_agg_delete, travelers_daily_agg_insert, travelers_monthly_agg_delete, travelers_monthly_agg_insert]
+upsert_table_queries = [visa_table_upsert, city_table_upsert, airports_table_update, airports_table_upsert, temperatures_table_update,
+    temperatures_table_upsert, statistics_table_update, statistics_table_upsert, travelers_table_delete, travelers_table_insert,
+    travelers_daily_agg_delete, travelers_daily_agg_insert, travelers_monthly_agg_delete, travelers_monthly_agg_insert]
+staging_drop_table_queries = [staging_travelers_table_drop, staging_airports_table_drop, staging_cities_table_drop, staging_temperatures_table_drop]
+validation_queries  = [visa_validate, city_validate, airports_validate, temperatures_validate, statistics_validate, travelers_validate,
+    travelers_daily_agg_validate, travelers_monthly_agg_validate]
+staging_validation_queries  = [staging_airports_validate, staging_cities_validate, staging_temperatures_validate, staging_travelers_validate]
+analytics_queries = {'average_age_by_city': average_age_by_city, 'travelers_by_foreign_born': travelers_by_foreign_born, 'travelers_by_temperature': travelers_by_temperature}
+fact_analytics_queries = {'average_age_by_city': average_age_by_city_fact, 'travelers_by_foreign_born': travelers_by_foreign_born_fact,
+    'travelers_by_temperature': travelers_by_temperature_fact}
+
+# LOAD GRAPH
+# Each load step names the query it runs and the steps it depends on so independent COPY and INSERT statements can run at the same time
+load_graph = {
+    'staging_travelers': (staging_travelers_copy, []),
+    'staging_cities': (staging_cities_copy, []),
+    'staging_airports': (staging_airports_copy, []),
+    'staging_temperatures': (staging_temperatures_copy, []),
+    'visa_codes': (visa_table_insert, []),
+    'city': (city_table_insert, ['staging_airports']),
+    'airports': (airports_table_insert, ['city']),
+    'temperatures': (temperatures_table_insert, ['city', 'staging_temperatures']),
+    'statistics': (statistics_table_insert, ['city', 'staging_cities']),
+    'travelers': (travelers_table_insert, ['airports', 'staging_travelers']),
+    'travelers_daily_agg_delete': (travelers_daily_agg_delete, ['travelers']),
+    'travelers_daily_agg': (travelers_daily_agg_insert, ['travelers_daily_agg_delete']),
+    'travelers_monthly_agg_delete': (travelers_monthly_agg_delete, ['travelers_daily_agg']),
+    'travelers_monthly_agg': (travelers_monthly_agg_insert, ['travelers_monthly_agg_delete'])
+}
+
+# Incremental load graph which merges the staging deltas into the existing tables instead of appending everything
+upsert_load_graph = {
+    'staging_travelers': (staging_travelers_copy, []),
+    'staging_cities': (staging_cities_copy, []),
+    'staging_airports': (staging_airports_copy, []),
+    'staging_temperatures': (staging_temperatures_copy, []),
+    'visa_codes': (visa_table_upsert, []),
+    'city': (city_table_upsert, ['staging_airports']),
+    'airports_update': (airports_table_update, ['city']),
+    'airports': (airports_table_upsert, ['airports_update']),
+    'temperatures_update': (temperatures_table_update, ['city', 'staging_temperatures']),
+    'temperatures': (temperatures_table_upsert, ['temperatures_update']),
+    'statistics_update': (statistics_table_update, ['city', 'staging_cities']),
+    'statistics': (statistics_table_upsert, ['statistics_update']),
+    'travelers_delete': (travelers_table_delete, ['staging_travelers']),
+    'travelers': (travelers_table_insert, ['airports', 'travelers_delete']),
+    'travelers_daily_agg_delete': (travelers_daily_agg_delete, ['travelers']),
+    'travelers_daily_agg': (travelers_daily_agg_insert, ['travelers_daily_agg_delete']),
+    'travelers_monthly_agg_delete': (travelers_monthly_agg_delete, ['travelers_daily_agg']),
+    'travelers_monthly_agg': (travelers_monthly_agg_insert, ['travelers_monthly_agg_delete'])
+}
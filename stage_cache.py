@@ -0,0 +1,111 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+import types
+from ledger import file_signature
+
+# Settings outside a stage's own keys that still change what every stage writes
+SHARED_SETTINGS = {
+    'OUTPUT': ('format', 'split', 'slices', 'part_size_mb'),
+    'ENGINE': ('auto_threshold_mb',)
+}
+
+
+def fingerprint_path(config, key):
+    """
+    Return the path of the fingerprint recorded next to a stage's output in the output folder
+    """
+    return config['OUTPUT']['FOLDER'] + '/' + key.lower() + '.fingerprint.json'
+
+def load_fingerprint(config, key):
+    """
+    Load the fingerprint recorded by the last run of a stage, or None if it has not run
+    """
+    if not os.path.exists(fingerprint_path(config, key)):
+        return None
+    with open(fingerprint_path(config, key)) as f:
+        return json.load(f)
+
+def save_fingerprint(config, key, fingerprint):
+    """
+    Write a stage's fingerprint to the output folder
+    """
+    with open(fingerprint_path(config, key), 'w') as f:
+        json.dump(fingerprint, f, indent=2, sort_keys=True)
+
+def stage_settings(config, key):
+    """
+    Return the INPUT, OUTPUT and ENGINE settings that belong to a stage, such as TEMPERATURES and TEMPERATURES_CHUNKSIZE
+    """
+    settings = {}
+    for section in ('INPUT', 'OUTPUT', 'ENGINE'):
+        if not config.has_section(section):
+            continue
+        for option, value in config.items(section):
+            if option.startswith(key.lower()) or option in SHARED_SETTINGS.get(section, ()):
+                settings[section + '.' + option] = value
+    return settings
+
+def local_module(obj, root):
+    """
+    Return a module, or the module an object is defined in, if it is one of the pipeline's own modules in `root`, or None for libraries
+    """
+    module = obj if isinstance(obj, types.ModuleType) else sys.modules.get(getattr(obj, '__module__', None))
+    path = getattr(module, '__file__', None)
+    if path is not None and os.path.dirname(os.path.abspath(path)) == root:
+        return module
+    return None
+
+def code_version(func):
+    """
+    Hash the source of a stage function together with every function, class and constant it uses, directly or through other
+    functions and methods, from its own module and the other pipeline modules next to it such as staging_files.py and
+    spark_session.py, so editing one stage does not invalidate the others while editing a shared helper invalidates its users
+    """
+    root = os.path.dirname(os.path.abspath(sys.modules[func.__module__].__file__))
+    sources = {}
+    pending = [func]
+    while pending:
+        item = pending.pop()
+        name = item.__module__ + '.' + item.__qualname__
+        if name in sources:
+            continue
+        sources[name] = inspect.getsource(item)
+
+        # Classes are followed through their methods and local base classes, functions through their own code
+        if isinstance(item, type):
+            members = [inspect.unwrap(getattr(member, '__func__', member)) for member in vars(item).values()]
+            codes = [member.__code__ for member in members if isinstance(member, types.FunctionType)]
+            pending.extend(base for base in item.__bases__ if local_module(base, root))
+        else:
+            codes = [inspect.unwrap(item).__code__]
+        namespace = vars(sys.modules[item.__module__])
+
+        # Collect the global names used by the code and any nested functions or lambdas it defines
+        names = set()
+        while codes:
+            code = codes.pop()
+            names.update(code.co_names)
+            codes.extend(const for const in code.co_consts if isinstance(const, types.CodeType))
+
+        for used in sorted(names):
+            value = namespace.get(used)
+            if isinstance(value, (types.FunctionType, type)) and local_module(value, root):
+                pending.append(value)
+            elif isinstance(value, types.ModuleType) and local_module(value, root):
+                sources[value.__name__] = inspect.getsource(value)
+            elif isinstance(value, (str, int, float, list, tuple, dict)):
+                sources[item.__module__ + '.' + used] = repr(value)
+    return hashlib.sha256(json.dumps(sources, sort_keys=True).encode()).hexdigest()
+
+def stage_fingerprint(config, key, func, inputs):
+    """
+    Build the fingerprint of a stage from the signatures of its input files, its settings and its code version
+    """
+    return {
+        'inputs': {path: file_signature(path) for path in inputs},
+        'settings': stage_settings(config, key),
+        'code': code_version(func)
+    }
@@ -0,0 +1,213 @@
+import glob
+import os
+import struct
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.csv as pa_csv
+
+# Parquet schemas for each staging dataset, matching the column order and types of the staging_*_table_create DDL
+STAGING_SCHEMAS = {
+    'CITIES': pa.schema([
+        ('city', pa.string()),
+        ('median_age', pa.float64()),
+        ('cnt_male', pa.int32()),
+        ('cnt_female', pa.int32()),
+        ('population', pa.int32()),
+        ('cnt_veterans', pa.int32()),
+        ('cnt_foreign_born', pa.int32()),
+        ('avg_household', pa.float64()),
+        ('state', pa.string()),
+        ('cnt_white', pa.int32()),
+        ('per_white', pa.float64()),
+        ('cnt_his_latino', pa.int32()),
+        ('per_his_latino', pa.float64()),
+        ('cnt_asian', pa.int32()),
+        ('per_asian', pa.float64()),
+        ('cnt_amer_ind_ak_native', pa.int32()),
+        ('per_amer_ind_ak_native', pa.float64()),
+        ('cnt_black', pa.int32()),
+        ('per_black_afr_amer', pa.float64()),
+        ('per_male', pa.float64()),
+        ('per_female', pa.float64()),
+        ('per_veterans', pa.float64()),
+        ('per_foreign_born', pa.float64()),
+        ('city_id', pa.int64())
+    ]),
+    'AIRPORTS': pa.schema([
+        ('iata_code', pa.string()),
+        ('type', pa.string()),
+        ('name', pa.string()),
+        ('elevation_ft', pa.float64()),
+        ('city', pa.string()),
+        ('long', pa.string()),
+        ('lat', pa.string()),
+        ('state', pa.string()),
+        ('city_id', pa.int64())
+    ]),
+    'TEMPERATURES': pa.schema([
+        ('date', pa.string()),
+        ('avg_temp', pa.float64()),
+        ('avg_temp_uncertainty', pa.float64()),
+        ('city', pa.string()),
+        ('lat', pa.string()),
+        ('long', pa.string()),
+        ('month', pa.int32()),
+        ('year', pa.int32()),
+        ('average_temp_month', pa.float64()),
+        ('city_id', pa.int64())
+    ]),
+    # Written by Spark without a header, so the names are only used to read the files back
+    'TRAVELERS': pa.schema([
+        ('iata_code', pa.string()),
+        ('age', pa.int32()),
+        ('visa', pa.int32()),
+        ('gender', pa.string()),
+        ('year_of_birth', pa.int32()),
+        ('arrival_year', pa.int32()),
+        ('arrival_month', pa.int32()),
+        ('arrival_day', pa.int32())
+    ])
+}
+
+def output_format(config):
+    """
+    Return the configured staging output format, either csv or parquet
+    """
+    return config['OUTPUT'].get('FORMAT', 'csv').lower()
+
+def output_name(config, key):
+    """
+    Return the output file name for a staging dataset with the extension matching the output format
+    """
+    name = config['OUTPUT'][key]
+    if output_format(config) == 'parquet' and name.endswith('.csv'):
+        name = name[:-len('.csv')] + '.parquet'
+    return name
+
+def output_path(config, key):
+    """
+    Return the local path for a staging dataset within the output folder
+    """
+    return config['OUTPUT']['FOLDER'] + '/' + output_name(config, key)
+
+def split_outputs(config):
+    """
+    Check whether staging datasets are split into compressed parts loaded through COPY manifests
+    """
+    return config.getboolean('OUTPUT', 'SPLIT', fallback=False)
+
+def part_path(config, key, index=None):
+    """
+    Return the local path of a numbered part of a split staging dataset, or a glob matching all of its parts when no index is given
+    """
+    name = output_name(config, key)
+    number = '*' if index is None else '{:04d}'.format(index)
+    if output_format(config) == 'parquet':
+        return config['OUTPUT']['FOLDER'] + '/' + name[:-len('.parquet')] + '.' + number + '.parquet'
+    return config['OUTPUT']['FOLDER'] + '/' + name + '.' + number + '.gz'
+
+def s3_key(config, path):
+    """
+    Return the S3 key of a local file in the output folder
+    """
+    return config['S3']['FOLDER'] + '/' + os.path.relpath(path, config['OUTPUT']['FOLDER']).replace(os.sep, '/')
+
+def copy_manifest_path(config, name):
+    """
+    Return the local path of the COPY manifest for a staging dataset or travelers partition, named relative to the output folder
+    """
+    return config['OUTPUT']['FOLDER'] + '/copy_manifests/' + name.rstrip('/') + '.manifest'
+
+def staged_files(path):
+    """
+    List the data files Spark wrote to a folder, leaving out markers such as _SUCCESS and checksum files
+    """
+    return [os.path.join(folder, f) for folder, dirs, files in sorted(os.walk(path)) for f in sorted(files)
+            if not f.startswith(('_', '.')) and not f.endswith('crc')]
+
+def dataset_files(config, key):
+    """
+    List the local files and matching S3 keys that make up a staging dataset, including its COPY manifests when outputs are split
+    """
+    path = output_path(config, key)
+    if os.path.isdir(path):
+        # Travelers is a folder so partition folders keep their relative path
+        files = [os.path.join(folder, f) for folder, dirs, files in sorted(os.walk(path)) for f in sorted(files) if f.endswith(('csv', 'parquet', '.gz'))]
+    elif split_outputs(config):
+        files = sorted(glob.glob(part_path(config, key)))
+    else:
+        files = [path]
+    if split_outputs(config):
+        manifests = copy_manifest_path(config, output_name(config, key))
+        files += [manifests] if os.path.exists(manifests) else []
+        files += staged_files(manifests[:-len('.manifest')])
+    return [(f, s3_key(config, f)) for f in files]
+
+def output_exists(config, key):
+    """
+    Check whether a staging dataset has been written
+    """
+    files = dataset_files(config, key)
+    return bool(files) and all(os.path.exists(path) for path, s3_key in files)
+
+def uploads_to_s3(config):
+    """
+    Check whether the staging files need uploading, which is only the case for Redshift. A local DuckDB warehouse reads them
+    directly and etl.py streams them into PostgreSQL over the connection
+    """
+    return config.get('WAREHOUSE', 'TYPE', fallback='redshift').lower() == 'redshift'
+
+# Staging datasets small enough to skip S3 and be loaded by etl.py straight over the database connection. Temperatures are
+# left out since they run to hundreds of thousands of rows, which Redshift would receive as multi-row inserts
+DIRECT_LOAD_KEYS = ('CITIES', 'AIRPORTS')
+
+def uncompressed_size(path):
+    """
+    Return the size of the data in a staging file before compression, read from the gzip trailer or the Parquet row group metadata
+    """
+    if path.endswith('.gz'):
+        # The trailer holds the uncompressed size modulo 4 GB, which is exact for the parts loaded directly
+        with open(path, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            return struct.unpack('<I', f.read(4))[0]
+    if path.endswith('.parquet'):
+        metadata = pq.ParquetFile(path).metadata
+        return sum(metadata.row_group(index).total_byte_size for index in range(metadata.num_row_groups))
+    return os.path.getsize(path)
+
+def data_files(config, key, partition=None):
+    """
+    List the local data files of a staging dataset, or of one arrival_year/arrival_month partition of travelers, leaving out its COPY manifests
+    """
+    if partition is not None:
+        return staged_files(output_path(config, key) + partition)
+    return [path for path, s3_key in dataset_files(config, key) if not path.endswith('.manifest')]
+
+def loads_directly(config, key):
+    """
+    Check whether a staging dataset is loaded directly by etl.py, which is the case when its local files add up to no more than
+    ETL DIRECT_LOAD_MB before compression, so gzip or Snappy parts are measured by the data they hold rather than their size on disk
+    """
+    threshold = config.getfloat('ETL', 'DIRECT_LOAD_MB', fallback=0) * 1024 * 1024
+    if key not in DIRECT_LOAD_KEYS or threshold <= 0 or not uploads_to_s3(config):
+        return False
+    paths = data_files(config, key)
+    return bool(paths) and all(os.path.exists(path) for path in paths) and sum(uncompressed_size(path) for path in paths) <= threshold
+
+def read_staging_file(config, key, path):
+    """
+    Read one local file of a staging dataset into an Arrow table with its staging schema, with empty CSV fields read as nulls
+    as DuckDB and a PostgreSQL CSV COPY read them
+    """
+    schema = STAGING_SCHEMAS[key]
+    if output_format(config) == 'parquet':
+        return pq.read_table(path).select(schema.names).cast(schema)
+    # Travelers files have no header, while the pandas outputs and every CSV part start with one
+    read_options = pa_csv.ReadOptions(column_names=schema.names) if key == 'TRAVELERS' else pa_csv.ReadOptions()
+    return pa_csv.read_csv(path, read_options=read_options, convert_options=pa_csv.ConvertOptions(column_types=schema, strings_can_be_null=True))
+
+def read_output_table(config, key):
+    """
+    Read the local files of a staging dataset, whether a single file or split parts, back into one Arrow table with its staging schema
+    """
+    return pa.concat_tables([read_staging_file(config, key, path) for path in data_files(config, key)])
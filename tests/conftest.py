@@ -0,0 +1,77 @@
+import configparser
+import importlib
+import os
+import shutil
+import sys
+import urllib.parse
+import pytest
+
+# Folder holding the pipeline scripts, which are imported as top-level modules like the scripts import each other
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def make_config(tmp_path, monkeypatch):
+    """
+    Returns a function that writes a config.cfg into a temporary folder, with the repository inputs, an output folder and
+    a local DuckDB warehouse inside it plus any overrides given per section, and reloads the modules that read config.cfg on import
+    """
+    def make(overrides=None):
+        config = configparser.ConfigParser()
+        config.read(os.path.join(ROOT, 'config.cfg'))
+        for option, path in config.items('INPUT'):
+            if path.startswith('input_data/'):
+                config.set('INPUT', option, os.path.join(ROOT, path))
+        config.set('OUTPUT', 'FOLDER', str(tmp_path / 'output_data'))
+        config.set('WAREHOUSE', 'TYPE', 'duckdb')
+        config.set('WAREHOUSE', 'DATABASE', str(tmp_path / 'warehouse.duckdb'))
+        config.set('INSTRUMENTATION', 'LOG', str(tmp_path / 'pipeline_metrics.jsonl'))
+        for section, options in (overrides or {}).items():
+            for option, value in options.items():
+                config.set(section, option, str(value))
+        os.makedirs(config['OUTPUT']['FOLDER'], exist_ok=True)
+        with open(tmp_path / 'config.cfg', 'w') as f:
+            config.write(f)
+
+        monkeypatch.chdir(tmp_path)
+        import sql_queries, create_tables, etl
+        for module in (sql_queries, create_tables, etl):
+            importlib.reload(module)
+        return config
+    return make
+
+
+@pytest.fixture(scope='session')
+def generated_inputs(tmp_path_factory):
+    """
+    Generates the synthetic inputs of the benchmarks at a scale factor of 1 once per test session and returns their INPUT settings
+    """
+    from benchmarks.generators import generate
+    return generate(str(tmp_path_factory.mktemp('benchmark_data')), 1, 42, 'csv')
+
+@pytest.fixture(scope='session')
+def spark():
+    """
+    Starts a local Spark session for the tests, which the prep stages pick up as the active session, or skips the test when
+    there is no Java runtime to start it
+    """
+    if shutil.which('java') is None and not os.environ.get('JAVA_HOME'):
+        pytest.skip('Spark needs a Java runtime')
+    from pyspark.sql import SparkSession
+    session = SparkSession.builder.master('local[2]').appName('tests').config('spark.sql.shuffle.partitions', '4').getOrCreate()
+    yield session
+    session.stop()
+
+@pytest.fixture(scope='session')
+def postgres(tmp_path_factory):
+    """
+    Starts a throwaway PostgreSQL server from the pgserver package and returns its CLUSTER settings, or skips the test when
+    pgserver is not installed
+    """
+    pgserver = pytest.importorskip('pgserver')
+    server = pgserver.get_server(str(tmp_path_factory.mktemp('postgres')), cleanup_mode='stop')
+    uri = urllib.parse.urlparse(server.get_uri())
+    yield {'HOST': urllib.parse.parse_qs(uri.query)['host'][0], 'DB_NAME': uri.path.lstrip('/'), 'DB_USER': uri.username,
+           'DB_PASSWORD': uri.password or '', 'DB_PORT': uri.port or 5432}
+    server.cleanup()
@@ -0,0 +1,76 @@
+import os
+import pandas as pd
+import pyarrow as pa
+from staging_files import STAGING_SCHEMAS
+
+# Staging rows for three cities, with travelers over two arrival months, one of them at a port that is not a known airport
+STAGING_ROWS = {
+    'AIRPORTS': [
+        ('BOS', 'large_airport', 'Logan', 20.0, 'Boston', '71.01W', '42.36N', 'MA', 1),
+        ('ORH', 'small_airport', 'Worcester Regional', 1000.0, 'Worcester', '71.88W', '42.27N', 'MA', 2),
+        ('JFK', 'large_airport', 'Kennedy', 13.0, 'New York', '73.78W', '40.64N', 'NY', 3),
+        ('LGA', 'medium_airport', 'LaGuardia', None, 'New York', '73.87W', '40.78N', 'NY', 3)
+    ],
+    'CITIES': [
+        ('Boston', 31.3, 328000, 340000, 668000, 21000, 190000, 2.4, 'MA', 380000, 0.57, 130000, 0.19, 66000, 0.1,
+         3000, 0.0, 170000, 0.25, 0.49, 0.51, 0.03, 0.28, 1),
+        ('Worcester', 31.0, 90000, 92000, 182000, 8000, 40000, None, 'MA', 120000, 0.66, 38000, 0.21, 14000, 0.08,
+         1000, 0.01, 24000, 0.13, 0.49, 0.51, 0.04, 0.22, 2),
+        ('New York', 36.0, 4080000, 4470000, 8550000, 156000, 3210000, 2.7, 'NY', 3830000, 0.45, 2490000, 0.29, 1240000, 0.15,
+         70000, 0.01, 2100000, 0.25, 0.48, 0.52, 0.02, 0.38, 3)
+    ],
+    'TEMPERATURES': [
+        ('2013-04-01', 8.1, 0.2, 'Boston', '42.59N', '72.00W', 4, 2013, 7.9, 1),
+        ('2012-04-01', 7.7, 0.3, 'Boston', '42.59N', '72.00W', 4, 2012, 7.9, 1),
+        ('2013-04-01', 7.4, 0.2, 'Worcester', '42.59N', '72.00W', 4, 2013, 7.4, 2),
+        ('2013-04-01', 11.2, 0.2, 'New York', '40.99N', '74.56W', 4, 2013, 11.0, 3),
+        ('2012-04-01', 10.8, 0.3, 'New York', '40.99N', '74.56W', 4, 2012, 11.0, 3)
+    ],
+    'TRAVELERS': [
+        ('BOS', 34, 2, 'F', 1982, 2016, 4, 1),
+        ('BOS', None, 1, 'M', None, 2016, 4, 1),
+        ('ORH', 51, 2, 'M', 1965, 2016, 4, 9),
+        ('JFK', 27, 3, 'F', 1989, 2016, 4, 30),
+        ('LGA', 8, 2, 'M', 2008, 2016, 5, 2),
+        ('JFK', 62, 1, 'F', 1954, 2016, 5, 17),
+        ('XXX', 40, 2, 'F', 1976, 2016, 5, 18)
+    ]
+}
+
+# Staging table of each dataset
+STAGING_TABLES = {'AIRPORTS': 'staging_airports', 'CITIES': 'staging_cities', 'TEMPERATURES': 'staging_temperatures', 'TRAVELERS': 'staging_travelers'}
+
+
+def staging_frame(key, rows=None):
+    """
+    Returns the staging rows of a dataset, or the given rows, as a dataframe with its staging schema, holding integers with
+    nulls as nullable integers
+    """
+    schema = STAGING_SCHEMAS[key]
+    table = pa.Table.from_pylist([dict(zip(schema.names, row)) for row in (STAGING_ROWS[key] if rows is None else rows)], schema=schema)
+    return table.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}.get)
+
+def write_partitioned_travelers(config, travelers=None, source='i94_apr16_sub.sas7bdat'):
+    """
+    Writes travelers, the staging rows by default, into arrival_year/arrival_month partition folders the way dataprep.py does,
+    with the partition columns kept in the headerless files under a source= folder for the input file, and returns the partition names
+    """
+    travelers = staging_frame('TRAVELERS') if travelers is None else travelers
+    split = config.getboolean('OUTPUT', 'SPLIT')
+    partitions = []
+    for (year, month), rows in travelers.groupby(['arrival_year', 'arrival_month']):
+        partition = 'arrival_year={}/arrival_month={}'.format(year, month)
+        folder = os.path.join(config['OUTPUT']['FOLDER'], config['OUTPUT']['TRAVELERS'], partition, 'source=' + source)
+        os.makedirs(folder)
+        if config['OUTPUT']['FORMAT'] == 'parquet':
+            rows.to_parquet(os.path.join(folder, 'part-00000-c000.snappy.parquet'), index=False)
+        else:
+            rows.to_csv(os.path.join(folder, 'part-00000-c000.csv' + ('.gz' if split else '')), header=False, index=False)
+        partitions.append(partition)
+    return partitions
+
+def values(rows):
+    """
+    Formats rows as the VALUES list of an INSERT statement
+    """
+    return ', '.join('(' + ', '.join('NULL' if value is None else repr(value) for value in row) + ')' for row in rows)
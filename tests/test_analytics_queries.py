@@ -0,0 +1,29 @@
+import importlib
+from warehouse import connect
+from staging_data import STAGING_ROWS, STAGING_TABLES, values
+
+def test_aggregate_queries_match_fact_queries(make_config):
+    config = make_config()
+    import create_tables, etl, sql_queries
+    from benchmarks import queries
+    importlib.reload(queries)
+    conn = connect(config)
+    cur = conn.cursor()
+    create_tables.drop_tables(cur, conn)
+    create_tables.create_tables(cur, conn)
+    for key, rows in STAGING_ROWS.items():
+        cur.execute('INSERT INTO {} VALUES {}'.format(STAGING_TABLES[key], values(rows)))
+    conn.commit()
+    etl.insert_tables(cur, conn)
+
+    cur.execute(sql_queries.travelers_monthly_agg_validate)
+    assert cur.fetchone()[0] == 6
+
+    # Every README query returns rows, and the same rows from the aggregate as from the travelers fact table
+    for name, query in sql_queries.analytics_queries.items():
+        cur.execute(query)
+        assert cur.fetchall(), name
+    results = queries.run_query_benchmark(conn, 1)
+    assert {name: result['matches'] for name, result in results.items()} == {name: True for name in sql_queries.analytics_queries}
+    assert all(result['rows'] for result in results.values())
+    conn.close()
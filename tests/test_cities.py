@@ -0,0 +1,72 @@
+import os
+import pandas as pd
+import pytest
+from dataprep import INPUT_SCHEMAS, city_id, nearby, prep_cities_data, race_columns, resolve_temperature_cities, spatial_index
+from staging_files import output_path
+from benchmarks.transforms import race_columns_before
+
+# cities.csv written from input_data/us-cities-demographics.csv by prep_cities_data before the race columns were pivoted
+GOLDEN_CITIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden', 'cities.csv')
+
+# US airports a temperature series can be matched to, in the layout of airport-codes_csv.csv
+AIRPORTS = pd.DataFrame([
+    ('BOS', 'large_airport', 'Logan', 20, 'US', 'US-MA', 'Boston', '-71.01, 42.36'),
+    ('STL', 'large_airport', 'Lambert', 618, 'US', 'US-MO', 'St. Louis', '-90.37, 38.75'),
+    ('PDX', 'large_airport', 'Portland Intl', 31, 'US', 'US-OR', 'Portland', '-122.60, 45.59'),
+    ('PWM', 'medium_airport', 'Portland Jetport', 76, 'US', 'US-ME', 'Portland', '-70.31, 43.65'),
+    ('YUL', 'large_airport', 'Trudeau', 118, 'CA', 'CA-QC', 'Montreal', '-73.74, 45.47')
+], columns=['iata_code', 'type', 'name', 'elevation_ft', 'iso_country', 'iso_region', 'municipality', 'coordinates'])
+
+
+def test_cities_output_matches_golden_file(make_config):
+    config = make_config({'OUTPUT': {'FORMAT': 'csv', 'SPLIT': 'false'}, 'ENGINE': {'CITIES': 'pandas'}})
+    prep_cities_data(config)
+    cities = pd.read_csv(output_path(config, 'CITIES'), dtype=str)
+
+    # Every column but the city id, which was added later, is written exactly as before, in the same row order
+    pd.testing.assert_frame_equal(cities.drop(columns='city_id'), pd.read_csv(GOLDEN_CITIES, dtype=str))
+    assert list(cities['city_id'].astype('int64')) == [city_id(city, state) for city, state in zip(cities['city'], cities['state'])]
+
+
+def test_race_columns_match_merge_per_race(make_config):
+    config = make_config()
+    citiesdf = pd.read_csv(config['INPUT']['CITIES'], **INPUT_SCHEMAS['CITIES']).sort_values(by=['State', 'City'])
+    before = race_columns_before(citiesdf).drop(columns=['Race', 'Count']).reset_index(drop=True)
+    after = race_columns(citiesdf).drop(columns=['Race', 'Count']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(after, before, check_dtype=False)
+
+
+def test_spatial_index_finds_locations_in_neighbouring_cells():
+    locations = pd.DataFrame({'lat': [42.36, 42.9, 44.5, 42.36, 80.1, 80.2, 80.3], 'long': [-71.01, -71.9, -71.0, -75.2, -0.5, 10.5, 20.0]})
+    index = spatial_index(locations, 1.0)
+    assert index[(42, -72)] == [0, 1] and index[(44, -71)] == [2]
+
+    # One cell of latitude either way, and wider in longitude towards the poles where degrees of longitude are shorter
+    assert sorted(nearby(index, 1.0, 42.5, -71.5)) == [0, 1]
+    assert sorted(nearby(index, 1.0, 43.5, -71.5)) == [0, 1, 2]
+    assert sorted(nearby(index, 1.0, 80.0, 5.0)) == [4, 5]
+    assert nearby(index, 1.0, 20.0, 5.0) == []
+
+
+@pytest.mark.parametrize('radius, matched', [(150, {'Boston', 'Saint Louis', 'Portland'}), (10, {'Boston'})])
+def test_resolve_temperature_cities(make_config, tmp_path, radius, matched):
+    airports = tmp_path / 'airport-codes_csv.csv'
+    AIRPORTS.to_csv(airports, index=False)
+    config = make_config({'INPUT': {'AIRPORTS': str(airports), 'TEMPERATURES_MATCH_KM': radius}})
+    locations = pd.DataFrame([
+        ('Boston', '42.59N', '71.00W'),
+        ('Boston', '42.36N', '71.05W'),
+        ('Saint Louis', '39.38N', '89.78W'),
+        ('Portland', '45.81N', '123.46W'),
+        ('Springfield', '42.10N', '72.59W'),
+        ('Montreal', '45.81N', '73.81W')
+    ], columns=['city', 'lat', 'long'])
+    resolved = resolve_temperature_cities(config, locations)
+
+    # Each city gets its closest series, names match once normalized and cities outside the US or the radius are dropped
+    assert set(resolved['city']) == matched
+    assert resolved['city_id'].is_unique
+    boston = resolved[resolved['city'] == 'Boston'].iloc[0]
+    assert (boston['lat'], boston['city_id']) == ('42.36N', city_id('Boston', 'MA'))
+    if 'Portland' in matched:
+        assert resolved.loc[resolved['city'] == 'Portland', 'city_id'].item() == city_id('Portland', 'OR')
@@ -0,0 +1,49 @@
+import pytest
+from warehouse import connect
+from staging_data import values
+
+
+def staging_airports(cities):
+    """
+    Returns two airports for each of a number of cities, so the update of the old city build matches every city more than once
+    """
+    return [(code + str(city), kind, 'Airport {}'.format(city), 10.0, 'City {}'.format(city), '-73.7', '40.6', 'NY', city)
+        for city in range(1, cities + 1) for code, kind in (('L', 'large_airport'), ('S', 'small_airport'))]
+
+@pytest.mark.parametrize('warehouse', ['duckdb', 'postgres'])
+def test_city_build_versions_build_the_same_cities(make_config, request, warehouse):
+    overrides = {'WAREHOUSE': {'TYPE': warehouse}}
+    if warehouse == 'postgres':
+        overrides['CLUSTER'] = request.getfixturevalue('postgres')
+    config = make_config(overrides)
+    import create_tables
+    from benchmarks import city_build
+    conn = connect(config)
+    cur = conn.cursor()
+    create_tables.drop_tables(cur, conn)
+    create_tables.create_tables(cur, conn)
+    cur.execute('INSERT INTO staging_airports VALUES {}'.format(values(staging_airports(2000))))
+    conn.commit()
+
+    results = city_build.run_city_build_benchmark(config, conn, 2)
+    assert {version: result['rows'] for version, result in results.items()} == {'insert+update': 2000, 'single pass': 2000}
+    assert all(len(result['times']) == 2 for result in results.values())
+    if warehouse == 'postgres':
+        # Updating every city leaves a dead version of each row behind, which the single pass never writes
+        assert results['insert+update']['size_mb'] > results['insert+update']['compacted_mb']
+        assert results['single pass']['size_mb'] == results['single pass']['compacted_mb']
+    cur.execute("SELECT count(*) FROM information_schema.tables WHERE table_name = 'city_benchmark'")
+    assert cur.fetchone()[0] == 0
+    conn.close()
+
+def test_city_build_needs_staging_airports(make_config):
+    config = make_config()
+    import create_tables
+    from benchmarks import city_build
+    conn = connect(config)
+    cur = conn.cursor()
+    create_tables.drop_tables(cur, conn)
+    create_tables.create_tables(cur, conn)
+    with pytest.raises(ValueError, match='staging_airports is empty'):
+        city_build.run_city_build_benchmark(config, conn, 1)
+    conn.close()
@@ -0,0 +1,48 @@
+import os
+import pytest
+import pyarrow as pa
+from dataprep import staging_spark_type
+from staging_files import STAGING_SCHEMAS
+from benchmarks.engines import engine_config, outputs_match, read_output, time_stage
+
+# Demographics are read from the repository input, airports and temperatures from the generated benchmark inputs
+GENERATED_INPUTS = ('AIRPORTS', 'TEMPERATURES')
+
+
+@pytest.mark.parametrize('key', ['CITIES', 'AIRPORTS', 'TEMPERATURES'])
+@pytest.mark.parametrize('output', [{'FORMAT': 'csv', 'SPLIT': 'false'}, {'FORMAT': 'parquet', 'SPLIT': 'true'}])
+def test_spark_stage_matches_pandas_stage(make_config, spark, generated_inputs, tmp_path, key, output):
+    config = make_config({'INPUT': {input_key: generated_inputs[input_key] for input_key in GENERATED_INPUTS}, 'OUTPUT': output})
+    outputs = {}
+    for engine in ('pandas', 'spark'):
+        forced = engine_config(config, key, engine, str(tmp_path / engine))
+        os.makedirs(forced['OUTPUT']['FOLDER'])
+        time_stage(forced, key)
+        outputs[engine] = read_output(forced, key)
+    assert len(outputs['pandas']) > 0
+    assert outputs_match(outputs['pandas'], outputs['spark'])
+
+def spark_type_names():
+    """
+    Returns the names Spark SQL accepts for its atomic types that take no parameters, read from PySpark without starting a JVM
+    """
+    from pyspark.sql import types
+    names = set()
+    for name in dir(types):
+        cls = getattr(types, name)
+        if isinstance(cls, type) and issubclass(cls, types.AtomicType):
+            try:
+                names.add(cls().simpleString())
+            except TypeError:
+                pass
+    return names
+
+@pytest.mark.parametrize('key', list(STAGING_SCHEMAS))
+def test_staging_schema_fields_have_spark_types(key):
+    names = spark_type_names()
+    for field in STAGING_SCHEMAS[key]:
+        assert staging_spark_type(field) in names, field
+
+def test_unmapped_staging_type_fails_clearly():
+    with pytest.raises(ValueError, match='no Spark type in STAGING_SPARK_TYPES'):
+        staging_spark_type(pa.field('when', pa.timestamp('s')))
@@ -0,0 +1,26 @@
+import os
+import pandas as pd
+from benchmarks.generators import generate
+
+
+def test_generated_temperatures_cover_the_readme_month(generated_inputs):
+    # The README temperature query filters on April 2013, which every US city must have a reading for
+    temperatures = pd.read_csv(generated_inputs['TEMPERATURES'], usecols=['dt', 'City', 'Country'])
+    cities = set(pd.read_csv(generated_inputs['CITIES'], sep=';', usecols=['City'])['City'])
+    april = temperatures[(temperatures['dt'] == '2013-04-01') & (temperatures['Country'] == 'United States')]
+    assert len(april) and set(april['City']) <= cities
+
+
+def test_generate_reuses_files_only_for_the_same_seed(tmp_path):
+    folder = str(tmp_path / 'data')
+    inputs = generate(folder, 1, 1, 'csv')
+    cities = open(inputs['CITIES']).read()
+    modified = os.path.getmtime(inputs['CITIES'])
+
+    assert generate(folder, 1, 1, 'csv') == inputs
+    assert os.path.getmtime(inputs['CITIES']) == modified
+
+    # Another seed writes the data again rather than reusing the files of the first one
+    generate(folder, 1, 2, 'parquet')
+    assert open(inputs['CITIES']).read() != cities
+    assert os.listdir(os.path.join(folder, 'travelers')) == ['i94_apr16_sub.parquet']
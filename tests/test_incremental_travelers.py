@@ -0,0 +1,67 @@
+import pandas as pd
+from dataprep import write_output
+from ledger import save_ledger
+from warehouse import connect
+from staging_data import staging_frame, write_partitioned_travelers
+
+# A second monthly file with more arrivals in May, which is already partly loaded
+MAY_ARRIVALS = pd.DataFrame({
+    'iata_code': ['BOS', 'ORH'],
+    'age': [45, 29],
+    'visa': [2, 1],
+    'gender': ['F', 'M'],
+    'year_of_birth': [1971, 1987],
+    'arrival_year': [2016, 2016],
+    'arrival_month': [5, 5],
+    'arrival_day': [20, 21]
+})
+
+
+def write_dimensions(config):
+    for key in ('AIRPORTS', 'CITIES', 'TEMPERATURES'):
+        write_output(staging_frame(key), config, key)
+
+def load(config, ledger):
+    import create_tables, etl
+    save_ledger(config, ledger)
+    create_tables.main()
+    etl.main()
+    conn = connect(config)
+    cur = conn.cursor()
+    cur.execute('SELECT count(*), (SELECT sum(m_traveler_count) FROM travelers_monthly_agg) FROM travelers')
+    counts = cur.fetchone()
+    conn.close()
+    return counts
+
+def test_full_load_copies_every_ledger_partition(make_config):
+    config = make_config({'INPUT': {'TRAVELERS_INCREMENTAL': 'true'}, 'ETL': {'LOAD_MODE': 'full'}})
+    write_dimensions(config)
+    partitions = write_partitioned_travelers(config)
+
+    # Nothing is pending, but the full load recreates travelers so every partition recorded in the ledger is copied again
+    ledger = {'files': {'i94_apr16_sub.sas7bdat': {'size': 1, 'mtime': 1, 'partitions': partitions}}, 'pending': []}
+    assert load(config, ledger) == (6, 6)
+
+def test_incremental_load_replaces_months_with_new_files(make_config):
+    config = make_config({'INPUT': {'TRAVELERS_INCREMENTAL': 'true'}, 'ETL': {'LOAD_MODE': 'incremental'}})
+    write_dimensions(config)
+    partitions = write_partitioned_travelers(config)
+    ledger = {'files': {'i94_apr16_sub.sas7bdat': {'size': 1, 'mtime': 1, 'partitions': partitions}}, 'pending': partitions}
+    assert load(config, ledger) == (6, 6)
+
+    # The new file adds to the May partition, which is copied whole and replaces May in travelers without duplicating it
+    may = write_partitioned_travelers(config, MAY_ARRIVALS, source='i94_may16_sub.sas7bdat')
+    ledger['files']['i94_may16_sub.sas7bdat'] = {'size': 1, 'mtime': 1, 'partitions': may}
+    ledger['pending'] = may
+    assert load(config, ledger) == (8, 8)
+
+def test_partitions_are_recorded_per_source_file(make_config, spark):
+    from dataprep import write_travelers_partitions
+    config = make_config({'INPUT': {'TRAVELERS_INCREMENTAL': 'true'}})
+    # The April file has arrivals in April and May, while the May file only has arrivals in May
+    rows = [('BOS', 34, 2, 'M', 1982, 2016, 4, 1, 'i94_apr16_sub.sas7bdat'), ('JFK', 62, 1, 'F', 1954, 2016, 5, 17, 'i94_apr16_sub.sas7bdat'),
+            ('BOS', 45, 2, 'F', 1971, 2016, 5, 20, 'i94_may16_sub.sas7bdat')]
+    schema = 'iata_code string, age int, visa int, gender string, year_of_birth int, arrival_year int, arrival_month int, arrival_day int, source string'
+    sources = write_travelers_partitions(spark.createDataFrame(rows, schema), config)
+    assert sources == {'i94_apr16_sub.sas7bdat': ['arrival_year=2016/arrival_month=4', 'arrival_year=2016/arrival_month=5'],
+                       'i94_may16_sub.sas7bdat': ['arrival_year=2016/arrival_month=5']}
@@ -0,0 +1,51 @@
+import os
+import pandas as pd
+import pytest
+from dataprep import INPUT_SCHEMAS, TRAVELERS_COLUMNS, read_input, read_travelers
+
+
+def write_cities(path, sep=';', drop=(), **values):
+    """
+    Writes a one-row demographics file with the columns of INPUT_SCHEMAS, less any dropped, and any values replaced
+    """
+    row = {column: 1 for column in INPUT_SCHEMAS['CITIES']['usecols']}
+    row.update({'City': 'Boston', 'State': 'Massachusetts', 'State Code': 'MA', 'Race': 'White'}, **values)
+    pd.DataFrame([row]).drop(columns=list(drop)).to_csv(path, sep=sep, index=False)
+
+
+def test_read_input_uses_declared_schema(make_config, tmp_path):
+    path = tmp_path / 'cities.csv'
+    write_cities(path, **{'Extra Column': 'x'})
+    config = make_config({'INPUT': {'CITIES': str(path)}})
+    df = read_input(config, 'CITIES')
+    assert list(df.columns) == INPUT_SCHEMAS['CITIES']['usecols']
+    assert {column: str(dtype) for column, dtype in df.dtypes.items() if column in ('Count', 'Race', 'Male Population')} == \
+        {'Male Population': 'Int32', 'Race': 'category', 'Count': 'int32'}
+
+
+@pytest.mark.parametrize('layout, error', [
+    ({'drop': ['Count']}, r"CITIES input .* is missing the columns \['Count'\] declared in INPUT_SCHEMAS"),
+    ({'sep': ','}, r"CITIES input .* is missing the columns \['City', 'State', "),
+    ({'Count': 'many'}, r"CITIES input .* does not match the dtypes declared in INPUT_SCHEMAS")
+])
+def test_read_input_fails_clearly_on_mismatched_schema(make_config, tmp_path, layout, error):
+    path = tmp_path / 'cities.csv'
+    write_cities(path, **layout)
+    config = make_config({'INPUT': {'CITIES': str(path)}})
+    with pytest.raises(ValueError, match=error):
+        read_input(config, 'CITIES')
+
+
+def test_read_travelers_lines_up_mismatched_monthly_files(spark, tmp_path):
+    # April has upper case names and an extra column, May has no gender column and is stored as Parquet
+    april = pd.DataFrame({'I94PORT': ['BOS'], 'ARRDATE': [20545.0], 'I94BIR': [34.0], 'I94VISA': [2.0], 'BIRYEAR': [1982.0],
+                          'GENDER': ['F'], 'AIRLINE': ['AA']})
+    may = pd.DataFrame({'i94port': ['JFK'], 'arrdate': [20591.0], 'i94bir': [62.0], 'i94visa': [1.0], 'biryear': [1954.0]})
+    files = [str(tmp_path / 'i94_apr16_sub.csv'), str(tmp_path / 'i94_may16_sub.parquet')]
+    april.to_csv(files[0], index=False)
+    may.to_parquet(files[1], index=False)
+
+    df = read_travelers(spark, files, with_source=True)
+    assert [(field.name, field.dataType.simpleString()) for field in df.schema] == list(TRAVELERS_COLUMNS.items()) + [('source', 'string')]
+    assert sorted(map(tuple, df.collect())) == [('BOS', 20545.0, 34.0, 2.0, 1982.0, 'F', os.path.basename(files[0])),
+                                                ('JFK', 20591.0, 62.0, 1.0, 1954.0, None, os.path.basename(files[1]))]
@@ -0,0 +1,48 @@
+import pytest
+from dataprep import write_output
+from ledger import save_ledger
+from warehouse import connect
+from staging_data import STAGING_ROWS, STAGING_TABLES, staging_frame, write_partitioned_travelers
+
+
+def load_warehouse(config, incremental=False):
+    """
+    Writes the staging outputs to the output folder and runs create_tables.py and etl.py against PostgreSQL
+    """
+    import create_tables, etl
+    for key in ('AIRPORTS', 'CITIES', 'TEMPERATURES'):
+        write_output(staging_frame(key), config, key)
+    partitions = write_partitioned_travelers(config)
+    if incremental:
+        save_ledger(config, {'files': {}, 'pending': partitions})
+    create_tables.main()
+    etl.main()
+
+def table_rows(cur, table):
+    cur.execute('SELECT * FROM {}'.format(table))
+    return sorted(cur.fetchall(), key=repr)
+
+@pytest.mark.parametrize('output', [{'FORMAT': 'csv', 'SPLIT': 'false'}, {'FORMAT': 'csv', 'SPLIT': 'true'}, {'FORMAT': 'parquet', 'SPLIT': 'true'}])
+@pytest.mark.parametrize('parallel', ['true', 'false'])
+def test_postgres_loads_staging_tables_from_local_files(make_config, postgres, output, parallel):
+    config = make_config({'WAREHOUSE': {'TYPE': 'postgres'}, 'CLUSTER': postgres, 'OUTPUT': output, 'ETL': {'PARALLEL': parallel}})
+    load_warehouse(config)
+
+    conn = connect(config)
+    cur = conn.cursor()
+    for key, table in STAGING_TABLES.items():
+        assert table_rows(cur, table) == sorted(STAGING_ROWS[key], key=repr), table
+    cur.execute('SELECT count(*) FROM travelers')
+    assert cur.fetchone()[0] == 6
+    conn.close()
+
+def test_postgres_loads_pending_travelers_partitions(make_config, postgres):
+    config = make_config({'WAREHOUSE': {'TYPE': 'postgres'}, 'CLUSTER': postgres, 'INPUT': {'TRAVELERS_INCREMENTAL': 'true'}})
+    load_warehouse(config, incremental=True)
+
+    conn = connect(config)
+    cur = conn.cursor()
+    assert table_rows(cur, 'staging_travelers') == sorted(STAGING_ROWS['TRAVELERS'], key=repr)
+    cur.execute('SELECT sum(m_traveler_count) FROM travelers_monthly_agg')
+    assert cur.fetchone()[0] == 6
+    conn.close()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import pytest
+from dataprep import s3_client, upload_to_s3, write_copy_manifest, write_output
+from staging_files import dataset_files, output_path, staged_files
+from staging_data import staging_frame, write_partitioned_travelers
+
+moto = pytest.importorskip('moto')
+
+
+def bucket_keys(config):
+    s3 = s3_client(config)
+    return sorted(item['Key'] for page in s3.get_paginator('list_objects_v2').paginate(Bucket=config['S3']['BUCKET'])
+                  for item in page.get('Contents', []))
+
+
+def local_keys(config, keys):
+    return sorted(s3_key for key in keys for path, s3_key in dataset_files(config, key))
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+def test_upload_skips_unchanged_files_and_removes_stale_keys(make_config, monkeypatch, capsys, output_format):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    config = make_config({'OUTPUT': {'FORMAT': output_format, 'SPLIT': 'true', 'SLICES': 2}, 'WAREHOUSE': {'TYPE': 'redshift'},
+                          'ETL': {'DIRECT_LOAD_MB': 0}})
+    keys = ('CITIES', 'TRAVELERS')
+
+    with moto.mock_aws():
+        s3_client(config).create_bucket(Bucket=config['S3']['BUCKET'], CreateBucketConfiguration={'LocationConstraint': config['AWS']['REGION']})
+
+        # Cities in two parts and travelers in two monthly partitions, each with a COPY manifest
+        write_output(staging_frame('CITIES'), config, 'CITIES')
+        for partition in write_partitioned_travelers(config):
+            path = output_path(config, 'TRAVELERS') + partition
+            write_copy_manifest(config, os.path.relpath(path, config['OUTPUT']['FOLDER']), staged_files(path))
+        files = len(local_keys(config, keys))
+        assert files == 7
+
+        upload_to_s3(config, keys)
+        assert 'Uploaded {} files'.format(files) in capsys.readouterr().out
+        assert bucket_keys(config) == local_keys(config, keys)
+
+        # Nothing changed, so nothing is uploaded again
+        upload_to_s3(config, keys)
+        out = capsys.readouterr().out
+        assert 'Uploaded 0 files (0 bytes)' in out and 'skipped {} unchanged, removed 0 stale'.format(files) in out
+
+        # Cities rewritten as a single part and the May partition gone leave the second part and the May files stale
+        config.set('OUTPUT', 'SLICES', '1')
+        write_output(staging_frame('CITIES'), config, 'CITIES')
+        shutil.rmtree(output_path(config, 'TRAVELERS') + 'arrival_year=2016/arrival_month=5')
+        os.remove(os.path.join(config['OUTPUT']['FOLDER'], 'copy_manifests', 'travelers', 'arrival_year=2016', 'arrival_month=5.manifest'))
+
+        upload_to_s3(config, keys)
+        out = capsys.readouterr().out
+        assert 'Uploaded 2 files' in out and 'skipped 2 unchanged, removed 3 stale' in out
+        assert bucket_keys(config) == local_keys(config, keys)
+
+
+def test_upload_benchmark_leaves_no_keys_behind(make_config, monkeypatch):
+    from benchmarks.uploads import parse_file_sets, run_upload_benchmark
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    config = make_config({'WAREHOUSE': {'TYPE': 'redshift'}})
+
+    with moto.mock_aws():
+        s3_client(config).create_bucket(Bucket=config['S3']['BUCKET'], CreateBucketConfiguration={'LocationConstraint': config['AWS']['REGION']})
+        results = run_upload_benchmark(config, parse_file_sets('3x0.01,1x0.1'), 2)
+        assert {name: (len(result['times']), result['count']) for name, result in results.items()} == {'3x0.01': (2, 3), '1x0.1': (2, 1)}
+        assert bucket_keys(config) == []
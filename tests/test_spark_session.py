@@ -0,0 +1,31 @@
+import pytest
+import dataprep
+
+
+@pytest.fixture
+def stopped(monkeypatch):
+    """
+    Replaces the Spark session stop in dataprep with one that counts its calls, so no JVM is needed
+    """
+    calls = []
+    monkeypatch.setattr(dataprep, 'stop_spark_session', lambda: calls.append(True))
+    return calls
+
+def test_main_stops_spark_session_when_travelers_are_skipped(make_config, monkeypatch, stopped):
+    make_config({'PIPELINE': {'PARALLEL': 'false'}})
+    ran = []
+    # Only the cities stage runs, standing in for a Spark stage, while the other stages come from the cache
+    monkeypatch.setattr(dataprep, 'run_cached_stage', lambda config, key, force=False: ran.append(key) or key == 'CITIES')
+    monkeypatch.setattr(dataprep, 'uploads_to_s3', lambda config: False)
+    dataprep.main()
+    assert ran == ['CITIES', 'AIRPORTS', 'TEMPERATURES', 'TRAVELERS']
+    assert stopped == [True]
+
+def test_pipeline_worker_stops_spark_session_after_a_failed_stage(make_config, monkeypatch, stopped):
+    make_config()
+    def fail(config, key, force=False):
+        raise RuntimeError('stage failed')
+    monkeypatch.setattr(dataprep, 'run_cached_stage', fail)
+    with pytest.raises(RuntimeError):
+        dataprep.run_stage('CITIES', 'config.cfg')
+    assert stopped == [True]
@@ -0,0 +1,71 @@
+import importlib
+import sys
+import pytest
+from stage_cache import code_version
+
+STAGE = '''
+from helpers import Writer, scale
+
+LIMIT = 10
+
+def stage(rows):
+    return Writer(scale(rows, LIMIT))
+
+def other(rows):
+    return rows
+'''
+
+HELPERS = '''
+class Base:
+    def close(self):
+        return 'closed'
+
+class Writer(Base):
+    def __init__(self, rows):
+        self.rows = rows
+
+def scale(rows, limit):
+    return rows[:limit]
+'''
+
+
+@pytest.fixture
+def modules(tmp_path, monkeypatch):
+    """
+    Writes a stage module that uses a class and a function from a helper module next to it, returning a function that
+    rewrites either module and imports them again
+    """
+    monkeypatch.syspath_prepend(str(tmp_path))
+    sources = {'stages': STAGE, 'helpers': HELPERS}
+
+    def write(name=None, old=None, new=None):
+        if name is not None:
+            sources[name] = sources[name].replace(old, new)
+        for module, source in sources.items():
+            (tmp_path / (module + '.py')).write_text(source)
+            sys.modules.pop(module, None)
+        importlib.invalidate_caches()
+        return importlib.import_module('stages')
+
+    yield write
+    for module in sources:
+        sys.modules.pop(module, None)
+
+
+@pytest.mark.parametrize('name, old, new', [
+    ('helpers', 'self.rows = rows', 'self.rows = list(rows)'),
+    ('helpers', "return 'closed'", "return 'done'"),
+    ('helpers', 'rows[:limit]', 'rows[-limit:]'),
+    ('stages', 'LIMIT = 10', 'LIMIT = 20')
+])
+def test_code_version_follows_classes_and_helper_modules(modules, name, old, new):
+    before = code_version(modules().stage)
+    assert code_version(modules(name, old, new).stage) != before
+
+
+def test_code_version_ignores_unused_code(modules):
+    stages = modules()
+    before = (code_version(stages.stage), code_version(stages.other))
+    stages = modules('stages', 'return rows\n', 'return rows[::-1]\n')
+    assert code_version(stages.stage) == before[0]
+    assert code_version(stages.other) != before[1]
@@ -0,0 +1,33 @@
+import pytest
+from ledger import save_ledger
+from warehouse import connect
+from staging_data import STAGING_ROWS, write_partitioned_travelers
+
+
+def staged_travelers(cur):
+    cur.execute('SELECT * FROM staging_travelers')
+    return sorted(cur.fetchall(), key=repr)
+
+def expected_travelers(months):
+    return sorted([row for row in STAGING_ROWS['TRAVELERS'] if row[6] in months], key=repr)
+
+@pytest.mark.parametrize('output', [{'FORMAT': 'csv', 'SPLIT': 'false'}, {'FORMAT': 'csv', 'SPLIT': 'true'}, {'FORMAT': 'parquet', 'SPLIT': 'false'}])
+def test_duckdb_loads_partitioned_travelers(make_config, output):
+    config = make_config({'OUTPUT': output})
+    import create_tables, etl, sql_queries
+    partitions = write_partitioned_travelers(config)
+    conn = connect(config)
+    cur = conn.cursor()
+    create_tables.drop_tables(cur, conn)
+    create_tables.create_tables(cur, conn)
+
+    # The full copy reads every partition folder through the recursive glob
+    cur.execute(sql_queries.staging_travelers_copy)
+    conn.commit()
+    assert staged_travelers(cur) == expected_travelers([4, 5])
+
+    # The incremental copy reads only the partitions pending in the ledger
+    save_ledger(config, {'files': {}, 'pending': partitions[1:]})
+    etl.load_travelers_partitions(cur, conn, config)
+    assert staged_travelers(cur) == expected_travelers([5])
+    conn.close()
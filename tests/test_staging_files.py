@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+from dataprep import write_output
+from staging_files import data_files, loads_directly, read_output_table, uncompressed_size
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+def test_direct_load_threshold_uses_uncompressed_size(make_config, output_format):
+    config = make_config({'OUTPUT': {'FORMAT': output_format, 'SPLIT': 'true', 'SLICES': 2}, 'WAREHOUSE': {'TYPE': 'redshift'}})
+    airports = pd.DataFrame({
+        'iata_code': ['A{:05d}'.format(i) for i in range(20000)],
+        'type': 'small_airport',
+        'name': 'Airport',
+        'elevation_ft': 100.0,
+        'city': 'Springfield',
+        'long': '89.65W',
+        'lat': '39.8N',
+        'state': 'IL',
+        'city_id': 7
+    })
+    write_output(airports, config, 'AIRPORTS')
+
+    # The parts are a fraction of their data on disk, so the threshold is compared with the data they hold
+    size = sum(uncompressed_size(path) for path in data_files(config, 'AIRPORTS'))
+    assert len(data_files(config, 'AIRPORTS')) == 2
+    config.set('ETL', 'DIRECT_LOAD_MB', str(size * 1.01 / 1024 ** 2))
+    assert loads_directly(config, 'AIRPORTS')
+    config.set('ETL', 'DIRECT_LOAD_MB', str(size * 0.99 / 1024 ** 2))
+    assert not loads_directly(config, 'AIRPORTS')
+    assert read_output_table(config, 'AIRPORTS').num_rows == len(airports)
+
+def test_temperatures_are_never_loaded_directly(make_config):
+    config = make_config({'WAREHOUSE': {'TYPE': 'redshift'}, 'ETL': {'DIRECT_LOAD_MB': 1024}})
+    assert not loads_directly(config, 'TEMPERATURES')
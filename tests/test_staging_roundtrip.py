@@ -0,0 +1,43 @@
+import pyarrow.parquet as pq
+import pytest
+from dataprep import write_output
+from staging_files import STAGING_SCHEMAS, data_files, read_output_table, read_staging_file
+from staging_data import STAGING_ROWS, staging_frame, write_partitioned_travelers
+
+OUTPUTS = [{'FORMAT': 'csv', 'SPLIT': 'false'}, {'FORMAT': 'csv', 'SPLIT': 'true'},
+           {'FORMAT': 'parquet', 'SPLIT': 'false'}, {'FORMAT': 'parquet', 'SPLIT': 'true'}]
+
+
+def with_null_row(key):
+    """
+    Returns the staging rows of a dataset followed by a row that is null in every column, as a dataframe and as the rows expected back
+    """
+    rows = STAGING_ROWS[key] + [(None,) * len(STAGING_SCHEMAS[key])]
+    return staging_frame(key, rows), [dict(zip(STAGING_SCHEMAS[key].names, row)) for row in rows]
+
+
+@pytest.mark.parametrize('key', ['CITIES', 'AIRPORTS', 'TEMPERATURES'])
+@pytest.mark.parametrize('output', OUTPUTS)
+def test_pandas_outputs_round_trip_with_staging_schema(make_config, key, output):
+    config = make_config({'OUTPUT': output})
+    frame, expected = with_null_row(key)
+    write_output(frame, config, key)
+
+    # Parquet files carry the staging column types themselves, while CSV gets them from the schema when read back
+    if output['FORMAT'] == 'parquet':
+        for path in data_files(config, key):
+            assert pq.read_schema(path).remove_metadata() == STAGING_SCHEMAS[key]
+    table = read_output_table(config, key)
+    assert table.schema == STAGING_SCHEMAS[key]
+    assert table.to_pylist() == expected
+
+
+@pytest.mark.parametrize('output', OUTPUTS)
+def test_travelers_partitions_round_trip_with_staging_schema(make_config, output):
+    config = make_config({'OUTPUT': output})
+    # The partition columns are kept so the null row is written to the April partition
+    rows = STAGING_ROWS['TRAVELERS'] + [(None, None, None, None, None, 2016, 4, None)]
+    partitions = write_partitioned_travelers(config, staging_frame('TRAVELERS', rows))
+    written = [row for partition in partitions for path in data_files(config, 'TRAVELERS', partition)
+               for row in read_staging_file(config, 'TRAVELERS', path).to_pylist()]
+    assert sorted(written, key=repr) == sorted((dict(zip(STAGING_SCHEMAS['TRAVELERS'].names, row)) for row in rows), key=repr)
@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+from dataprep import prep_temperature_data, write_output
+from staging_files import STAGING_SCHEMAS, data_files, read_staging_file
+from staging_data import staging_frame
+
+
+@pytest.mark.parametrize('split', ['false', 'true'])
+@pytest.mark.parametrize('chunksize', [0, 2])
+def test_temperature_stage_replaces_output_of_an_empty_input(make_config, generated_inputs, tmp_path, chunksize, split):
+    # A file with a header but no rows, so no chunk is ever read
+    path = tmp_path / 'temperatures.csv'
+    pd.DataFrame(columns=['dt', 'AverageTemperature', 'AverageTemperatureUncertainty', 'City', 'Country', 'Latitude', 'Longitude']).to_csv(path, index=False)
+    config = make_config({'INPUT': {'TEMPERATURES': str(path), 'TEMPERATURES_CHUNKSIZE': chunksize, 'AIRPORTS': generated_inputs['AIRPORTS']}, 'ENGINE': {'TEMPERATURES': 'pandas'},
+                          'OUTPUT': {'FORMAT': 'parquet', 'SPLIT': split}})
+    # A previous run left rows behind, which must not be loaded again as if they were current
+    write_output(staging_frame('TEMPERATURES'), config, 'TEMPERATURES')
+    prep_temperature_data(config)
+    # Split outputs are left with no parts at all, and a single file with a header and no rows
+    tables = [read_staging_file(config, 'TEMPERATURES', path) for path in data_files(config, 'TEMPERATURES')]
+    assert len(tables) == (0 if split == 'true' else 1)
+    assert all(table.num_rows == 0 and table.schema.names == STAGING_SCHEMAS['TEMPERATURES'].names for table in tables)
+
+def test_streaming_temperature_stage_replaces_output_when_no_chunk_is_read(make_config, monkeypatch):
+    import dataprep
+    config = make_config({'INPUT': {'TEMPERATURES_CHUNKSIZE': 2}, 'OUTPUT': {'FORMAT': 'csv', 'SPLIT': 'false'}})
+    write_output(staging_frame('TEMPERATURES'), config, 'TEMPERATURES')
+    monkeypatch.setattr(dataprep, 'read_temperature_chunks', lambda config, count_rows=False: iter(()))
+    dataprep.prep_temperature_data_streaming(config)
+    assert [read_staging_file(config, 'TEMPERATURES', path).num_rows for path in data_files(config, 'TEMPERATURES')] == [0]
@@ -0,0 +1,27 @@
+import datetime
+import pandas as pd
+from dataprep import INPUT_SCHEMAS, transform_airports, with_arrival_date_parts
+from benchmarks.transforms import arrival_dates, run_airports_benchmark, transform_airports_before, with_arrival_date_parts_udf
+
+
+def test_airports_transform_matches_row_by_row_baseline(generated_inputs):
+    before = transform_airports_before(pd.read_csv(generated_inputs['AIRPORTS']))
+    after = transform_airports(pd.read_csv(generated_inputs['AIRPORTS'], **INPUT_SCHEMAS['AIRPORTS'])).drop(columns='city_id')
+    assert len(after) > 1000
+    pd.testing.assert_frame_equal(after.sort_values('iata_code').reset_index(drop=True), before.sort_values('iata_code').reset_index(drop=True), check_dtype=False)
+
+def test_airports_benchmark_times_both_versions():
+    result = run_airports_benchmark(1000, 2)
+    assert result['rows'] == 55000 and len(result['before']) == len(result['after']) == 2
+
+
+def test_native_arrival_date_matches_udf(spark):
+    # Dates around the epoch, a leap day, a fractional value and a missing date, plus a generated spread of dates
+    epoch = datetime.date(1960, 1, 1)
+    dates = [None, 0.0, -1.0, float((datetime.date(2016, 2, 29) - epoch).days), 20574.6, float((datetime.date(2016, 12, 31) - epoch).days)]
+    sample = spark.createDataFrame([(i, date) for i, date in enumerate(dates)], 'id long, arrival_date double')\
+        .unionByName(arrival_dates(spark, 5000).selectExpr('id + 100 as id', 'arrival_date'))
+
+    native = sorted(map(tuple, with_arrival_date_parts(sample).collect()))
+    assert native == sorted(map(tuple, with_arrival_date_parts_udf(sample).collect()))
+    assert native[:6] == [(0, None, None, None), (1, 1960, 1, 1), (2, 1959, 12, 31), (3, 2016, 2, 29), (4, 2016, 4, 30), (5, 2016, 12, 31)]
@@ -0,0 +1,104 @@
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+# DuckDB databases opened by this process, shared between connections so that each one is a cursor on the same database
+DUCKDB_DATABASES = {}
+
+
+class DuckDBConnection:
+    """
+    Wraps a DuckDB cursor in the psycopg2 style used by the scripts, keeping a transaction open that commit and rollback
+    end and then restart
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.connection.begin()
+        self.rowcount = -1
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        self.connection.execute(query)
+
+        # DuckDB returns the rows affected by INSERT, UPDATE, DELETE and COPY as a Count result rather than a rowcount
+        self.rowcount = -1
+        description = self.connection.description
+        if not query.lstrip().lower().startswith(('select', 'with')) and description and [column[0] for column in description] == ['Count']:
+            row = self.connection.fetchone()
+            if row is not None:
+                self.rowcount = row[0]
+
+    def fetchone(self):
+        return self.connection.fetchone()
+
+    def fetchall(self):
+        return self.connection.fetchall()
+
+    def commit(self):
+        self.connection.commit()
+        self.connection.begin()
+
+    def rollback(self):
+        self.connection.rollback()
+        self.connection.begin()
+
+    def close(self):
+        self.connection.close()
+
+
+class DuckDBConnectionPool:
+    """
+    Hands out connections on a shared DuckDB database with the same interface as psycopg2's ThreadedConnectionPool
+    """
+    def __init__(self, config):
+        self.config = config
+
+    def getconn(self):
+        return connect(self.config)
+
+    def putconn(self, conn):
+        conn.close()
+
+    def closeall(self):
+        pass
+
+
+def warehouse_type(config):
+    """
+    Return the configured warehouse type, either redshift, postgres or duckdb
+    """
+    return config.get('WAREHOUSE', 'TYPE', fallback='redshift').lower()
+
+def cluster_dsn(config):
+    """
+    Build the psycopg2 connection string for a Redshift cluster or PostgreSQL stand-in from the CLUSTER section
+    """
+    return "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values())
+
+def duckdb_database(config):
+    """
+    Open the local DuckDB database file once per process
+    """
+    path = config['WAREHOUSE']['DATABASE']
+    if path not in DUCKDB_DATABASES:
+        # DuckDB is only needed when it is the configured warehouse
+        import duckdb
+        DUCKDB_DATABASES[path] = duckdb.connect(path)
+    return DUCKDB_DATABASES[path]
+
+def connect(config):
+    """
+    Connect to the configured warehouse
+    """
+    if warehouse_type(config) == 'duckdb':
+        return DuckDBConnection(duckdb_database(config).cursor())
+    return psycopg2.connect(cluster_dsn(config))
+
+def connection_pool(config, maxconn):
+    """
+    Create a pool of up to `maxconn` connections to the configured warehouse for running load steps at the same time
+    """
+    if warehouse_type(config) == 'duckdb':
+        return DuckDBConnectionPool(config)
+    return ThreadedConnectionPool(1, maxconn, cluster_dsn(config))